@@ -7,13 +7,27 @@ import uuid
 import traceback
 import random
 import os
-import requests
-from flask import Flask, render_template, request, jsonify, session
+import time
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
 from jinja2 import TemplateNotFound
 
-from config import LLM_CONFIG
+from config import LLM_CONFIG, env_bool
+from conversation_context import history_summarizer
+from evaluation_jobs import EvaluationJob, EvaluationQueueFull, evaluation_jobs
+from http_pool import pool_stats
+from incremental_evaluator import incremental_evaluator
+from llm_cache import llm_cache
+from llm_cassette import llm_cassette
+from llm_client import llm_client
+from llm_json import json_parse_stats
+from llm_scheduler import BUSY_REPLY, INTERACTIVE, PRIORITY_NAMES, LLMBusy, backend_group, llm_context, llm_scheduler
+from metrics import SERVER_TIMING, end_trace, http_seconds, metrics, server_timing, start_trace
+from model_availability import model_availability
+from opening_pool import opening_pool, warm_opening_pool
+from prompt_cache import prefix_cache_stats
+from response_schemas import structured_output
 from training_config import (
     find_by_id,
     get_evaluation_criteria as get_evaluation_criteria_config,
@@ -22,6 +36,7 @@ from training_config import (
     get_training_options,
     get_user_profiles,
 )
+from session_store import create_session_store
 from user_simulator import UserSimulator
 from evaluator import ConversationEvaluator
 
@@ -67,6 +82,30 @@ def handle_exception(e):
     }), 500
 
 
+@app.before_request
+def start_request_timing():
+    """记录请求开始时间，并开始收集本次请求内各阶段耗时（见 metrics.py）"""
+    g.request_started = time.perf_counter()
+    g.trace_token = start_trace()
+
+
+@app.after_request
+def finish_request_timing(response):
+    """按路由记录请求耗时；各阶段耗时通过 Server-Timing 响应头返回（流式响应只含返回响应头之前的阶段）"""
+    started = g.pop("request_started", None)
+    token = g.pop("trace_token", None)
+    if started is None or token is None:
+        return response
+    elapsed = time.perf_counter() - started
+    trace = end_trace(token)
+    if metrics.enabled:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        http_seconds.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = server_timing(trace, elapsed)
+    return response
+
+
 @app.errorhandler(500)
 def handle_500(e):
     """处理500错误"""
@@ -83,9 +122,6 @@ def handle_404(e):
         return jsonify({"error": "接口不存在"}), 404
     return render_template('index.html'), 404
 
-# 存储活跃的训练会话
-active_sessions = {}
-
 def _difficulty_level_from_threshold(trust_threshold: int) -> str:
     """
     难度用于“通关条件”分层，而不是评估维度分。
@@ -142,6 +178,47 @@ class TrainingSession:
         self.end_reason: str | None = None
         self.end_detail: dict = {}
         
+    def to_state(self) -> dict:
+        """导出可 JSON 序列化的完整会话状态（用于持久化会话存储）"""
+        return {
+            "session_id": self.session_id,
+            "profile": self.profile,
+            "scenario": self.scenario,
+            "mental_state": self.mental_state,
+            "goals_config": self.goals_config,
+            "difficulty_level": self.difficulty_level,
+            "effective_goals_config": self.effective_goals_config,
+            "simulator": self.simulator.to_state(),
+            "turn_count": self.turn_count,
+            "messages": self.messages,
+            "started": self.started,
+            "end_reason": self.end_reason,
+            "end_detail": self.end_detail,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "TrainingSession":
+        """由 to_state() 的结果恢复会话"""
+        obj = cls.__new__(cls)
+        obj.session_id = state["session_id"]
+        obj.profile = state["profile"]
+        obj.scenario = state.get("scenario")
+        obj.mental_state = state.get("mental_state")
+        obj.goals_config = state.get("goals_config") or get_goals_config()
+        obj.difficulty_level = state.get("difficulty_level") or _difficulty_level_from_threshold(
+            int(obj.profile.get("trust_threshold", 7) or 7)
+        )
+        obj.effective_goals_config = state.get("effective_goals_config") or _apply_success_overrides(
+            obj.goals_config, obj.difficulty_level
+        )
+        obj.simulator = UserSimulator.from_state(state["simulator"])
+        obj.turn_count = int(state.get("turn_count", 0))
+        obj.messages = list(state.get("messages") or [])
+        obj.started = bool(state.get("started", False))
+        obj.end_reason = state.get("end_reason")
+        obj.end_detail = state.get("end_detail") or {}
+        return obj
+        
     def to_dict(self):
         return {
             "session_id": self.session_id,
@@ -161,6 +238,13 @@ class TrainingSession:
         }
 
 
+# 存储活跃的训练会话（memory / sqlite，见 session_store.py）
+active_sessions = create_session_store(TrainingSession.to_state, TrainingSession.from_state)
+
+# 后台预生成开场白（见 opening_pool.py）
+warm_opening_pool()
+
+
 @app.route('/')
 def index():
     """首页"""
@@ -272,18 +356,24 @@ def start_session():
         
         # 创建新会话
         session_obj = TrainingSession(profile, scenario=selected_scenario, mental_state=selected_mental_state)
-        active_sessions[session_obj.session_id] = session_obj
         
-        # 生成用户开场白（带异常处理）
-        try:
-            opening = session_obj.simulator.get_opening_message()
-        except Exception as e:
-            print(f"[ERROR] 生成开场白失败: {str(e)}")
-            # 使用默认开场白
-            opening = {
-                "response": f"你好，我是{profile['name']}，{profile['trigger_scenario']}，但是我不太懂这些东西...",
-                "inner_thought": "希望能有人帮我解答疑惑"
-            }
+        # 优先使用预生成的开场白；池中没有时再现场生成（带异常处理）
+        opening = opening_pool.take(profile, selected_scenario, selected_mental_state)
+        if opening is not None:
+            session_obj.simulator.accept_opening(opening)
+        else:
+            busy = _llm_busy_response()
+            if busy is not None:
+                return busy
+            try:
+                opening = session_obj.simulator.get_opening_message()
+            except Exception as e:
+                print(f"[ERROR] 生成开场白失败: {str(e)}")
+                # 使用默认开场白
+                opening = {
+                    "response": f"你好，我是{profile['name']}，{profile['trigger_scenario']}，但是我不太懂这些东西...",
+                    "inner_thought": "希望能有人帮我解答疑惑"
+                }
         
         session_obj.messages.append({
             "role": "user",  # 这里user指的是模拟的小白用户
@@ -291,6 +381,7 @@ def start_session():
             "inner_thought": opening.get("inner_thought", "")
         })
         session_obj.started = True
+        active_sessions.save(session_obj)
         
         return jsonify({
             "session_id": session_obj.session_id,
@@ -307,19 +398,140 @@ def start_session():
         return jsonify({"error": f"启动会话失败: {str(e)}"}), 500
 
 
+def _default_user_reply() -> dict:
+    """LLM 调用异常时的兜底回复"""
+    return {
+        "response": "嗯...让我想想...",
+        "inner_thought": "（系统处理中）",
+        "trust_change": 0,
+        "concern_addressed": None,
+        "willing_to_continue": True,
+        "ready_to_open_account": False
+    }
+
+
+def _finish_chat_turn(session_obj: TrainingSession, response: dict) -> dict:
+    """记录用户回复、判定是否结束，并生成返回给前端的数据（chat / chat_stream 共用）"""
+    # 记录用户回复
+    session_obj.messages.append({
+        "role": "user",
+        "content": response["response"],
+        "inner_thought": response.get("inner_thought", ""),
+        "trust_change": response.get("trust_change", 0)
+    })
+    
+    # 检查会话状态
+    is_ended = False
+    end_reason = None
+    end_detail: dict = {}
+    
+    if session_obj.simulator.is_convinced:
+        is_ended = True
+        end_reason = "success"
+    elif not response.get("willing_to_continue", True):
+        is_ended = True
+        end_reason = "user_quit"
+        # 透传更具体的“失去兴趣原因”
+        qr = response.get("quit_reason")
+        qe = response.get("quit_explanation")
+        if qr:
+            end_detail["quit_reason"] = qr
+        if qe:
+            end_detail["quit_explanation"] = qe
+        end_detail["final_trust"] = session_obj.simulator.trust_level
+        end_detail["last_trust_change"] = response.get("trust_change", 0)
+        end_detail["turn"] = session_obj.turn_count
+    else:
+        # 1) 信任度满分：直接结算（视为训练目标达成的一种）
+        if int(session_obj.simulator.trust_level) >= 10:
+            is_ended = True
+            end_reason = "trust_full"
+            end_detail["final_trust"] = session_obj.simulator.trust_level
+            end_detail["turn"] = session_obj.turn_count
+
+        # 2) 顾虑全部解答：直接结算（视为训练目标达成的一种）
+        if not is_ended:
+            try:
+                total_concerns = len(session_obj.profile.get("pain_points") or [])
+            except Exception:
+                total_concerns = 0
+            addressed = len(session_obj.simulator.concerns_addressed or [])
+            if total_concerns > 0 and addressed >= total_concerns:
+                is_ended = True
+                end_reason = "concerns_full"
+                end_detail["concerns_addressed"] = addressed
+                end_detail["total_concerns"] = total_concerns
+                end_detail["turn"] = session_obj.turn_count
+
+        max_turns = (get_goals_config().get("end_conditions") or {}).get("max_turns", 20)
+        if session_obj.turn_count >= int(max_turns):
+            is_ended = True
+            end_reason = "max_turns"
+            end_detail["turn"] = session_obj.turn_count
+
+    if is_ended:
+        session_obj.end_reason = end_reason
+        session_obj.end_detail = end_detail
+    
+    return {
+        "response": response["response"],
+        "inner_thought": response.get("inner_thought", ""),
+        "trust_change": response.get("trust_change", 0),
+        "concern_addressed": response.get("concern_addressed"),
+        "is_ended": is_ended,
+        "end_reason": end_reason,
+        "end_detail": end_detail,
+        "status": session_obj.to_dict()
+    }
+
+
+def _submit_turn_score(session_obj: TrainingSession, pm_message: str, response: dict) -> None:
+    """在后台为刚结束的这一轮 PM 发言打分（见 incremental_evaluator.py）"""
+    # messages 末尾依次为：上一句用户发言、本轮 PM 发言、本轮用户回复
+    previous = session_obj.messages[-3] if len(session_obj.messages) >= 3 else {}
+    incremental_evaluator.submit_turn(
+        session_obj.session_id,
+        session_obj.turn_count,
+        session_obj.profile,
+        pm_message,
+        previous.get("content", "") if previous.get("role") == "user" else "",
+        response,
+    )
+
+
+def _llm_busy_response(force: bool = False):
+    """
+    LLM 调度排队已满时的快速“繁忙”响应（503 + Retry-After），在修改会话状态之前调用；
+    未满时返回 None。force=True 用于请求已在排队中超时的情况
+    """
+    if not force and not llm_scheduler.overloaded(backend_group(llm_client.primary_backend())):
+        return None
+    resp = jsonify({"error": BUSY_REPLY.strip("[]"), "busy": True})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
+def _sse(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.route('/api/session/<session_id>/chat', methods=['POST'])
 def chat(session_id):
     """发送消息"""
     try:
-        if session_id not in active_sessions:
+        session_obj = active_sessions.get(session_id)
+        if session_obj is None:
             return jsonify({"error": "会话不存在"}), 404
-        
-        session_obj = active_sessions[session_id]
         data = request.json
         pm_message = data.get('message', '').strip()
         
         if not pm_message:
             return jsonify({"error": "消息不能为空"}), 400
+        busy = _llm_busy_response()
+        if busy is not None:
+            return busy
         
         # 记录PM的消息
         session_obj.messages.append({
@@ -330,170 +542,337 @@ def chat(session_id):
         
         # 获取用户回复（带异常处理）
         try:
-            response = session_obj.simulator.respond(pm_message)
+            with llm_context(INTERACTIVE, session_id):
+                response = session_obj.simulator.respond(pm_message)
+        except LLMBusy:
+            # 排队超时：本轮未被处理，撤销后让前端稍后重发
+            _rollback_pm_turn(session_obj)
+            return _llm_busy_response(force=True)
         except Exception as e:
             print(f"[ERROR] 获取用户回复失败: {str(e)}")
             # 返回默认回复
-            response = {
-                "response": "嗯...让我想想...",
-                "inner_thought": "（系统处理中）",
-                "trust_change": 0,
-                "concern_addressed": None,
-                "willing_to_continue": True,
-                "ready_to_open_account": False
-            }
-        
-        # 记录用户回复
-        session_obj.messages.append({
-            "role": "user",
-            "content": response["response"],
-            "inner_thought": response.get("inner_thought", ""),
-            "trust_change": response.get("trust_change", 0)
-        })
-        
-        # 检查会话状态
-        is_ended = False
-        end_reason = None
-        end_detail: dict = {}
+            response = _default_user_reply()
         
-        if session_obj.simulator.is_convinced:
-            is_ended = True
-            end_reason = "success"
-        elif not response.get("willing_to_continue", True):
-            is_ended = True
-            end_reason = "user_quit"
-            # 透传更具体的“失去兴趣原因”
-            qr = response.get("quit_reason")
-            qe = response.get("quit_explanation")
-            if qr:
-                end_detail["quit_reason"] = qr
-            if qe:
-                end_detail["quit_explanation"] = qe
-            end_detail["final_trust"] = session_obj.simulator.trust_level
-            end_detail["last_trust_change"] = response.get("trust_change", 0)
-            end_detail["turn"] = session_obj.turn_count
-        else:
-            # 1) 信任度满分：直接结算（视为训练目标达成的一种）
-            if int(session_obj.simulator.trust_level) >= 10:
-                is_ended = True
-                end_reason = "trust_full"
-                end_detail["final_trust"] = session_obj.simulator.trust_level
-                end_detail["turn"] = session_obj.turn_count
-
-            # 2) 顾虑全部解答：直接结算（视为训练目标达成的一种）
-            if not is_ended:
-                try:
-                    total_concerns = len(session_obj.profile.get("pain_points") or [])
-                except Exception:
-                    total_concerns = 0
-                addressed = len(session_obj.simulator.concerns_addressed or [])
-                if total_concerns > 0 and addressed >= total_concerns:
-                    is_ended = True
-                    end_reason = "concerns_full"
-                    end_detail["concerns_addressed"] = addressed
-                    end_detail["total_concerns"] = total_concerns
-                    end_detail["turn"] = session_obj.turn_count
-
-            max_turns = (get_goals_config().get("end_conditions") or {}).get("max_turns", 20)
-            if session_obj.turn_count >= int(max_turns):
-                is_ended = True
-                end_reason = "max_turns"
-                end_detail["turn"] = session_obj.turn_count
-
-        if is_ended:
-            session_obj.end_reason = end_reason
-            session_obj.end_detail = end_detail
-        
-        return jsonify({
-            "response": response["response"],
-            "inner_thought": response.get("inner_thought", ""),
-            "trust_change": response.get("trust_change", 0),
-            "concern_addressed": response.get("concern_addressed"),
-            "is_ended": is_ended,
-            "end_reason": end_reason,
-            "end_detail": end_detail,
-            "status": session_obj.to_dict()
-        })
+        result = _finish_chat_turn(session_obj, response)
+        active_sessions.save(session_obj)
+        _submit_turn_score(session_obj, pm_message, response)
+        _start_speculative_evaluation(session_obj, result)
+        return jsonify(result)
     except Exception as e:
         print(f"[ERROR] chat异常: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": f"对话处理失败: {str(e)}"}), 500
 
 
-@app.route('/api/session/<session_id>/evaluate', methods=['POST'])
-def evaluate(session_id):
-    """评估训练结果"""
-    try:
-        if session_id not in active_sessions:
-            return jsonify({"error": "会话不存在"}), 404
-        
-        session_obj = active_sessions[session_id]
-        evaluator = ConversationEvaluator(
-            criteria=get_evaluation_criteria_config(),
-            scoring_rules=get_scoring_rules(),
-            goals_config=getattr(session_obj, "effective_goals_config", None) or get_goals_config(),
-        )
-        
+@app.route('/api/session/<session_id>/chat/stream', methods=['POST'])
+def chat_stream(session_id):
+    """
+    发送消息（流式）：以 SSE 返回
+    - event: delta  data: {"text": "..."}   用户回复的增量文本
+    - event: done   data: 与 /chat 返回体一致
+    """
+    session_obj = active_sessions.get(session_id)
+    if session_obj is None:
+        return jsonify({"error": "会话不存在"}), 404
+    data = request.json or {}
+    pm_message = (data.get('message') or '').strip()
+
+    if not pm_message:
+        return jsonify({"error": "消息不能为空"}), 400
+    busy = _llm_busy_response()
+    if busy is not None:
+        return busy
+
+    def generate():
+        # 在生成器内记录 PM 消息：客户端在开始读取前断开时不会留下半轮
+        session_obj.messages.append({
+            "role": "pm",
+            "content": pm_message
+        })
+        session_obj.turn_count += 1
+        response = None
         try:
-            evaluation = evaluator.evaluate(
-                session_obj.simulator.conversation_history,
-                session_obj.profile,
-                session_obj.simulator.trust_level,
-                session_obj.simulator.is_convinced,
-                session_obj.simulator.concerns_addressed,
-                session_obj.turn_count,
-                scenario=session_obj.scenario,
-                mental_state=session_obj.mental_state,
-                end_reason=session_obj.end_reason,
-                end_detail=session_obj.end_detail,
-            )
+            with llm_context(INTERACTIVE, session_id):
+                for kind, value in session_obj.simulator.respond_stream(pm_message):
+                    if kind == "delta":
+                        yield _sse("delta", {"text": value})
+                    else:
+                        response = value
+        except LLMBusy:
+            yield _sse("error", {"error": BUSY_REPLY.strip("[]"), "busy": True})
+            return
+        except Exception as e:
+            print(f"[ERROR] 流式获取用户回复失败: {str(e)}")
+            traceback.print_exc()
+            response = _default_user_reply()
+        finally:
+            # 繁忙或客户端中途断开（GeneratorExit）：回复未生成，撤销本轮，避免下一轮出现连续两条 PM 消息
+            if response is None:
+                _rollback_pm_turn(session_obj)
+        if response is None:
+            yield _sse("error", {"error": "对话处理失败: 未获取到用户回复"})
+            return
+
+        try:
+            result = _finish_chat_turn(session_obj, response)
+            active_sessions.save(session_obj)
+            _submit_turn_score(session_obj, pm_message, response)
+            _start_speculative_evaluation(session_obj, result)
+            yield _sse("done", result)
+        except Exception as e:
+            print(f"[ERROR] chat_stream异常: {str(e)}")
+            traceback.print_exc()
+            yield _sse("error", {"error": f"对话处理失败: {str(e)}"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _rollback_pm_turn(session_obj: TrainingSession) -> None:
+    """撤销尚未得到回复的一轮：前端消息、轮次计数与模拟器中记录的 PM 消息"""
+    if session_obj.messages and session_obj.messages[-1].get("role") == "pm":
+        session_obj.messages.pop()
+        session_obj.turn_count -= 1
+    session_obj.simulator.rollback_turn()
+
+
+def _default_evaluation() -> dict:
+    """评估异常时的兜底结果"""
+    return {
+        "scores": {"communication_skills": 60, "empathy": 60, "problem_solving": 60, "persuasion": 60, "professionalism": 60},
+        "total_score": 60,
+        "highlights": ["完成了训练对话"],
+        "improvements": ["继续练习以提升表现"],
+        "key_insights": "持续练习可以提升用户感知能力",
+        "overall_comment": "继续加油！"
+    }
+
+
+def _session_stats(session_obj: TrainingSession) -> dict:
+    """评估结果中附带的会话统计"""
+    return {
+        "turn_count": session_obj.turn_count,
+        "final_trust": session_obj.simulator.trust_level,
+        "trust_threshold": session_obj.profile["trust_threshold"],
+        "is_convinced": session_obj.simulator.is_convinced,
+        "concerns_addressed": len(session_obj.simulator.concerns_addressed),
+        "total_concerns": len(session_obj.profile["pain_points"]),
+        "end_reason": session_obj.end_reason,
+        "end_detail": session_obj.end_detail,
+    }
+
+
+def _submit_evaluation(session_obj: TrainingSession) -> EvaluationJob:
+    """
+    提交后台评估任务：立即计算规则分作为 preview，LLM 评语在评估线程中生成
+
+    任务只使用提交时的会话快照，之后会话对象的变化不影响评估
+    """
+    evaluator = ConversationEvaluator(
+        criteria=get_evaluation_criteria_config(),
+        scoring_rules=get_scoring_rules(),
+        goals_config=getattr(session_obj, "effective_goals_config", None) or get_goals_config(),
+    )
+    simulator = session_obj.simulator
+    args = (
+        list(simulator.conversation_history),
+        session_obj.profile,
+        simulator.trust_level,
+        simulator.is_convinced,
+        list(simulator.concerns_addressed),
+        session_obj.turn_count,
+    )
+    kwargs = {"end_reason": session_obj.end_reason, "end_detail": dict(session_obj.end_detail or {})}
+    stats = _session_stats(session_obj)
+
+    def run() -> dict:
+        try:
+            # 逐轮打分齐全时只需做一次简短总结；否则回退为整段对话评估
+            turn_scores = incremental_evaluator.collect(session_obj.session_id, session_obj.turn_count)
+            if turn_scores:
+                evaluation = evaluator.evaluate_incremental(
+                    *args, turn_scores=turn_scores,
+                    scenario=session_obj.scenario, mental_state=session_obj.mental_state, **kwargs
+                )
+            else:
+                evaluation = evaluator.evaluate(
+                    *args, scenario=session_obj.scenario, mental_state=session_obj.mental_state, **kwargs
+                )
         except Exception as e:
             print(f"[ERROR] 评估失败: {str(e)}")
             # 返回默认评估
-            evaluation = {
-                "scores": {"communication_skills": 60, "empathy": 60, "problem_solving": 60, "persuasion": 60, "professionalism": 60},
-                "total_score": 60,
-                "highlights": ["完成了训练对话"],
-                "improvements": ["继续练习以提升表现"],
-                "key_insights": "持续练习可以提升用户感知能力",
-                "overall_comment": "继续加油！"
-            }
-        
+            evaluation = _default_evaluation()
         # 添加会话统计
-        evaluation["stats"] = {
-            "turn_count": session_obj.turn_count,
-            "final_trust": session_obj.simulator.trust_level,
-            "trust_threshold": session_obj.profile["trust_threshold"],
-            "is_convinced": session_obj.simulator.is_convinced,
-            "concerns_addressed": len(session_obj.simulator.concerns_addressed),
-            "total_concerns": len(session_obj.profile["pain_points"]),
-            "end_reason": session_obj.end_reason,
-            "end_detail": session_obj.end_detail,
-        }
-        
-        return jsonify(evaluation)
+        evaluation["stats"] = stats
+        return evaluation
+
+    preview = evaluator.rule_based_preview(*args, **kwargs)
+    preview["stats"] = stats
+    # 对话状态不变时复用已有任务（如最后一轮对话时已投机提交的评估）
+    fingerprint = f"{session_obj.turn_count}|{len(args[0])}|{session_obj.end_reason}"
+    return evaluation_jobs.submit(session_obj.session_id, run, preview, fingerprint=fingerprint)
+
+
+def _start_speculative_evaluation(session_obj: TrainingSession, result: dict) -> None:
+    """对话在本轮结束时立即提交评估任务，前端进入结果页时评估已在进行（或已完成）"""
+    if not result.get("is_ended") or not env_bool("PMTRAINER_EVAL_SPECULATIVE", True):
+        return
+    try:
+        job = _submit_evaluation(session_obj)
+        result["evaluation_job_id"] = job.job_id
+    except Exception as e:
+        # 投机评估失败不影响本轮对话，前端之后显式请求时会重新提交
+        print(f"[EVAL] 投机评估提交失败: {type(e).__name__}: {e}")
+
+
+@app.route('/api/session/<session_id>/evaluate', methods=['POST'])
+def evaluate(session_id):
+    """评估训练结果（等待后台评估任务完成后返回完整结果）"""
+    try:
+        session_obj = active_sessions.get(session_id)
+        if session_obj is None:
+            return jsonify({"error": "会话不存在"}), 404
+
+        job = _submit_evaluation(session_obj)
+        job.future.result()
+        if job.result is None:
+            return jsonify({"error": f"评估处理失败: {job.error}"}), 500
+        return jsonify(job.result)
+    except EvaluationQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"[ERROR] evaluate异常: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": f"评估处理失败: {str(e)}"}), 500
 
 
+@app.route('/api/session/<session_id>/evaluation-jobs', methods=['POST'])
+def create_evaluation_job(session_id):
+    """提交后台评估任务，立即返回 job_id 与规则分 preview（202）"""
+    session_obj = active_sessions.get(session_id)
+    if session_obj is None:
+        return jsonify({"error": "会话不存在"}), 404
+    try:
+        job = _submit_evaluation(session_obj)
+    except EvaluationQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/session/<session_id>/turn-scores')
+def get_turn_scores(session_id):
+    """逐轮评估分数（对话进行中即可查询，用于绘制分数曲线）"""
+    return jsonify({
+        "session_id": session_id,
+        "turn_scores": incremental_evaluator.turn_scores(session_id),
+    })
+
+
+@app.route('/api/evaluation-jobs/<job_id>')
+def get_evaluation_job(job_id):
+    """轮询评估任务状态；status=done 时 result 为完整评估结果"""
+    job = evaluation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "评估任务不存在"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/evaluation-jobs/<job_id>/events')
+def evaluation_job_events(job_id):
+    """
+    以 SSE 推送评估任务进度：
+    - event: preview  规则分（立即发送）
+    - event: done     完整评估结果
+    - event: error    评估失败
+    """
+    job = evaluation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "评估任务不存在"}), 404
+
+    def generate():
+        yield _sse("preview", job.preview)
+        # 定期发送注释行保持连接（避免代理因空闲断开）
+        while not job.wait(15):
+            yield ": keep-alive\n\n"
+        if job.result is not None:
+            yield _sse("done", job.result)
+        else:
+            yield _sse("error", {"error": job.error or "评估处理失败"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route('/api/session/<session_id>/status')
 def get_status(session_id):
     """获取会话状态"""
-    if session_id not in active_sessions:
+    session_obj = active_sessions.get(session_id)
+    if session_obj is None:
         return jsonify({"error": "会话不存在"}), 404
-    
-    session_obj = active_sessions[session_id]
     return jsonify(session_obj.to_dict())
 
 
+@app.route('/api/sessions/stats')
+def get_sessions_stats():
+    """会话存储统计：存活会话数、估算占用字节数、淘汰次数；以及开场白预生成池、评估任务状态"""
+    return jsonify({
+        **active_sessions.stats(),
+        "opening_pool": opening_pool.stats(),
+        "evaluation_jobs": evaluation_jobs.stats(),
+        "turn_evaluation": incremental_evaluator.stats(),
+    })
+
+
 @app.route('/api/evaluation-criteria')
 def get_evaluation_criteria_api():
     """获取评估标准"""
     return jsonify(get_evaluation_criteria_config())
 
 
+def _collect_metrics():
+    """把已有的诊断统计（JSON 解析、回复缓存、调度队列）转换为 /metrics 指标"""
+    parse_samples = []
+    for source, summary in json_parse_stats.stats()["by_source"].items():
+        for status in ("clean", "repaired", "failed"):
+            parse_samples.append(({"source": source, "status": status}, summary.get(status, 0)))
+    yield "pmtrainer_json_parse_total", "counter", "LLM 回复 JSON 解析次数（clean / repaired / failed）", parse_samples
+
+    cache_samples = []
+    for site, counts in llm_cache.stats()["by_site"].items():
+        cache_samples.append(({"site": site, "result": "hit"}, counts.get("hits", 0)))
+        cache_samples.append(({"site": site, "result": "miss"}, counts.get("misses", 0)))
+    yield "pmtrainer_llm_cache_lookups_total", "counter", "回复缓存查询次数（按调用方）", cache_samples
+
+    groups = llm_scheduler.stats()["groups"]
+    yield "pmtrainer_llm_scheduler_active", "gauge", "各后端正在进行的 LLM 请求数", [
+        ({"group": name}, group["active"]) for name, group in groups.items()
+    ]
+    yield "pmtrainer_llm_scheduler_queued", "gauge", "各后端排队中的 LLM 请求数", [
+        ({"group": name, "priority": priority}, group["queued"].get(priority, 0))
+        for name, group in groups.items() for priority in PRIORITY_NAMES.values()
+    ]
+    yield "pmtrainer_llm_scheduler_rejected_total", "counter", "排队已满或超时被拒绝的 LLM 请求数", [
+        ({"group": name, "reason": "queue_full"}, group["rejected"]) for name, group in groups.items()
+    ] + [
+        ({"group": name, "reason": "timeout"}, group["timeouts"]) for name, group in groups.items()
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的指标：各阶段耗时（按 backend / model / endpoint）、LLM 请求数、接口耗时等"""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.route('/api/llm/status')
 def llm_status():
     """
@@ -505,17 +884,11 @@ def llm_status():
     remote_model = (LLM_CONFIG.get("model") or "").strip()
     remote_key = (LLM_CONFIG.get("api_key") or "").strip()
 
-    ollama_base = (os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434").rstrip("/")
-    ollama_model = (os.getenv("OLLAMA_MODEL") or "qwen2.5:7b-instruct").strip()
-    ollama_reachable = False
-    ollama_err = ""
-    try:
-        r = requests.get(f"{ollama_base}/api/tags", timeout=2)
-        ollama_reachable = (r.status_code == 200)
-        if not ollama_reachable:
-            ollama_err = f"HTTP {r.status_code}"
-    except Exception as e:
-        ollama_err = f"{type(e).__name__}: {e}"
+    ollama_base = llm_client._ollama_base_url()
+    ollama_model = llm_client._ollama_model()
+    # 与对话兜底路径共用模型可用性缓存；?refresh=1 强制重新探测
+    force_refresh = (request.args.get("refresh") or "").strip() in ("1", "true")
+    ollama_reachable, ollama_models, ollama_err = llm_client._ollama_tags(force_refresh=force_refresh)
 
     return jsonify({
         "remote": {
@@ -527,11 +900,23 @@ def llm_status():
             "base_url": ollama_base,
             "model": ollama_model,
             "reachable": ollama_reachable,
+            "model_ready": ollama_model in ollama_models,
             "error": ollama_err if not ollama_reachable else "",
+            "tags_cache": model_availability.stats(),
         },
+        "pools": pool_stats(),
+        "breakers": llm_client.breaker_stats(),
+        "endpoints": llm_client.endpoint_stats(),
+        "prompt_cache": prefix_cache_stats.stats(),
+        "history_summary": history_summarizer.stats(),
+        "json_parse": json_parse_stats.stats(),
+        "structured_output": structured_output.stats(),
+        "response_cache": llm_cache.stats(),
+        "cassette": llm_cassette.stats(),
+        "scheduler": llm_scheduler.stats(),
     })
 
 
 if __name__ == '__main__':
-    # use_reloader=False 避免热重载导致会话丢失
+    # use_reloader=False 避免热重载导致会话丢失（memory 会话存储时）
     app.run(debug=True, host='0.0.0.0', port=8080, use_reloader=False)
@@ -0,0 +1,230 @@
+"""
+异步 LLM API 客户端（asyncio + httpx）
+
+与 LLMClient 共用同一套后端路由（远程优先、本地 Ollama 兜底）、错误提示与响应解析，
+只把 I/O 换成 httpx.AsyncClient：等待模型生成期间不占用线程，供 asyncio 程序（脚本、压测工具、
+将来的 ASGI 服务）在一个线程里同时发起大量 LLM 请求。app.py 是 WSGI 应用，Flask 的 async 视图
+仍然每个请求占用一个线程，因此视图使用同步的 LLMClient。
+
+每次 asyncio.run() 都会新建事件循环，若在其中直接创建 httpx 客户端，连接池会随循环结束而销毁。
+因此 LLM 协程统一提交到一个常驻后台事件循环执行（run_on_llm_loop），长连接可以跨调用复用。
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Awaitable
+
+import httpx
+
+from config import env_int
+from llm_cache import cache_key, llm_cache
+from llm_cassette import llm_cassette
+from llm_client import LLMClient
+from llm_scheduler import BUSY_REPLY, LLMBusy, SlotHolder, bind_context, llm_scheduler
+from metrics import bind_trace, observe_stage, span, stage_labels, timed
+from model_availability import model_availability
+from prompt_cache import prefix_cache_stats
+
+
+# httpcore 追踪事件 -> 阶段名（新建连接时才会触发）
+_TRACE_STAGES = {
+    "connection.connect_tcp": "llm.connect",
+    "connection.start_tls": "llm.tls",
+}
+
+
+def _connection_tracer():
+    """每个请求一个 httpx trace 回调：记录建连（DNS + TCP）与 TLS 握手耗时"""
+    started: dict[str, float] = {}
+
+    async def trace(event_name: str, info: dict) -> None:
+        name, _, phase = event_name.rpartition(".")
+        stage = _TRACE_STAGES.get(name)
+        if stage is None:
+            return
+        if phase == "started":
+            started[name] = time.perf_counter()
+        elif phase in ("complete", "failed") and name in started:
+            observe_stage(stage, time.perf_counter() - started.pop(name))
+
+    return trace
+
+
+class AsyncLLMClient(LLMClient):
+    """LLMClient 的 asyncio 版本：chat() 为协程"""
+
+    def __init__(self):
+        super().__init__()
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def _client(self, backend: str) -> httpx.AsyncClient:
+        # 与同步连接池一致：每个后端一个长连接池（需在常驻事件循环中使用）
+        client = self._clients.get(backend)
+        if client is None:
+            maxsize = env_int(f"LLM_HTTP_POOL_MAXSIZE_{backend.upper()}", env_int("LLM_HTTP_POOL_MAXSIZE", 16))
+            retries = env_int(f"LLM_HTTP_RETRIES_{backend.upper()}", env_int("LLM_HTTP_RETRIES", 2))
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=maxsize),
+                transport=httpx.AsyncHTTPTransport(retries=retries),
+            )
+            self._clients[backend] = client
+        return client
+
+    async def _ollama_tags_async(self) -> tuple[bool, set[str], str]:
+        # 与同步客户端共用模型可用性缓存
+        base = self._ollama_base_url()
+        cached = model_availability.peek(base, self._ollama_model())
+        if cached is not None:
+            return cached
+        try:
+            r = await self._client("ollama_native").get(f"{base.rstrip('/')}/api/tags", timeout=2)
+            result = self._parse_tags_response(r)
+        except Exception as e:
+            result = (False, set(), f"{type(e).__name__}: {e}")
+        model_availability.store(base, result)
+        return result
+
+    async def _open_response_async(self, messages: list, temperature: float, max_tokens: int, timeout: int,
+                                   model: str | None = None, schema: dict | None = None,
+                                   slot: SlotHolder | None = None):
+        """异步驱动 _route，返回 (response, used_backend, error_text)；slot 的含义同 _open_response"""
+        route = self._route(messages, temperature, max_tokens, model=model, schema=schema)
+        try:
+            step = next(route)
+            while step[0] != "result":
+                if step[0] == "tags":
+                    with span("llm.tags", backend="ollama_native"):
+                        outcome: Any = await self._ollama_tags_async()
+                else:
+                    _, backend, endpoint, headers, payload = step
+                    with stage_labels(backend=backend, model=payload.get("model"), endpoint=endpoint):
+                        if slot is not None:
+                            with span("llm.queue_wait"):
+                                await slot.switch_async(backend)
+                        started = time.perf_counter()
+                        try:
+                            outcome = await self._client(backend).post(
+                                endpoint,
+                                headers=headers,
+                                json=payload,
+                                timeout=float(timeout),
+                                extensions={"trace": _connection_tracer()},
+                            )
+                        except httpx.HTTPError as e:
+                            outcome = e
+                        self._record_request(outcome, time.perf_counter() - started)
+                step = route.send(outcome)
+        finally:
+            route.close()
+        _, response, used_backend, error_text = step
+        return response, used_backend, error_text
+
+    @timed("llm.chat")
+    async def chat(self, messages: list, temperature: float = 0.8, max_tokens: int = 2000, timeout: int = 300,
+                   model: str | None = None, schema: dict | None = None, cache: str | None = None) -> str:
+        """
+        异步调用LLM进行对话（参数与语义同 LLMClient.chat，出错时返回 "[...]" 提示）
+        """
+        key, cached = self._cache_lookup(cache, messages, model, temperature, max_tokens, schema)
+        if cached is not None:
+            return self._record_call("cache", cached)
+        tape_key = None
+        if llm_cassette.enabled:
+            tape_key = cache_key(messages, self._request_model(model), temperature, max_tokens, schema)
+            replayed, delay = llm_cassette.lookup(tape_key)
+            if replayed is not None:
+                await asyncio.sleep(delay)
+                return self._record_call("cassette", replayed)
+
+        started = time.monotonic()
+        content = await self._chat_async(messages, temperature, max_tokens, timeout, model, schema)
+        if tape_key is not None:
+            llm_cassette.record(tape_key, self._request_model(model), content, time.monotonic() - started)
+        if key is not None:
+            llm_cache.store(cache, key, content)
+        return self._record_call("backend", content)
+
+    async def _chat_async(self, messages: list, temperature: float, max_tokens: int, timeout: int,
+                          model: str | None, schema: dict | None) -> str:
+        """实际发起一次异步调用（不经过缓存/录制回放）"""
+        slot = SlotHolder(llm_scheduler)
+        try:
+            print(f"[LLM] 模型: {model or self.model}（异步）")
+            print(f"[LLM] 消息数量: {len(messages)}")
+
+            response, used_backend, error_text = await self._open_response_async(
+                messages, temperature, max_tokens, timeout, model=model, schema=schema, slot=slot
+            )
+            if error_text:
+                return error_text
+
+            print(f"[LLM] 响应状态码: {response.status_code}")
+
+            if response.status_code != 200:
+                return self._http_error_message(response, used_backend, messages, temperature)
+
+            result = response.json()
+
+            if used_backend in ("ollama_native",):
+                content = self._extract_ollama_content(result)
+            else:
+                content = self._extract_openai_content(result)
+                prefix_cache_stats.record_usage(result.get("usage") if isinstance(result, dict) else None)
+
+            if not content:
+                print(f"[LLM] 响应格式异常: {json.dumps(result, ensure_ascii=False)[:500]}")
+                return "[API返回格式异常]"
+
+            print(f"[LLM] 成功获取回复，长度: {len(content)}")
+            return content
+
+        except httpx.TimeoutException:
+            print("[LLM] 请求超时")
+            return "[API请求超时，请重试]"
+        except httpx.ConnectError as e:
+            print(f"[LLM] 连接错误: {str(e)}")
+            return f"[无法连接到API服务器: {self.url}]"
+        except httpx.HTTPError as e:
+            print(f"[LLM] 请求异常: {str(e)}")
+            return f"[API调用失败: {str(e)}]"
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            print(f"[LLM] 解析错误: {str(e)}")
+            return f"[解析响应失败: {str(e)}]"
+        except LLMBusy as e:
+            print(f"[LLM] 调度繁忙: {e}")
+            return BUSY_REPLY
+        finally:
+            slot.release()
+
+    async def aclose(self) -> None:
+        for client in list(self._clients.values()):
+            await client.aclose()
+        self._clients.clear()
+
+
+_LOOP: asyncio.AbstractEventLoop | None = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _llm_loop() -> asyncio.AbstractEventLoop:
+    """常驻后台事件循环（守护线程），承载所有异步 LLM 请求"""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+            _LOOP = loop
+        return _LOOP
+
+
+async def run_on_llm_loop(coro: Awaitable):
+    """在常驻事件循环中执行协程，并在当前事件循环中等待其结果（带上当前的调度优先级/会话与请求追踪）"""
+    loop = _llm_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(bind_context(bind_trace(coro)), loop))
+
+
+# 全局异步客户端实例
+async_llm_client = AsyncLLMClient()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+批量评估（离线重新评分已归档的对话）
+
+修改 scoring_rules / evaluation_criteria 后，需要对成千上万条历史对话重新评分，
+而 ConversationEvaluator.evaluate 一次只评一个会话。这里提供批量入口：
+- 输入为 JSON Lines，每行一个会话，支持两种格式：
+  - 扁平记录: {"session_id", "profile" 或 "profile_id", "conversation_history", "final_trust_level",
+               "is_convinced", "concerns_addressed", "turn_count", "scenario", "mental_state", "end_reason", "end_detail"}
+  - 会话状态: TrainingSession.to_state() 的结果（如从 sessions.db 导出的 state 列）
+- 规则分（_compute_rule_based_score，纯 CPU）在进程池中计算，不受 GIL 限制
+- LLM 评语在线程池中并发请求，并发数由 --concurrency 限制；请求以 evaluation 优先级进入 LLM 调度器，
+  与线上对话共用后端时不会挤占对话请求
+- 每评完一条追加写入检查点（JSON Lines），中断后重新运行会跳过已完成的会话；
+  检查点记录评分配置的指纹，评分规则变化后旧结果不会被复用；LLM 评语失败的会话在下次运行时重试
+- 全部完成后把结果写成列式文件：.parquet（需要安装 pyarrow）或 .csv
+
+用法：
+    python batch_evaluate.py transcripts.jsonl -o results.parquet
+    python batch_evaluate.py transcripts.jsonl -o results.csv --concurrency 8 --workers 4
+    python batch_evaluate.py transcripts.jsonl -o results.csv --no-llm      # 只重算规则分
+
+环境变量：
+- PMTRAINER_BATCH_CONCURRENCY: 默认的 LLM 并发数（默认 4）
+- PMTRAINER_BATCH_WORKERS:     默认的规则分进程数（默认 CPU 核数）
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Iterator
+
+from config import env_int
+from evaluator import ConversationEvaluator, calculate_weighted_score
+from llm_client import llm_client
+from llm_scheduler import EVALUATION, llm_context
+from response_schemas import DIMENSIONS, EVALUATION_REPORT
+from training_config import get_evaluation_criteria, get_goals_config, get_scoring_rules, get_user_profiles
+
+
+# 结果文件的列（维度分展开为 score_<维度>，列表/字典类字段以 JSON 字符串保存）
+COLUMNS = [
+    "session_id", "profile_id", "profile_name", "scenario_id", "mental_state_id",
+    "turn_count", "final_trust_level", "is_convinced", "concerns_addressed", "end_reason",
+    "total_score", "raw_score", "max_total_score", "llm_weighted_score",
+    *[f"score_{key}" for key in DIMENSIONS],
+    "llm_status", "highlights", "improvements", "key_insights", "overall_comment", "end_explanation",
+    "scoring_parts", "rules_version", "evaluated_at",
+]
+
+
+def rules_version(scoring_rules: dict, criteria: dict) -> str:
+    """评分配置指纹：规则或维度权重变化后，检查点中的旧结果不再复用"""
+    raw = json.dumps({"scoring_rules": scoring_rules, "criteria": criteria}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _profiles_by_id() -> dict:
+    return {str(p.get("id")): p for p in get_user_profiles() if isinstance(p, dict)}
+
+
+def normalize_record(raw: dict, profiles: dict) -> dict:
+    """把一行输入（扁平记录或会话状态）统一为 evaluate 所需的参数"""
+    simulator = raw.get("simulator") if isinstance(raw.get("simulator"), dict) else {}
+    profile = raw.get("profile") or simulator.get("profile")
+    if not isinstance(profile, dict):
+        profile = profiles.get(str(raw.get("profile_id")))
+    if not isinstance(profile, dict):
+        raise ValueError(f"找不到用户画像: profile_id={raw.get('profile_id')}")
+    history = raw.get("conversation_history", simulator.get("conversation_history"))
+    if not isinstance(history, list):
+        raise ValueError("缺少 conversation_history")
+    concerns = raw.get("concerns_addressed", simulator.get("concerns_addressed")) or []
+    pm_turns = sum(1 for m in history if isinstance(m, dict) and m.get("role") == "user")
+    return {
+        "session_id": str(raw.get("session_id") or ""),
+        "conversation_history": history,
+        "user_profile": profile,
+        "final_trust_level": int(raw.get("final_trust_level", simulator.get("trust_level", 0)) or 0),
+        "is_convinced": bool(raw.get("is_convinced", simulator.get("is_convinced", False))),
+        "concerns_addressed": list(concerns),
+        "turn_count": int(raw.get("turn_count", simulator.get("pm_turn_count", pm_turns)) or 0),
+        "scenario": raw.get("scenario", simulator.get("scenario")),
+        "mental_state": raw.get("mental_state", simulator.get("mental_state")),
+        "end_reason": raw.get("end_reason"),
+        "end_detail": raw.get("end_detail"),
+    }
+
+
+def read_transcripts(path: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """逐行读取输入，产出 (行号, 原始记录, 错误)"""
+    opener = open
+    if path.endswith(".gz"):
+        import gzip
+        opener = gzip.open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError as e:
+                yield lineno, None, f"JSON 解析失败: {e}"
+                continue
+            if not isinstance(raw, dict):
+                yield lineno, None, "不是 JSON 对象"
+                continue
+            yield lineno, raw, None
+
+
+# ---- 规则分（在进程池的工作进程中执行） ----
+
+_worker_evaluator: ConversationEvaluator | None = None
+
+
+def _init_rule_worker(criteria: dict, scoring_rules: dict, goals_config: dict) -> None:
+    # 每个工作进程只构建一次评估器：评分规则在首次使用时编译，之后复用
+    global _worker_evaluator
+    _worker_evaluator = ConversationEvaluator(criteria=criteria, scoring_rules=scoring_rules, goals_config=goals_config)
+
+
+def _rule_score(record: dict) -> dict:
+    return _worker_evaluator.rule_based_preview(
+        record["conversation_history"],
+        record["user_profile"],
+        record["final_trust_level"],
+        record["is_convinced"],
+        record["concerns_addressed"],
+        record["turn_count"],
+        end_reason=record["end_reason"],
+        end_detail=record["end_detail"],
+    )
+
+
+# ---- 检查点 ----
+
+def load_checkpoint(path: str, version: str) -> dict[str, dict]:
+    """读取检查点中按当前评分配置得到的结果（同一会话取最后一条）"""
+    rows: dict[str, dict] = {}
+    if not os.path.exists(path):
+        return rows
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # 进程被强杀时最后一行可能不完整
+                continue
+            if row.get("rules_version") == version:
+                rows[row["session_id"]] = row
+    return rows
+
+
+class BatchEvaluator:
+    """批量评估：进程池算规则分，线程池并发请求 LLM 评语，主线程合并结果并写检查点"""
+
+    def __init__(self, concurrency: int = 4, workers: int | None = None, use_llm: bool = True):
+        self.concurrency = max(1, int(concurrency))
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.use_llm = use_llm
+        self.criteria = get_evaluation_criteria()
+        self.scoring_rules = get_scoring_rules()
+        self.goals_config = get_goals_config()
+        self.version = rules_version(self.scoring_rules, self.criteria)
+
+    def _evaluator(self) -> ConversationEvaluator:
+        # 评估器在生成提示词时记住最近一次对话：每条记录各用一个，避免线程间互相覆盖
+        return ConversationEvaluator(criteria=self.criteria, scoring_rules=self.scoring_rules,
+                                     goals_config=self.goals_config)
+
+    def _evaluate_one(self, record: dict, rule_future: Future) -> dict:
+        """线程池任务：请求 LLM 评语（可选），再与进程池算出的规则分合并"""
+        session_id = record["session_id"]
+        response = None
+        if self.use_llm:
+            evaluator = self._evaluator()
+            messages = evaluator._evaluation_messages(
+                record["conversation_history"], record["user_profile"], record["final_trust_level"],
+                record["is_convinced"], record["concerns_addressed"], record["turn_count"],
+                record["scenario"], record["mental_state"],
+                end_reason=record["end_reason"], end_detail=record["end_detail"],
+            )
+            with llm_context(EVALUATION, session_id):
+                response = llm_client.chat(messages, temperature=0.3, schema=EVALUATION_REPORT, cache="evaluation")
+        preview = rule_future.result()
+        breakdown = preview["scoring_breakdown"]
+        if response is None:
+            return self._row(record, {**preview, "llm_status": "skipped"})
+        evaluation = evaluator._apply_evaluation(
+            response, record["user_profile"], record["final_trust_level"], record["is_convinced"],
+            record["concerns_addressed"], record["turn_count"],
+            end_reason=record["end_reason"], end_detail=record["end_detail"], scoring_breakdown=breakdown,
+        )
+        if response.startswith("["):
+            evaluation["llm_status"] = "error"
+        else:
+            # _apply_evaluation 解析失败时回退为默认评估（不带 llm_weighted_score）
+            evaluation["llm_status"] = "ok" if "llm_weighted_score" in evaluation else "parse_failed"
+        return self._row(record, evaluation)
+
+    def _row(self, record: dict, evaluation: dict) -> dict:
+        """一条结果（列名见 COLUMNS）"""
+        profile = record["user_profile"]
+        breakdown = evaluation.get("scoring_breakdown") or {}
+        scores = evaluation.get("scores") if evaluation.get("llm_status") == "ok" else None
+        scores = scores if isinstance(scores, dict) else {}
+        llm_weighted = evaluation.get("llm_weighted_score")
+        if llm_weighted is None and scores:
+            llm_weighted = calculate_weighted_score(scores, criteria=self.criteria)
+        return {
+            "session_id": record["session_id"],
+            "profile_id": profile.get("id"),
+            "profile_name": profile.get("name"),
+            "scenario_id": (record["scenario"] or {}).get("id") if isinstance(record["scenario"], dict) else None,
+            "mental_state_id": (record["mental_state"] or {}).get("id") if isinstance(record["mental_state"], dict) else None,
+            "turn_count": record["turn_count"],
+            "final_trust_level": record["final_trust_level"],
+            "is_convinced": record["is_convinced"],
+            "concerns_addressed": len(record["concerns_addressed"]),
+            "end_reason": record["end_reason"],
+            "total_score": breakdown.get("total_score"),
+            "raw_score": breakdown.get("raw_score"),
+            "max_total_score": breakdown.get("max_total_score"),
+            "llm_weighted_score": llm_weighted,
+            **{f"score_{key}": scores.get(key) for key in DIMENSIONS},
+            "llm_status": evaluation.get("llm_status"),
+            "highlights": json.dumps(evaluation.get("highlights") or [], ensure_ascii=False) if scores else None,
+            "improvements": json.dumps(evaluation.get("improvements") or [], ensure_ascii=False) if scores else None,
+            "key_insights": evaluation.get("key_insights") if scores else None,
+            "overall_comment": evaluation.get("overall_comment") if scores else None,
+            "end_explanation": evaluation.get("end_explanation"),
+            "scoring_parts": json.dumps(breakdown.get("parts") or [], ensure_ascii=False),
+            "rules_version": self.version,
+            "evaluated_at": round(time.time(), 3),
+        }
+
+    def run(self, input_path: str, checkpoint_path: str, limit: int | None = None) -> dict[str, dict]:
+        """评估输入中尚未完成的会话，返回 {session_id: 结果}（含检查点中已有的结果，LLM 失败的也保留）"""
+        results = load_checkpoint(checkpoint_path, self.version)
+        # LLM 评语失败的会话重新评估；只算规则分的结果在请求 LLM 时也要重新评估
+        finished_status = ("ok",) if self.use_llm else ("ok", "skipped")
+        done = {sid for sid, row in results.items() if row.get("llm_status") in finished_status}
+        profiles = _profiles_by_id()
+        pending: list[dict] = []
+        seen: set[str] = set()
+        invalid = 0
+        for lineno, raw, error in read_transcripts(input_path):
+            if error is None:
+                try:
+                    record = normalize_record(raw, profiles)
+                except (TypeError, ValueError) as e:
+                    error = str(e)
+            if error is not None:
+                invalid += 1
+                print(f"[BATCH] 跳过第 {lineno} 行: {error}")
+                continue
+            record["session_id"] = record["session_id"] or f"line-{lineno}"
+            if record["session_id"] in seen:
+                continue
+            seen.add(record["session_id"])
+            if record["session_id"] not in done:
+                pending.append(record)
+        if limit is not None:
+            pending = pending[:max(0, limit)]
+
+        print(f"[BATCH] 输入 {len(seen)} 个会话（无效 {invalid} 行），检查点已完成 {len(seen & done)} 个，"
+              f"本次评估 {len(pending)} 个: llm={'on' if self.use_llm else 'off'}, "
+              f"concurrency={self.concurrency}, workers={self.workers}, rules_version={self.version}")
+        if not pending:
+            return results
+
+        started = time.monotonic()
+        counts: dict[str, int] = {}
+        with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+                ProcessPoolExecutor(max_workers=self.workers, initializer=_init_rule_worker,
+                                    initargs=(self.criteria, self.scoring_rules, self.goals_config)) as processes, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-eval") as threads:
+            futures = {
+                threads.submit(self._evaluate_one, record, processes.submit(_rule_score, record)): record["session_id"]
+                for record in pending
+            }
+            for finished, future in enumerate(as_completed(futures), 1):
+                session_id = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    counts["exception"] = counts.get("exception", 0) + 1
+                    print(f"[BATCH] 评估失败: session_id={session_id}, err={type(e).__name__}: {e}")
+                    continue
+                # 只有主线程写检查点：每条写完即刷新，中断后最多丢失正在评估的几条
+                checkpoint.write(json.dumps(row, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                counts[row["llm_status"]] = counts.get(row["llm_status"], 0) + 1
+                results[session_id] = row
+                if finished % 50 == 0 or finished == len(futures):
+                    elapsed = time.monotonic() - started
+                    print(f"[BATCH] 进度 {finished}/{len(futures)}，{finished / elapsed:.1f} 条/秒，状态 {counts}")
+        return results
+
+
+def write_columnar(rows: list[dict], path: str) -> None:
+    """按扩展名写出结果：.parquet（pyarrow）或 .csv"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({column: [row.get(column) for row in rows] for column in COLUMNS})
+        pq.write_table(table, path)
+        return
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="批量评估已归档的训练对话")
+    parser.add_argument("input", help="对话记录文件（JSON Lines，可为 .gz）")
+    parser.add_argument("-o", "--output", required=True, help="结果文件（.parquet 需要 pyarrow，或 .csv）")
+    parser.add_argument("--checkpoint", help="检查点文件（默认为 <output>.checkpoint.jsonl）")
+    parser.add_argument("--concurrency", type=int, default=env_int("PMTRAINER_BATCH_CONCURRENCY", 4),
+                        help="LLM 并发请求数（默认 4）")
+    parser.add_argument("--workers", type=int, default=env_int("PMTRAINER_BATCH_WORKERS", 0) or None,
+                        help="规则分进程数（默认 CPU 核数）")
+    parser.add_argument("--no-llm", action="store_true", help="只重算规则分，不请求 LLM 评语")
+    parser.add_argument("--limit", type=int, help="本次最多评估多少个会话（调试用）")
+    args = parser.parse_args(argv)
+
+    if args.output.endswith(".parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("[BATCH] 写出 .parquet 需要安装 pyarrow（pip install pyarrow），或改用 .csv 输出")
+            return 2
+    elif not args.output.endswith(".csv"):
+        print("[BATCH] 结果文件扩展名应为 .parquet 或 .csv")
+        return 2
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.jsonl"
+    batch = BatchEvaluator(concurrency=args.concurrency, workers=args.workers, use_llm=not args.no_llm)
+    results = batch.run(args.input, checkpoint_path, limit=args.limit)
+    rows = sorted(results.values(), key=lambda row: row["session_id"])
+    write_columnar(rows, args.output)
+    print(f"[BATCH] 已写出 {len(rows)} 条结果: {args.output}（检查点: {checkpoint_path}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
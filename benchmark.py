@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+热点路径基准测试（模拟器 / 评估器 / HTTP）
+
+在本进程内启动一个假的 LLM 后端（OpenAI 兼容接口，按请求的结构化输出 schema 立即返回固定回复），
+不需要 API Key 或 Ollama，测量的全部是本项目自身的开销：
+- system_prompt:          UserSimulator.get_system_prompt（带场景/心理状态/已触发事件）
+- update_active_events:   UserSimulator._update_active_events（配置中的场景事件 + 合成的大量事件）
+- parse_reply_*:          respond 中的 JSON 提取（parse_llm_json：干净 / 代码块包裹 / 截断修复）
+- rule_score_large:       ConversationEvaluator._compute_rule_based_score（长对话）
+- load_training_config:   load_training_config(force_reload=True)（含评分规则、场景事件预编译）
+- http_chat / http_chat_stream: /api/session/<id>/chat（及 /chat/stream）单轮请求的端到端开销
+
+每项测试先预热，再跑若干轮（每轮自动确定迭代次数，使一轮至少耗时 --min-time 秒），
+按轮计算单次耗时的中位数/最小值/均值/p95。结果写入 JSON（-o），指定 --baseline 时逐项与基线的中位数比较，
+变慢超过阈值即判为回归，退出码为 1，便于在部署前的 CI 中拦截。
+测量期间屏蔽各模块的 print 日志输出（写入 os.devnull）。
+
+用法：
+    python benchmark.py -o bench_baseline.json                 # 生成基线
+    python benchmark.py --baseline bench_baseline.json         # 与基线比较（默认写 bench_results.json）
+    python benchmark.py --filter http --rounds 10              # 只跑名称包含 http 的测试
+
+环境变量：
+- PMTRAINER_BENCH_THRESHOLD: 判定回归的变慢比例（默认 0.2，即中位数慢 20% 以上）
+- PMTRAINER_BENCH_LLM_DELAY: 假 LLM 后端每次回复前等待的秒数（默认 0）
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+
+# 假 LLM 后端按请求的 schema 名称返回的回复
+FAKE_REPLIES = {
+    "simulator_reply": {
+        "response": "听你这么说我放心一点了，不过开户的时候要填哪些资料呀？会不会很麻烦？",
+        "inner_thought": "好像没有我想的那么复杂，但还是要再问问",
+        "trust_change": 0,
+        "concern_addressed": None,
+        "willing_to_continue": True,
+        "ready_to_open_account": False,
+    },
+    "opening": {
+        "response": "你好，我听朋友说现在可以用手机炒股，但我什么都不懂，怕被骗……",
+        "inner_thought": "先问问看靠不靠谱",
+    },
+    "evaluation_report": {
+        "scores": {"communication_skills": 75, "empathy": 80, "problem_solving": 70, "persuasion": 65, "professionalism": 78},
+        "highlights": ["耐心解释资金安全"],
+        "improvements": ["可以更早了解用户真实需求"],
+        "key_insights": "先建立信任再介绍功能",
+        "overall_comment": "整体表现良好",
+        "end_explanation": "",
+    },
+    "turn_score": {
+        "scores": {"communication_skills": 75, "empathy": 80, "problem_solving": 70, "persuasion": 65, "professionalism": 78},
+        "note": "回应了用户顾虑",
+    },
+    "history_summary": {"summary": "用户担心资金安全，PM 解释了第三方存管。"},
+}
+FAKE_REPLIES["evaluation_summary"] = {k: v for k, v in FAKE_REPLIES["evaluation_report"].items() if k != "scores"}
+
+
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出：不关 Nagle 时 keep-alive 连接每次请求都会多等一个延迟 ACK（约 40ms）
+    disable_nagle_algorithm = True
+    delay = 0.0
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        # Ollama 模型列表（/api/tags）
+        self._send(json.dumps({"models": [{"name": "bench-model"}]}).encode())
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.delay > 0:
+            time.sleep(self.delay)
+        schema_name = (((body.get("response_format") or {}).get("json_schema")) or {}).get("name")
+        text = json.dumps(FAKE_REPLIES.get(schema_name or "simulator_reply", FAKE_REPLIES["simulator_reply"]),
+                          ensure_ascii=False)
+        if self.path.endswith("/api/chat"):
+            # Ollama 原生接口（远程失败回退时才会用到），只提供非流式
+            self._send(json.dumps({"message": {"role": "assistant", "content": text}, "done": True}).encode())
+            return
+        if not body.get("stream"):
+            self._send(json.dumps({"choices": [{"message": {"role": "assistant", "content": text}}]}).encode())
+            return
+        events = [
+            "data: " + json.dumps({"choices": [{"delta": {"content": text[i:i + 8]}}]}, ensure_ascii=False) + "\n\n"
+            for i in range(0, len(text), 8)
+        ]
+        events.append("data: [DONE]\n\n")
+        self._send("".join(events).encode(), "text/event-stream")
+
+
+class FakeLLMServer:
+    """本进程内的假 LLM 后端（后台线程）"""
+
+    def __init__(self, delay: float = 0.0):
+        handler = type("FakeLLMHandler", (_FakeLLMHandler,), {"delay": max(0.0, float(delay))})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def configure_environment(server: FakeLLMServer) -> None:
+    """把 LLM 后端指向假服务器（必须在导入项目模块之前调用）"""
+    os.environ.update({
+        "LLM_API_URL": f"{server.url}/v1",
+        "LLM_API_KEY": "bench",
+        "LLM_MODEL": "bench-model",
+        "OLLAMA_BASE_URL": server.url,
+        "OLLAMA_MODEL": "bench-model",
+        "LLM_CACHE": "off",
+        "LLM_CASSETTE_MODE": "off",
+    })
+    # 后台 LLM 任务会与被测请求争用 CPU，默认关闭（可在环境变量中显式开启）
+    for name, value in (
+        ("PMTRAINER_OPENING_POOL_SIZE", "0"),
+        ("PMTRAINER_TURN_EVAL", "0"),
+        ("PMTRAINER_EVAL_SPECULATIVE", "0"),
+        ("PMTRAINER_HISTORY_SUMMARY", "0"),
+        ("PMTRAINER_SESSION_STORE", "memory"),
+    ):
+        os.environ.setdefault(name, value)
+
+
+@contextlib.contextmanager
+def quiet() -> Any:
+    """屏蔽被测代码的 print 日志"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# ---- 测量 ----
+
+class Benchmark:
+    """
+    一项基准测试：setup() 在每轮开始前（不计时）准备状态，fn(state) 为被测的一次操作
+
+    number 为每轮迭代次数；为 None 时自动确定（使一轮至少耗时 min_time 秒）
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], setup: Callable[[], Any] | None = None,
+                 number: int | None = None, description: str = ""):
+        self.name = name
+        self.fn = fn
+        self.setup = setup or (lambda: None)
+        self.number = number
+        self.description = description
+
+    def _round(self, number: int) -> float:
+        state = self.setup()
+        fn = self.fn
+        started = time.perf_counter()
+        for _ in range(number):
+            fn(state)
+        return time.perf_counter() - started
+
+    def _calibrate(self, min_time: float) -> int:
+        number = 1
+        while True:
+            if self._round(number) >= min_time or number >= 1_000_000:
+                return number
+            number *= 2 if number < 10 else 5
+
+    def run(self, rounds: int = 5, min_time: float = 0.2) -> dict:
+        with quiet():
+            number = self.number or self._calibrate(min_time)
+            self._round(number)  # 预热
+            per_op = [self._round(number) / number for _ in range(max(1, rounds))]
+        per_op_us = sorted(t * 1e6 for t in per_op)
+        median = statistics.median(per_op_us)
+        return {
+            "description": self.description,
+            "rounds": len(per_op_us),
+            "number": number,
+            "median_us": round(median, 3),
+            "min_us": round(per_op_us[0], 3),
+            "mean_us": round(statistics.fmean(per_op_us), 3),
+            "p95_us": round(per_op_us[min(len(per_op_us) - 1, int(0.95 * len(per_op_us)))], 3),
+            "stdev_us": round(statistics.stdev(per_op_us), 3) if len(per_op_us) > 1 else 0.0,
+            "ops_per_sec": round(1e6 / median, 2) if median > 0 else 0.0,
+        }
+
+
+def _synthetic_events(count: int, seed: int = 7) -> list[dict]:
+    """合成场景事件：回合/信任度阈值、关键词、概率触发的组合"""
+    rng = random.Random(seed)
+    keywords = ["开户", "手续费", "风险", "收益", "身份证", "银行卡", "亏损", "基金", "隐私", "权限", "客服", "模拟盘"]
+    events = []
+    for i in range(count):
+        trigger: dict[str, Any] = {}
+        if rng.random() < 0.6:
+            trigger["turn_gte"] = rng.randint(1, 12)
+        if rng.random() < 0.4:
+            trigger["trust_gte"] = rng.randint(1, 8)
+        if rng.random() < 0.5:
+            trigger["keyword_any"] = rng.sample(keywords, rng.randint(1, 3))
+        if rng.random() < 0.2:
+            trigger["probability"] = 0.5
+        events.append({"id": f"bench_event_{i}", "name": f"事件{i}", "description": "合成事件", "trigger": trigger})
+    return events
+
+
+def _pm_lines() -> list[str]:
+    return [
+        "您好，我是腾讯自选股的产品经理，您有什么顾虑都可以问我。",
+        "资金由银行第三方存管，开户在持牌券商完成，我们碰不到您的钱。",
+        "炒股有风险，我不会跟您说稳赚，您可以先用模拟盘熟悉一下。",
+        "开户只需要身份证和银行卡，全程手机上十分钟左右就能完成。",
+        "手续费方面开户不收钱，交易时券商收取少量佣金，页面上都有说明。",
+        "App 不会读取您的通讯录，权限都可以在设置里关闭，不影响看行情。",
+        "这只基金收益很高，保证不亏，赶紧开户吧！",
+        "您先别急，有哪里不清楚的我们一条一条说。",
+    ]
+
+
+def build_benchmarks() -> list[Benchmark]:
+    """构建全部基准测试（导入项目模块，须在 configure_environment 之后调用）"""
+    with quiet():
+        from evaluator import ConversationEvaluator
+        from llm_json import parse_llm_json
+        from training_config import get_training_options, get_user_profiles, load_training_config
+        from user_simulator import UserSimulator
+
+        profile = get_user_profiles()[0]
+        options = get_training_options()
+        scenario = (options.get("scenarios") or [None])[0]
+        mental_state = (options.get("mental_states") or [None])[0]
+
+    pm_lines = _pm_lines()
+    benchmarks = []
+
+    # 系统提示词构建
+    def prompt_setup():
+        sim = UserSimulator(profile, scenario=scenario, mental_state=mental_state)
+        sim.trust_level = 5
+        sim.concerns_addressed = list(profile.get("pain_points") or [])[:2]
+        sim.active_events = list((scenario or {}).get("events") or [])
+        return sim
+
+    benchmarks.append(Benchmark("system_prompt", lambda sim: sim.get_system_prompt(), prompt_setup,
+                                description="UserSimulator.get_system_prompt"))
+
+    # 场景事件触发
+    events_scenario = {**(scenario or {}), "id": "bench", "events": list((scenario or {}).get("events") or [])
+                       + _synthetic_events(200)}
+
+    def events_setup():
+        sim = UserSimulator(profile, scenario=events_scenario, mental_state=mental_state)
+        sim.pm_turn_count = 6
+        sim.trust_level = 4
+        return {"sim": sim, "i": 0}
+
+    def update_events(state):
+        sim = state["sim"]
+        sim.active_events.clear()
+        state["i"] += 1
+        sim._update_active_events(pm_lines[state["i"] % len(pm_lines)])
+
+    benchmarks.append(Benchmark("update_active_events", update_events, events_setup,
+                                description="UserSimulator._update_active_events（201 个事件）"))
+
+    # respond 中的 JSON 提取
+    clean = json.dumps(FAKE_REPLIES["simulator_reply"], ensure_ascii=False)
+    samples = {
+        "clean": clean,
+        "fenced": f"好的，下面是我的回复：\n```json\n{json.dumps(FAKE_REPLIES['simulator_reply'], ensure_ascii=False, indent=2)}\n```",
+        "truncated": clean[: int(len(clean) * 0.7)],
+    }
+    for kind, text in samples.items():
+        benchmarks.append(Benchmark(f"parse_reply_{kind}", lambda _, text=text: parse_llm_json(text, "benchmark"),
+                                    description=f"parse_llm_json（{kind}）"))
+
+    # 长对话规则分
+    rng = random.Random(3)
+    history = []
+    for turn in range(200):
+        history.append({"role": "user", "content": "".join(rng.choice(pm_lines) for _ in range(3))})
+        history.append({"role": "assistant", "content": FAKE_REPLIES["simulator_reply"]["response"]})
+    evaluator = ConversationEvaluator()
+
+    def rule_score(_):
+        evaluator._compute_rule_based_score(
+            final_trust_level=6, is_convinced=True, concerns_addressed=["担心被骗"], turn_count=200,
+            user_profile=profile, conversation_history=history,
+        )
+
+    benchmarks.append(Benchmark("rule_score_large", rule_score,
+                                description="_compute_rule_based_score（200 轮，约 6 万字）"))
+
+    benchmarks.append(Benchmark("load_training_config", lambda _: load_training_config(force_reload=True),
+                                description="load_training_config(force_reload=True)"))
+
+    # HTTP 端到端：每轮新建会话（不计时），每轮固定 10 次对话，避免会话越聊越长
+    def http_setup():
+        with quiet():
+            import app as web
+        client = web.app.test_client()
+        resp = client.post("/api/session/start", json={"profile_id": profile.get("id")})
+        session_id = resp.get_json()["session_id"]
+        return {"client": client, "session_id": session_id, "i": 0}
+
+    def http_chat(state, stream: bool = False):
+        state["i"] += 1
+        url = f"/api/session/{state['session_id']}/chat" + ("/stream" if stream else "")
+        resp = state["client"].post(url, json={"message": pm_lines[state["i"] % len(pm_lines)]})
+        body = resp.get_data()
+        if resp.status_code != 200 or (stream and b"event: done" not in body):
+            raise RuntimeError(f"{url} 返回 {resp.status_code}: {body[:200]!r}")
+
+    benchmarks.append(Benchmark("http_chat", http_chat, http_setup, number=10,
+                                description="POST /api/session/<id>/chat（假 LLM 后端）"))
+    benchmarks.append(Benchmark("http_chat_stream", lambda state: http_chat(state, stream=True), http_setup,
+                                number=10, description="POST /api/session/<id>/chat/stream（假 LLM 后端）"))
+    return benchmarks
+
+
+# ---- 结果与基线 ----
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    """逐项比较中位数：变慢超过 threshold 为 regression，变快超过 threshold 为 improvement"""
+    rows = []
+    base_results = baseline.get("results") or {}
+    for name, current in results.items():
+        base = base_results.get(name)
+        if not base or not base.get("median_us"):
+            rows.append({"name": name, "status": "new", "median_us": current["median_us"]})
+            continue
+        ratio = current["median_us"] / base["median_us"]
+        status = "regression" if ratio > 1 + threshold else "improvement" if ratio < 1 - threshold else "ok"
+        rows.append({
+            "name": name,
+            "status": status,
+            "median_us": current["median_us"],
+            "baseline_median_us": base["median_us"],
+            "change": round(ratio - 1, 4),
+        })
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="模拟器 / 评估器 / HTTP 热点路径基准测试")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="结果文件（默认 bench_results.json）")
+    parser.add_argument("--baseline", help="基线结果文件（与之比较中位数）")
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.environ.get("PMTRAINER_BENCH_THRESHOLD") or 0.2),
+                        help="判定回归的变慢比例（默认 0.2）")
+    parser.add_argument("--filter", help="只运行名称包含该字符串的测试")
+    parser.add_argument("--rounds", type=int, default=5, help="每项测试的轮数（默认 5）")
+    parser.add_argument("--min-time", type=float, default=0.2, help="自动确定迭代次数时每轮的最短耗时，秒（默认 0.2）")
+    parser.add_argument("--llm-delay", type=float, default=float(os.environ.get("PMTRAINER_BENCH_LLM_DELAY") or 0),
+                        help="假 LLM 后端每次回复前等待的秒数（默认 0）")
+    parser.add_argument("--list", action="store_true", help="只列出测试名称")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    server = FakeLLMServer(delay=args.llm_delay)
+    configure_environment(server)
+    benchmarks = [b for b in build_benchmarks() if not args.filter or args.filter in b.name]
+    if args.list:
+        for b in benchmarks:
+            print(f"{b.name:<24} {b.description}")
+        return 0
+
+    results = {}
+    for b in benchmarks:
+        results[b.name] = b.run(rounds=args.rounds, min_time=args.min_time)
+        r = results[b.name]
+        print(f"[BENCH] {b.name:<24} median={r['median_us']:>12.2f}us  min={r['min_us']:>12.2f}us  "
+              f"p95={r['p95_us']:>12.2f}us  ({r['number']} × {r['rounds']})")
+    server.close()
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "rounds": args.rounds,
+            "min_time": args.min_time,
+            "llm_delay": args.llm_delay,
+        },
+        "results": results,
+    }
+    exit_code = 0
+    if baseline is not None:
+        rows = compare(results, baseline, args.threshold)
+        report["comparison"] = {"baseline": args.baseline, "threshold": args.threshold, "rows": rows}
+        print()
+        for row in rows:
+            change = f"{row['change']:+.1%}" if "change" in row else "   —"
+            print(f"[BENCH] {row['name']:<24} {change:>8}  {row['status']}")
+        regressions = [row["name"] for row in rows if row["status"] == "regression"]
+        if regressions:
+            print(f"[BENCH] 性能回归（中位数变慢超过 {args.threshold:.0%}）: {', '.join(regressions)}")
+            exit_code = 1
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[BENCH] 结果已写入: {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+LLM 端点熔断器
+
+远程服务故障时，如果每轮对话都把所有候选地址挨个请求一遍（每个都等满超时）再降级到 Ollama，
+一次故障就会让每轮对话多等几分钟。这里为每个端点维护一个熔断器：
+- closed（正常）：请求照常发出，并在滑动窗口内统计失败率/慢调用
+- open（熔断）：连续失败或失败率超阈值后打开，冷却期内直接跳过该端点
+- half_open（探测）：冷却期结束后放行少量请求试探，成功则恢复，失败则继续熔断
+
+环境变量：
+- LLM_BREAKER_ENABLED:              是否启用（默认 1）
+- LLM_BREAKER_WINDOW:               统计窗口，秒（默认 60）
+- LLM_BREAKER_MIN_REQUESTS:         窗口内至少多少次请求才按失败率判断（默认 4）
+- LLM_BREAKER_ERROR_RATE:           失败率阈值（默认 0.5）
+- LLM_BREAKER_CONSECUTIVE_FAILURES: 连续失败多少次直接熔断（默认 2）
+- LLM_BREAKER_SLOW_SECONDS:         超过该耗时的调用记为慢调用，按失败计（默认 90；
+                                    本地 Ollama 是最后的兜底，CPU 上生成本来就慢，不按慢调用计）
+- LLM_BREAKER_OPEN_SECONDS:         熔断冷却时间，秒（默认 30）
+- LLM_BREAKER_HALF_OPEN_CALLS:      半开状态允许的探测请求数（默认 1）
+"""
+import threading
+import time
+from collections import deque
+
+from config import env_bool, env_float, env_int
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个端点的熔断器（线程安全）"""
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_requests: int = 4,
+        error_rate_threshold: float = 0.5,
+        consecutive_failures: int = 2,
+        slow_call_seconds: float = 90.0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window_seconds = float(window_seconds)
+        self.min_requests = max(1, int(min_requests))
+        self.error_rate_threshold = float(error_rate_threshold)
+        self.consecutive_failures_threshold = max(1, int(consecutive_failures))
+        self.slow_call_seconds = float(slow_call_seconds)
+        self.open_seconds = float(open_seconds)
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+        self._half_open_started = 0.0
+        self._consecutive_failures = 0
+        self._window: deque[tuple[float, bool, float]] = deque()  # (ts, ok, latency)
+        self._last_error = ""
+        self.rejected = 0
+
+    def _trim(self, now: float) -> None:
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_inflight = 0
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def allow_request(self) -> bool:
+        """是否允许向该端点发请求；返回 False 表示应直接跳过"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN:
+                # 探测请求迟迟没有结果（如被调用方丢弃）时，允许重新探测
+                if self._half_open_inflight and now - self._half_open_started > self.open_seconds:
+                    self._half_open_inflight = 0
+                if self._half_open_inflight < self.half_open_max_calls:
+                    self._half_open_inflight += 1
+                    self._half_open_started = now
+                    return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, latency: float, error: str = "", count_slow: bool = True) -> None:
+        """记录一次调用结果；count_slow 为真时慢调用按失败计"""
+        now = time.monotonic()
+        if ok and count_slow and latency > self.slow_call_seconds:
+            ok = False
+            error = f"slow call {latency:.1f}s"
+
+        with self._lock:
+            state = self._current_state(now)
+            self._window.append((now, ok, latency))
+            self._trim(now)
+
+            if ok:
+                self._consecutive_failures = 0
+                if state == HALF_OPEN:
+                    self._state = CLOSED
+                    self._half_open_inflight = 0
+                    self._window.clear()
+                return
+
+            self._consecutive_failures += 1
+            self._last_error = error
+            if state == HALF_OPEN:
+                self._trip(now)
+                return
+
+            failures = sum(1 for _, item_ok, _ in self._window if not item_ok)
+            total = len(self._window)
+            if self._consecutive_failures >= self.consecutive_failures_threshold or (
+                total >= self.min_requests and failures / total >= self.error_rate_threshold
+            ):
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        if self._state != OPEN:
+            print(f"[LLM] 熔断打开: {self.name}（{self._last_error}）")
+        self._state = OPEN
+        self._opened_at = now
+        self._half_open_inflight = 0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            self._trim(now)
+            total = len(self._window)
+            failures = sum(1 for _, ok, _ in self._window if not ok)
+            latencies = [lat for _, _, lat in self._window]
+            return {
+                "state": state,
+                "requests_in_window": total,
+                "error_rate": round(failures / total, 3) if total else 0.0,
+                "avg_latency_seconds": round(sum(latencies) / total, 3) if total else 0.0,
+                "consecutive_failures": self._consecutive_failures,
+                "open_remaining_seconds": round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+                if state == OPEN else 0.0,
+                "rejected": self.rejected,
+                "last_error": self._last_error,
+            }
+
+
+class CircuitBreakerRegistry:
+    """按端点 URL 管理熔断器"""
+
+    def __init__(self, enabled: bool = True, **breaker_kwargs):
+        self.enabled = bool(enabled)
+        self._breaker_kwargs = breaker_kwargs
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, **self._breaker_kwargs)
+            return breaker
+
+    def allow(self, endpoint: str) -> bool:
+        return (not self.enabled) or self.get(endpoint).allow_request()
+
+    def record(self, endpoint: str, ok: bool, latency: float, error: str = "", count_slow: bool = True) -> None:
+        if self.enabled:
+            self.get(endpoint).record(ok, latency, error, count_slow=count_slow)
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {
+            "enabled": self.enabled,
+            "endpoints": {endpoint: b.snapshot() for endpoint, b in breakers},
+        }
+
+
+# 全局熔断器（同步/异步客户端共用）
+circuit_breakers = CircuitBreakerRegistry(
+    enabled=env_bool("LLM_BREAKER_ENABLED", True),
+    window_seconds=env_float("LLM_BREAKER_WINDOW", 60.0),
+    min_requests=env_int("LLM_BREAKER_MIN_REQUESTS", 4),
+    error_rate_threshold=env_float("LLM_BREAKER_ERROR_RATE", 0.5),
+    consecutive_failures=env_int("LLM_BREAKER_CONSECUTIVE_FAILURES", 2),
+    slow_call_seconds=env_float("LLM_BREAKER_SLOW_SECONDS", 90.0),
+    open_seconds=env_float("LLM_BREAKER_OPEN_SECONDS", 30.0),
+    half_open_max_calls=env_int("LLM_BREAKER_HALF_OPEN_CALLS", 1),
+)
@@ -59,6 +59,33 @@ def _load_env_file_if_present() -> None:
 
 _load_env_file_if_present()
 
+
+def env_int(name: str, default: int) -> int:
+    """读取整数型环境变量；缺失或格式错误时返回默认值"""
+    try:
+        v = (os.getenv(name) or "").strip()
+        return int(v) if v else int(default)
+    except Exception:
+        return int(default)
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点型环境变量；缺失或格式错误时返回默认值"""
+    try:
+        v = (os.getenv(name) or "").strip()
+        return float(v) if v else float(default)
+    except Exception:
+        return float(default)
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """读取布尔型环境变量（1/true/yes/on 视为开启）"""
+    v = (os.getenv(name) or "").strip().lower()
+    if not v:
+        return bool(default)
+    return v in ("1", "true", "yes", "on")
+
+
 # LLM API 配置
 # 为避免泄露敏感信息，请通过环境变量注入配置（不要把真实 key 提交到 GitHub）
 LLM_CONFIG = {
@@ -0,0 +1,288 @@
+"""
+对话历史窗口与滚动摘要
+
+原先每轮都把完整的对话历史发给 LLM：max_turns=20 时输入 token 数、延迟和费用都随轮次线性增长。
+这里只保留最近 N 轮原文，更早的轮次折叠成一段滚动摘要：
+- 摘要增量生成：每次只把“上次摘要 + 新折叠的几轮”交给 LLM，在后台线程执行，不阻塞当前回复
+- 摘要按内容哈希缓存：同一段历史只总结一次（会话对象被重建时，如 SQLite 会话存储，也能复用）
+- 摘要未就绪前，尚未折叠的旧轮次照常原文发送，不丢信息；生成失败的分段在一段时间内不再重试
+- token 预算：原文部分超过预算时从最旧的消息开始丢弃（至少保留最后一条），并对齐到产品经理消息
+
+环境变量：
+- PMTRAINER_HISTORY_WINDOW:       保留原文的最近轮数（默认 6，0 表示不裁剪，发送完整历史）
+- PMTRAINER_HISTORY_FOLD_TURNS:   累计多少轮待折叠时才生成一次摘要（默认 2）
+- PMTRAINER_HISTORY_TOKEN_BUDGET: 摘要 + 原文历史的估算 token 上限（默认 4000，0 表示不限制）
+- PMTRAINER_HISTORY_SUMMARY:      是否生成摘要（默认 1；关闭时超出窗口的轮次直接丢弃）
+- PMTRAINER_HISTORY_SUMMARY_WORKERS: 后台摘要线程数（默认 2）
+- PMTRAINER_HISTORY_SUMMARY_RETRY:   摘要生成失败后多少秒内不再重试同一分段（默认 60）
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import env_bool, env_float, env_int
+from llm_client import llm_client
+from llm_json import parse_llm_json
+from llm_scheduler import BACKGROUND, llm_context
+from response_schemas import HISTORY_SUMMARY
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个计，其余字符按 4 个 1 token 计"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _messages_tokens(messages: list) -> int:
+    # 每条消息额外按 4 个 token 计（角色、分隔符）
+    return sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages)
+
+
+class HistorySummarizer:
+    """增量生成对话摘要（后台线程池 + 按内容哈希的 LRU 缓存，线程安全）"""
+
+    def __init__(self, max_workers: int = 2, max_entries: int = 1024, retry_seconds: float = 60.0):
+        self.max_entries = max(1, int(max_entries))
+        self.retry_seconds = max(0.0, float(retry_seconds))
+        self._executor: ThreadPoolExecutor | None = None
+        self._max_workers = max(1, int(max_workers))
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._inflight: set[str] = set()
+        # 生成失败的 key -> 可再次尝试的时间（monotonic）：摘要器故障时不让每轮都多一次 LLM 请求
+        self._failed: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.requested = 0
+        self.hits = 0
+        self.generated = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    @staticmethod
+    def key(previous_summary: str, segment: list) -> str:
+        raw = json.dumps([previous_summary, segment], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> str | None:
+        with self._lock:
+            summary = self._cache.get(key)
+            if summary is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            return summary
+
+    def _store(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def submit(self, key: str, previous_summary: str, segment: list, persona: str) -> None:
+        """在后台生成摘要；同一 key 同时只会有一个任务"""
+        with self._lock:
+            if key in self._inflight or key in self._cache:
+                return
+            retry_at = self._failed.get(key)
+            if retry_at is not None:
+                if time.monotonic() < retry_at:
+                    return
+                del self._failed[key]
+            self._inflight.add(key)
+            self.requested += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="history-summary")
+            executor = self._executor
+        executor.submit(self._run, key, previous_summary, segment, persona)
+
+    def _run(self, key: str, previous_summary: str, segment: list, persona: str) -> None:
+        started = time.monotonic()
+        summary = None
+        try:
+            with llm_context(BACKGROUND):
+                summary = self.summarize(previous_summary, segment, persona)
+            if summary:
+                self._store(key, summary)
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+                self.total_seconds += time.monotonic() - started
+                if not summary and self.retry_seconds > 0:
+                    self._failed[key] = time.monotonic() + self.retry_seconds
+                    self._failed.move_to_end(key)
+                    while len(self._failed) > self.max_entries:
+                        self._failed.popitem(last=False)
+
+    def summarize(self, previous_summary: str, segment: list, persona: str) -> str | None:
+        """同步调用 LLM 生成摘要；失败返回 None"""
+        lines = []
+        for m in segment:
+            speaker = "产品经理" if m.get("role") == "user" else "我"
+            lines.append(f"{speaker}: {m.get('content')}")
+        prompt = f"""你是{persona}，正在和一位产品经理聊腾讯自选股App。请把下面的对话整理成一段简短的第一人称摘要，供你后续继续对话时回忆。
+
+## 之前的摘要
+{previous_summary or '（无）'}
+
+## 新增的对话
+{chr(10).join(lines)}
+
+要求：
+- 合并“之前的摘要”和“新增的对话”，输出完整的新摘要，不超过300字
+- 保留：产品经理给出的关键解释和承诺、我已经问过的问题、哪些顾虑已被解答、我的态度变化
+- 不要编造对话中没有的内容
+
+用JSON格式回复：
+{{
+    "summary": "新的摘要"
+}}"""
+        response_text = llm_client.chat([{"role": "user", "content": prompt}], temperature=0.2, max_tokens=600, timeout=60, schema=HISTORY_SUMMARY)
+        # llm_client 出错时返回 "[...]" 形式的提示文本，不能当作摘要
+        if not response_text or response_text.startswith("["):
+            with self._lock:
+                self.failed += 1
+            print(f"[HISTORY] 摘要生成失败: {response_text[:100] if response_text else ''}")
+            return None
+
+        # 解析失败时回复可能是残缺的 JSON，不能当作摘要缓存并注入之后的提示词：保留之前的摘要
+        data = parse_llm_json(response_text, "history_summary")
+        if data is None:
+            with self._lock:
+                self.failed += 1
+            print(f"[HISTORY] 摘要解析失败: {response_text[:100]}")
+            return None
+
+        summary = str(data.get("summary") or "").strip()
+        with self._lock:
+            if summary:
+                self.generated += 1
+            else:
+                self.failed += 1
+        return summary or None
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.generated + self.failed
+            return {
+                "requested": self.requested,
+                "generated": self.generated,
+                "failed": self.failed,
+                "cache_hits": self.hits,
+                "cached": len(self._cache),
+                "inflight": len(self._inflight),
+                "backoff": len(self._failed),
+                "avg_seconds": round(self.total_seconds / finished, 2) if finished else 0.0,
+            }
+
+
+class ConversationWindow:
+    """
+    单个会话的历史窗口：决定每轮实际发送给 LLM 的历史消息
+
+    对话历史的结构为 [开场白(assistant), user, assistant, user, assistant, ..., user]，
+    一“轮”为产品经理的一条消息加模拟用户的一条回复。
+    """
+
+    def __init__(
+        self,
+        window_turns: int = 6,
+        fold_turns: int = 2,
+        token_budget: int = 4000,
+        summarizer: HistorySummarizer | None = None,
+        persona: str = "",
+    ):
+        self.window_turns = max(0, int(window_turns))
+        self.fold_turns = max(1, int(fold_turns))
+        self.token_budget = max(0, int(token_budget))
+        self.summarizer = summarizer
+        self.persona = persona
+        self.summary = ""
+        # summary 已覆盖 history[:summarized_upto]
+        self.summarized_upto = 0
+        self.trimmed = 0
+
+    def to_state(self) -> dict:
+        return {"summary": self.summary, "summarized_upto": self.summarized_upto}
+
+    def load_state(self, state: dict | None) -> None:
+        state = state or {}
+        self.summary = str(state.get("summary") or "")
+        self.summarized_upto = int(state.get("summarized_upto") or 0)
+
+    def _advance_summary(self, history: list, cutoff: int) -> None:
+        """把 history[summarized_upto:cutoff] 折叠进摘要：缓存命中立即采用，否则提交后台任务"""
+        if self.summarizer is None:
+            return
+        # 按固定长度分段折叠，段边界不随轮次变化，缓存 key 才能在后续轮次命中；
+        # 段尾对齐到产品经理消息之前，使保留的原文总是从一条 user 消息开始
+        while True:
+            end = self.summarized_upto + 2 * self.fold_turns
+            if end < len(history) and history[end].get("role") == "assistant":
+                end += 1
+            if end > cutoff:
+                return
+            segment = history[self.summarized_upto:end]
+            key = self.summarizer.key(self.summary, segment)
+            summary = self.summarizer.lookup(key)
+            if summary is None:
+                self.summarizer.submit(key, self.summary, segment, self.persona)
+                return
+            self.summary = summary
+            self.summarized_upto = end
+
+    def build(self, history: list) -> list:
+        """返回本轮应发送的历史消息（可能包含一条摘要 system 消息）"""
+        if self.window_turns <= 0:
+            return list(history)
+
+        # 保留最近 window_turns 轮 + 当前这条产品经理消息
+        cutoff = len(history) - (2 * self.window_turns + 1)
+        if cutoff <= 0:
+            return list(history)
+
+        if self.summarizer is not None:
+            self._advance_summary(history, cutoff)
+            start = min(self.summarized_upto, cutoff) if self.summary else 0
+        else:
+            start = cutoff
+        tail = list(history[start:])
+
+        prefix = []
+        if self.summary:
+            prefix = [{"role": "system", "content": f"## 之前的对话摘要（更早的对话已折叠）\n{self.summary}"}]
+
+        if self.token_budget:
+            budget = self.token_budget - _messages_tokens(prefix)
+            trimmed = False
+            while len(tail) > 1 and _messages_tokens(tail) > budget:
+                tail.pop(0)
+                self.trimmed += 1
+                trimmed = True
+            # 按整轮丢弃：保留的原文总是从一条产品经理消息（user）开始
+            while trimmed and len(tail) > 1 and tail[0].get("role") != "user":
+                tail.pop(0)
+                self.trimmed += 1
+
+        return prefix + tail
+
+
+def create_conversation_window(persona: str = "") -> ConversationWindow:
+    """按环境变量创建历史窗口"""
+    return ConversationWindow(
+        window_turns=env_int("PMTRAINER_HISTORY_WINDOW", 6),
+        fold_turns=env_int("PMTRAINER_HISTORY_FOLD_TURNS", 2),
+        token_budget=env_int("PMTRAINER_HISTORY_TOKEN_BUDGET", 4000),
+        summarizer=history_summarizer if env_bool("PMTRAINER_HISTORY_SUMMARY", True) else None,
+        persona=persona,
+    )
+
+
+# 全局摘要器（所有会话共用线程池与缓存）
+history_summarizer = HistorySummarizer(
+    max_workers=env_int("PMTRAINER_HISTORY_SUMMARY_WORKERS", 2),
+    retry_seconds=env_float("PMTRAINER_HISTORY_SUMMARY_RETRY", 60.0),
+)
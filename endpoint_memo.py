@@ -0,0 +1,125 @@
+"""
+LLM 聊天端点发现结果记忆
+
+远程可能是 /chat/completions 也可能是 /v1/chat/completions，Ollama 可能是原生 /api/chat
+也可能只有 OpenAI 兼容接口。原先每次调用都按固定顺序逐个尝试，首个候选 404 时
+每轮对话都要白白多一次往返。这里按 (后端类型, base_url, model) 记住“确认可用”的端点：
+- 之后的调用直接把它排在第一个，稳态下只发一次请求
+- 它返回 404 立即失效；连续失败（网络异常/5xx）达到阈值也失效，重新走发现流程
+- 可选持久化到 JSON 文件，重启后无需重新探测
+
+环境变量：
+- LLM_ENDPOINT_CACHE_PATH:   持久化文件路径（默认不持久化）
+- LLM_ENDPOINT_MAX_FAILURES: 连续失败多少次后失效（默认 3）
+"""
+import json
+import os
+import threading
+
+from config import env_int
+
+
+class EndpointMemo:
+    """记忆每个 (kind, base_url, model) 确认可用的聊天端点（线程安全）"""
+
+    def __init__(self, path: str | None = None, max_failures: int = 3):
+        self.path = path or None
+        self.max_failures = max(1, int(max_failures))
+        self._known: dict[str, str] = {}
+        self._failures: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(kind: str, base_url: str, model: str) -> str:
+        return f"{kind}|{(base_url or '').rstrip('/')}|{model}"
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._known = {str(k): str(v) for k, v in data.items() if v}
+        except Exception as e:
+            print(f"[LLM] 读取端点缓存失败，将重新探测: path={self.path}, err={type(e).__name__}: {e}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._known, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[LLM] 写入端点缓存失败: path={self.path}, err={type(e).__name__}: {e}")
+
+    def known(self, kind: str, base_url: str, model: str) -> str | None:
+        with self._lock:
+            return self._known.get(self._key(kind, base_url, model))
+
+    def order(self, kind: str, base_url: str, model: str, candidates: list[str]) -> list[str]:
+        """把已确认可用的端点排到最前（其余候选保留，仅在它失败时兜底）"""
+        known = self.known(kind, base_url, model)
+        if not known or known not in candidates:
+            return list(candidates)
+        return [known] + [c for c in candidates if c != known]
+
+    def observe(self, kind: str, base_url: str, model: str, endpoint: str, outcome) -> None:
+        """
+        根据一次请求结果更新记忆
+        - 非 404 且非 5xx：端点存在 → 记住
+        - 404：记住的端点已失效 → 立即忘记
+        - 网络异常/5xx：记住的端点连续失败达到阈值 → 忘记
+        """
+        key = self._key(kind, base_url, model)
+        changed = False
+        with self._lock:
+            known = self._known.get(key)
+            if isinstance(outcome, Exception) or outcome.status_code >= 500:
+                if known == endpoint:
+                    self._failures[key] = self._failures.get(key, 0) + 1
+                    if self._failures[key] >= self.max_failures:
+                        self._known.pop(key, None)
+                        self._failures.pop(key, None)
+                        changed = True
+            elif outcome.status_code == 404:
+                if known == endpoint:
+                    self._known.pop(key, None)
+                    self._failures.pop(key, None)
+                    changed = True
+            else:
+                self._failures.pop(key, None)
+                if known != endpoint:
+                    self._known[key] = endpoint
+                    changed = True
+            if changed:
+                self._save()
+
+    def forget(self, kind: str | None = None) -> None:
+        with self._lock:
+            if kind is None:
+                self._known.clear()
+            else:
+                for key in [k for k in self._known if k.startswith(f"{kind}|")]:
+                    self._known.pop(key, None)
+            self._failures.clear()
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "max_failures": self.max_failures,
+                "known": dict(self._known),
+                "failures": dict(self._failures),
+            }
+
+
+# 全局端点记忆（同步/异步客户端共用）
+endpoint_memo = EndpointMemo(
+    path=(os.environ.get("LLM_ENDPOINT_CACHE_PATH") or "").strip() or None,
+    max_failures=env_int("LLM_ENDPOINT_MAX_FAILURES", 3),
+)
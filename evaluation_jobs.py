@@ -0,0 +1,181 @@
+"""
+后台评估任务
+
+评估是一次 max_tokens=2000 的长 LLM 调用，原先在 /evaluate 请求里同步执行，结果页要一直等它返回。
+这里把评估放进有界的后台线程池：
+- 每个任务有 job_id 与状态（queued / running / done / error），可轮询或通过 SSE 接收结果
+- 提交时先算好规则分（不依赖 LLM）作为 preview，结果页可立即展示，LLM 评语随后补上
+- 已结束的任务保留 PMTRAINER_EVAL_JOB_TTL 秒后清理
+- 同一会话、同一对话状态（fingerprint）只评估一次：对话最后一轮已提前（投机）开始的评估，
+  会被之后显式的 /evaluate 请求直接复用
+- 任务只保存在当前进程内（多 worker 部署时需要会话粘性）
+
+环境变量：
+- PMTRAINER_EVAL_WORKERS:     评估线程数（默认 4）
+- PMTRAINER_EVAL_MAX_PENDING: 最多允许多少个排队/执行中的任务（默认 32，超出时拒绝新任务）
+- PMTRAINER_EVAL_JOB_TTL:     已结束任务的保留时间，秒（默认 3600）
+"""
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import env_float, env_int
+from llm_scheduler import EVALUATION, llm_context
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+
+class EvaluationQueueFull(Exception):
+    """排队中的评估任务过多"""
+
+
+class EvaluationJob:
+    """单个评估任务"""
+
+    def __init__(self, session_id: str, preview: dict | None = None, fingerprint: str | None = None):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.fingerprint = fingerprint
+        self.status = QUEUED
+        self.preview = preview or {}
+        self.result: dict | None = None
+        self.error = ""
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.future: Future | None = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, ERROR)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """等待任务结束；返回是否已结束"""
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "preview": self.preview,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class EvaluationJobManager:
+    """有界线程池执行评估任务（线程安全）"""
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 32, ttl_seconds: float = 3600.0):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.ttl_seconds = float(ttl_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="evaluation")
+        self._jobs: dict[str, EvaluationJob] = {}
+        self._by_session: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deduplicated = 0
+        self.total_seconds = 0.0
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _sweep(self, now: float) -> None:
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.finished and now - (job.finished_at or now) > self.ttl_seconds]:
+            job = self._jobs.pop(job_id, None)
+            if job is not None and self._by_session.get(job.session_id) == job_id:
+                self._by_session.pop(job.session_id, None)
+
+    def submit(
+        self,
+        session_id: str,
+        run: Callable[[], dict],
+        preview: dict | None = None,
+        fingerprint: str | None = None,
+    ) -> EvaluationJob:
+        """
+        提交评估任务；run() 在后台线程执行并返回评估结果
+
+        fingerprint 相同且未失败的同会话任务已存在时，直接返回该任务（不重复评估）
+        """
+        with self._lock:
+            self._sweep(time.time())
+            existing = self._jobs.get(self._by_session.get(session_id, ""))
+            if fingerprint is not None and existing is not None \
+                    and existing.fingerprint == fingerprint and existing.status != ERROR:
+                self.deduplicated += 1
+                return existing
+            if self._pending() >= self.max_pending:
+                self.rejected += 1
+                raise EvaluationQueueFull(f"评估任务排队过多（{self.max_pending}），请稍后重试")
+            job = EvaluationJob(session_id, preview, fingerprint)
+            self._jobs[job.job_id] = job
+            self._by_session[session_id] = job.job_id
+            job.future = self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: EvaluationJob, run: Callable[[], dict]) -> dict | None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            with llm_context(EVALUATION, job.session_id):
+                job.result = run()
+            job.status = DONE
+        except Exception as e:
+            print(f"[EVAL] 评估任务失败: job_id={job.job_id}, err={type(e).__name__}: {e}")
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = ERROR
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if job.status == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_seconds += job.finished_at - job.started_at
+            job._done.set()
+        return job.result
+
+    def get(self, job_id: str) -> EvaluationJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending(),
+                "jobs": len(self._jobs),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "deduplicated": self.deduplicated,
+                "avg_seconds": round(self.total_seconds / finished, 2) if finished else 0.0,
+            }
+
+
+# 全局评估任务管理器
+evaluation_jobs = EvaluationJobManager(
+    max_workers=env_int("PMTRAINER_EVAL_WORKERS", 4),
+    max_pending=env_int("PMTRAINER_EVAL_MAX_PENDING", 32),
+    ttl_seconds=env_float("PMTRAINER_EVAL_JOB_TTL", 3600.0),
+)
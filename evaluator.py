@@ -3,9 +3,12 @@
 评估产品经理在对话中的表现
 """
 import json
-import re
 from typing import Any, Dict, Optional
 from llm_client import llm_client
+from llm_json import parse_llm_json
+from metrics import timed
+from response_schemas import EVALUATION_REPORT, EVALUATION_SUMMARY
+from text_matcher import compiled_rule_set
 from training_config import get_evaluation_criteria, get_scoring_rules, get_goals_config
 
 
@@ -23,6 +26,7 @@ class ConversationEvaluator:
         self.goals_config = goals_config or get_goals_config()
         self._last_conversation_history: list = []
         
+    @timed("evaluator.evaluate")
     def evaluate(self, conversation_history: list, user_profile: dict, 
                  final_trust_level: int, is_convinced: bool, 
                  concerns_addressed: list, turn_count: int,
@@ -42,6 +46,115 @@ class ConversationEvaluator:
         Returns:
             评估结果
         """
+        messages = self._evaluation_messages(
+            conversation_history, user_profile, final_trust_level,
+            is_convinced, concerns_addressed, turn_count, scenario, mental_state,
+            end_reason=end_reason, end_detail=end_detail
+        )
+        response = llm_client.chat(messages, temperature=0.3, schema=EVALUATION_REPORT, cache="evaluation")
+        return self._apply_evaluation(
+            response, user_profile, final_trust_level, is_convinced, concerns_addressed, turn_count,
+            end_reason=end_reason, end_detail=end_detail,
+        )
+
+    @timed("evaluator.evaluate_incremental")
+    def evaluate_incremental(self, conversation_history: list, user_profile: dict,
+                             final_trust_level: int, is_convinced: bool,
+                             concerns_addressed: list, turn_count: int,
+                             turn_scores: list,
+                             scenario: Optional[dict] = None, mental_state: Optional[dict] = None,
+                             end_reason: Optional[str] = None, end_detail: Optional[dict] = None) -> dict:
+        """
+        基于逐轮分数（见 incremental_evaluator.py）生成最终评估：
+        维度分取各轮平均，只用一次简短的总结调用生成亮点/改进/评语，不再发送整段对话
+        """
+        scores = {}
+        for key in self.criteria or {}:
+            values = [t["scores"][key] for t in turn_scores if key in (t.get("scores") or {})]
+            if values:
+                scores[key] = round(sum(values) / len(values), 1)
+
+        lines = []
+        for t in turn_scores:
+            avg = sum(t["scores"].values()) / max(1, len(t["scores"]))
+            lines.append(f"- 第{t['turn']}轮: 平均{avg:.0f}分，信任度变化 {t.get('trust_change', 0):+d}；{t.get('note') or ''}")
+
+        prompt = f"""以下是一位产品经理与潜在用户对话中，每一轮发言的打分与点评。请据此写出整体评估。
+
+## 用户背景
+- {user_profile['name']}，{user_profile['age']}岁，{user_profile['occupation']}
+- 主要顾虑: {', '.join(user_profile['pain_points'])}
+- 场景: {(scenario or {}).get('name') or '无（未配置）'}
+- 心理状态: {(mental_state or {}).get('name') or '无（未配置）'}
+
+## 逐轮打分
+{chr(10).join(lines)}
+
+## 各维度平均分
+{json.dumps(scores, ensure_ascii=False)}
+
+## 对话结果
+- 对话轮数: {turn_count}轮
+- 最终信任度: {final_trust_level}/10
+- 是否成功说服开户: {'是' if is_convinced else '否'}
+- 解答的顾虑: {concerns_addressed if concerns_addressed else '无'}
+- 结束原因: {end_reason or '未知'}
+- 结束补充信息: {end_detail if end_detail else '无'}
+
+请用JSON格式返回：
+{{
+    "highlights": ["做得好的地方1", "做得好的地方2", ...],
+    "improvements": ["需要改进的地方1", "需要改进的地方2", ...],
+    "key_insights": "关于用户sense的关键洞察",
+    "overall_comment": "总体评价",
+    "end_explanation": "用通俗的话解释：为什么对话会在这里结束"
+}}"""
+        self._last_conversation_history = conversation_history or []
+        messages = [
+            {"role": "system", "content": "你是一个专业的产品经理培训评估专家，需要对产品经理与用户的对话进行专业评估。"},
+            {"role": "user", "content": prompt}
+        ]
+        response = llm_client.chat(messages, temperature=0.3, max_tokens=800, schema=EVALUATION_SUMMARY,
+                                   cache="evaluation_summary")
+        result = self._apply_evaluation(
+            response, user_profile, final_trust_level, is_convinced, concerns_addressed, turn_count,
+            end_reason=end_reason, end_detail=end_detail, scores=scores,
+        )
+        result["turn_scores"] = turn_scores
+        return result
+
+    def rule_based_preview(self, conversation_history: list, user_profile: dict,
+                           final_trust_level: int, is_convinced: bool,
+                           concerns_addressed: list, turn_count: int,
+                           end_reason: Optional[str] = None, end_detail: Optional[dict] = None) -> dict:
+        """
+        只计算规则分与结束原因说明（不调用 LLM），用于 LLM 评语生成期间先行展示
+        """
+        scoring_breakdown = self._compute_rule_based_score(
+            final_trust_level=final_trust_level,
+            is_convinced=is_convinced,
+            concerns_addressed=concerns_addressed,
+            turn_count=turn_count,
+            user_profile=user_profile,
+            conversation_history=conversation_history,
+        )
+        return {
+            "total_score": scoring_breakdown["total_score"],
+            "scoring_breakdown": scoring_breakdown,
+            "end_explanation": self._build_end_explanation(
+                end_reason=end_reason,
+                end_detail=end_detail,
+                final_trust_level=final_trust_level,
+                turn_count=turn_count,
+            ),
+        }
+
+    def _evaluation_messages(self, conversation_history: list, user_profile: dict,
+                             final_trust_level: int, is_convinced: bool,
+                             concerns_addressed: list, turn_count: int,
+                             scenario: Optional[dict] = None, mental_state: Optional[dict] = None,
+                             end_reason: Optional[str] = None, end_detail: Optional[dict] = None) -> list:
+        """构建评估请求的消息列表"""
         # 构建评估提示词
         self._last_conversation_history = conversation_history or []
         evaluation_prompt = self._build_evaluation_prompt(
@@ -50,25 +163,23 @@ class ConversationEvaluator:
             end_reason=end_reason, end_detail=end_detail
         )
         
-        messages = [
+        return [
             {"role": "system", "content": "你是一个专业的产品经理培训评估专家，需要对产品经理与用户的对话进行专业评估。"},
             {"role": "user", "content": evaluation_prompt}
         ]
-        
-        response = llm_client.chat(messages, temperature=0.3)
-        
-        try:
-            # 尝试解析JSON
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0]
-            else:
-                json_str = response
-            
-            result = json.loads(json_str.strip())
 
-            # 计算可解释的规则分（由配置控制）
+    def _apply_evaluation(self, response: str, user_profile: dict,
+                          final_trust_level: int, is_convinced: bool,
+                          concerns_addressed: list, turn_count: int,
+                          end_reason: Optional[str] = None, end_detail: Optional[dict] = None,
+                          scores: Optional[dict] = None, scoring_breakdown: Optional[dict] = None) -> dict:
+        """
+        解析 LLM 评估结果，并合并规则分/结束原因；解析失败时返回默认评估
+
+        scores 非空时（逐轮评估汇总的维度分）覆盖 LLM 返回的维度分；
+        scoring_breakdown 非空时（如批量评估已在进程池中算好）直接使用，不再重复计算规则分
+        """
+        if scoring_breakdown is None:
             scoring_breakdown = self._compute_rule_based_score(
                 final_trust_level=final_trust_level,
                 is_convinced=is_convinced,
@@ -76,13 +187,19 @@ class ConversationEvaluator:
                 turn_count=turn_count,
                 user_profile=user_profile,
             )
+        try:
+            result = parse_llm_json(response, "evaluation")
+            if result is None:
+                raise ValueError("评估结果中没有 JSON 对象")
+            if scores:
+                result["scores"] = scores
 
             # 保留 LLM 维度评分，但以规则分作为 total_score（更可控、更可配置）
-            scores = result.get("scores") if isinstance(result, dict) else None
-            if not isinstance(scores, dict):
-                scores = {}
+            llm_scores = result.get("scores") if isinstance(result, dict) else None
+            if not isinstance(llm_scores, dict):
+                llm_scores = {}
 
-            llm_weighted = calculate_weighted_score(scores, criteria=self.criteria)
+            llm_weighted = calculate_weighted_score(llm_scores, criteria=self.criteria)
 
             result["llm_weighted_score"] = llm_weighted
             result["scoring_breakdown"] = scoring_breakdown
@@ -108,14 +225,10 @@ class ConversationEvaluator:
                 final_trust_level=final_trust_level,
                 turn_count=turn_count,
             )
-            fallback["scoring_breakdown"] = self._compute_rule_based_score(
-                final_trust_level=final_trust_level,
-                is_convinced=is_convinced,
-                concerns_addressed=concerns_addressed,
-                turn_count=turn_count,
-                user_profile=user_profile,
-            )
+            fallback["scoring_breakdown"] = scoring_breakdown
             fallback["total_score"] = fallback["scoring_breakdown"]["total_score"]
+            if scores:
+                fallback["scores"] = scores
             return fallback
     
     def _build_evaluation_prompt(self, conversation_history: list, 
@@ -203,7 +316,6 @@ class ConversationEvaluator:
         "persuasion": 分数,
         "professionalism": 分数
     }},
-    "total_score": 加权总分,
     "highlights": ["做得好的地方1", "做得好的地方2", ...],
     "improvements": ["需要改进的地方1", "需要改进的地方2", ...],
     "key_insights": "关于用户sense的关键洞察",
@@ -289,8 +401,9 @@ class ConversationEvaluator:
         concerns_addressed: list,
         turn_count: int,
         user_profile: dict,
+        conversation_history: Optional[list] = None,
     ) -> Dict[str, Any]:
-        """按 scoring_rules 生成可解释的规则分（可配置）"""
+        """按 scoring_rules 生成可解释的规则分（可配置）；未传 conversation_history 时使用最近一次评估的对话"""
         r = self.scoring_rules or {}
         base_score = int(r.get("base_score", 50))
         success_bonus = int(r.get("success_bonus", 20))
@@ -305,7 +418,8 @@ class ConversationEvaluator:
         # 提取 PM 话术（conversation_history 中 role=user 代表产品经理）
         pm_messages = []
         try:
-            for msg in (self._last_conversation_history or []):  # type: ignore[attr-defined]
+            history = conversation_history if conversation_history is not None else self._last_conversation_history
+            for msg in (history or []):
                 if isinstance(msg, dict) and msg.get("role") == "user":
                     pm_messages.append(str(msg.get("content") or ""))
         except Exception:
@@ -331,45 +445,24 @@ class ConversationEvaluator:
                 score += fast_bonus
                 parts.append({"name": "效率奖励", "delta": fast_bonus, "detail": f"turns≤{fast_turns_threshold}"})
 
-        # 话术规则加/扣分（可配置）
+        # 话术规则加/扣分（可配置）：规则在配置加载时已编译，一次扫描得到每条规则的命中位置
         def apply_rules(rule_list, kind: str):
             nonlocal score
             if not isinstance(rule_list, list):
                 return
-            lower_text = pm_text.lower()
-            for rule in rule_list:
-                if not isinstance(rule, dict):
-                    continue
+            compiled = compiled_rule_set(rule_list)
+            hits = compiled.match(pm_text, max_hits=5)
+            for idx, rule in enumerate(compiled.rules):
                 delta = int(rule.get("delta", 0) or 0)
-                if delta == 0:
+                if delta == 0 or idx not in hits:
                     continue
-                hit = False
-
-                keyword_any = rule.get("keyword_any") or []
-                if keyword_any:
-                    for k in keyword_any:
-                        ks = str(k).lower()
-                        if ks and ks in lower_text:
-                            hit = True
-                            break
-
-                regex_any = rule.get("regex_any") or []
-                if not hit and regex_any:
-                    for pat in regex_any:
-                        try:
-                            if re.search(str(pat), pm_text, flags=re.IGNORECASE):
-                                hit = True
-                                break
-                        except Exception:
-                            continue
-
-                if hit:
-                    score += delta
-                    parts.append({
-                        "name": f"{'加分' if kind == 'bonus' else '扣分'}：{rule.get('name') or rule.get('id')}",
-                        "delta": delta,
-                        "rule_id": rule.get("id"),
-                    })
+                score += delta
+                parts.append({
+                    "name": f"{'加分' if kind == 'bonus' else '扣分'}：{rule.get('name') or rule.get('id')}",
+                    "delta": delta,
+                    "rule_id": rule.get("id"),
+                    "hits": [{"start": start, "end": end, "text": pm_text[start:end]} for start, end in hits[idx]],
+                })
 
         apply_rules(bonuses, "bonus")
         apply_rules(penalties, "penalty")
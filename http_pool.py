@@ -0,0 +1,207 @@
+"""
+LLM 后端 HTTP 连接池
+
+每个后端（远程 / Ollama 原生 / Ollama OpenAI 兼容）各自持有一个 requests.Session：
+- keep-alive 复用 TCP/TLS 连接，避免每轮对话重新握手
+- 连接池大小、重试次数、退避系数可通过环境变量配置
+- 暴露连接池统计（新建连接数 vs 请求数），便于确认 socket 是否被复用
+- 新建连接时记录建连（DNS + TCP，llm.connect）与 TLS 握手（llm.tls）耗时（见 metrics.py）
+
+环境变量（均可按后端覆盖，后缀为大写后端名，如 LLM_HTTP_POOL_MAXSIZE_OLLAMA_NATIVE）：
+- LLM_HTTP_POOL_CONNECTIONS: 每个 Session 缓存的 host 连接池数量（默认 4）
+- LLM_HTTP_POOL_MAXSIZE:     每个 host 最多保留的长连接数（默认 16）
+- LLM_HTTP_RETRIES:          连接失败/429/5xx 网关错误的重试次数（默认 2）
+- LLM_HTTP_BACKOFF:          重试退避系数，秒（默认 0.5）
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from config import env_float, env_int
+from metrics import observe_stage
+
+
+BACKENDS = ("remote", "ollama_native", "ollama_openai")
+
+# 仅对“请求大概率没被模型处理”的状态码重试，避免重复生成
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+def _backend_env_int(name: str, backend: str, default: int) -> int:
+    return env_int(f"{name}_{backend.upper()}", env_int(name, default))
+
+
+def _backend_env_float(name: str, backend: str, default: float) -> float:
+    return env_float(f"{name}_{backend.upper()}", env_float(name, default))
+
+
+class _TimedConnectMixin:
+    """记录新建连接的耗时：_new_conn 为 DNS 解析 + TCP 建连，HTTPS 的 connect 在其后完成 TLS 握手"""
+
+    _tcp_seconds = 0.0
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            self._tcp_seconds = time.perf_counter() - started
+            observe_stage("llm.connect", self._tcp_seconds)
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    def connect(self) -> None:
+        started = time.perf_counter()
+        self._tcp_seconds = 0.0
+        super().connect()
+        observe_stage("llm.tls", max(0.0, time.perf_counter() - started - self._tcp_seconds))
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class PooledTransport:
+    """单个后端的连接池传输层（线程安全，可被多个 Flask 线程共享）"""
+
+    def __init__(
+        self,
+        name: str,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        retries: int = 2,
+        backoff_factor: float = 0.5,
+    ):
+        self.name = name
+        self.pool_connections = max(1, int(pool_connections))
+        self.pool_maxsize = max(1, int(pool_maxsize))
+        self.retries = max(0, int(retries))
+        self.backoff_factor = max(0.0, float(backoff_factor))
+
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,  # 读超时说明模型已在生成，不重试
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=False,
+        )
+        self._adapter.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._total_seconds = 0.0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        started = time.monotonic()
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._requests += 1
+                self._total_seconds += time.monotonic() - started
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> dict:
+        """连接池统计：num_connections 远小于 num_requests 即说明连接在被复用"""
+        pools = []
+        try:
+            manager = self._adapter.poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                idle = sum(1 for c in list(pool.pool.queue) if c is not None) if pool.pool is not None else 0
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "num_connections": pool.num_connections,
+                    "num_requests": pool.num_requests,
+                    "idle_connections": idle,
+                })
+        except Exception:
+            pools = []
+
+        with self._lock:
+            requests_count = self._requests
+            errors = self._errors
+            total_seconds = self._total_seconds
+        return {
+            "backend": self.name,
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "retries": self.retries,
+            "backoff_factor": self.backoff_factor,
+            "requests": requests_count,
+            "errors": errors,
+            "avg_seconds": round(total_seconds / requests_count, 4) if requests_count else 0.0,
+            "pools": pools,
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_TRANSPORTS: dict[str, PooledTransport] = {}
+_TRANSPORTS_LOCK = threading.Lock()
+
+
+def get_transport(backend: str) -> PooledTransport:
+    """获取（必要时创建）某个后端的共享连接池"""
+    with _TRANSPORTS_LOCK:
+        transport = _TRANSPORTS.get(backend)
+        if transport is None:
+            transport = PooledTransport(
+                backend,
+                pool_connections=_backend_env_int("LLM_HTTP_POOL_CONNECTIONS", backend, 4),
+                pool_maxsize=_backend_env_int("LLM_HTTP_POOL_MAXSIZE", backend, 16),
+                retries=_backend_env_int("LLM_HTTP_RETRIES", backend, 2),
+                backoff_factor=_backend_env_float("LLM_HTTP_BACKOFF", backend, 0.5),
+            )
+            _TRANSPORTS[backend] = transport
+        return transport
+
+
+def pool_stats() -> dict:
+    """所有已创建连接池的统计信息"""
+    with _TRANSPORTS_LOCK:
+        transports = list(_TRANSPORTS.values())
+    return {t.name: t.stats() for t in transports}
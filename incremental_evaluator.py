@@ -0,0 +1,210 @@
+"""
+逐轮增量评估
+
+原先评估在会话结束时把整段对话拼成一个大提示词：token 数与对话长度成正比，延迟全部压在结果页上。
+这里在对话进行中，每轮产品经理发言后由后台线程单独打分（可配置更便宜的模型）：
+- 每轮只发送该轮的 PM 发言与用户反应，提示词很短
+- 结束时 ConversationEvaluator.evaluate_incremental 只需合并逐轮分数并做一次简短总结
+- 副产品：逐轮分数曲线（/api/session/<id>/turn-scores）
+- 有轮次缺失（打分失败/未完成）时，结束评估回退为原来的整段评估
+- 分数只保存在当前进程内（多 worker 部署时需要会话粘性）
+
+环境变量：
+- PMTRAINER_TURN_EVAL:         是否启用逐轮评估（默认 1）
+- PMTRAINER_TURN_EVAL_MODEL:   逐轮打分使用的远程模型（默认与 LLM_MODEL 相同）
+- PMTRAINER_TURN_EVAL_WORKERS: 后台打分线程数（默认 2）
+- PMTRAINER_TURN_EVAL_WAIT:    结束评估时最多等待未完成的逐轮打分多少秒（默认 20）
+- PMTRAINER_TURN_EVAL_TTL:     会话逐轮分数的保留时间，秒（默认 7200）
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import env_bool, env_float, env_int
+from llm_client import llm_client
+from llm_json import parse_llm_json
+from llm_scheduler import EVALUATION, llm_context
+from response_schemas import DIMENSIONS, TURN_SCORE
+
+
+class _SessionScores:
+    __slots__ = ("turns", "inflight", "touched_at", "cond")
+
+    def __init__(self, lock: threading.Lock):
+        self.turns: dict[int, dict] = {}
+        self.inflight: set[int] = set()
+        self.touched_at = time.monotonic()
+        self.cond = threading.Condition(lock)
+
+
+class IncrementalEvaluator:
+    """在后台为每轮 PM 发言打分，并按会话保存结果（线程安全）"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        model: str | None = None,
+        max_workers: int = 2,
+        wait_seconds: float = 20.0,
+        ttl_seconds: float = 7200.0,
+    ):
+        self.enabled = bool(enabled)
+        self.model = model or None
+        self.wait_seconds = float(wait_seconds)
+        self.ttl_seconds = float(ttl_seconds)
+        self._max_workers = max(1, int(max_workers))
+        self._executor: ThreadPoolExecutor | None = None
+        self._sessions: dict[str, _SessionScores] = {}
+        self._lock = threading.Lock()
+        self.scored = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def _session(self, session_id: str) -> _SessionScores:
+        # 调用方需持有 self._lock
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items()
+                    if not s.inflight and now - s.touched_at > self.ttl_seconds]:
+            self._sessions.pop(sid, None)
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = _SessionScores(self._lock)
+        entry.touched_at = now
+        return entry
+
+    def submit_turn(self, session_id: str, turn: int, user_profile: dict,
+                    pm_message: str, previous_user_message: str, user_reply: dict) -> None:
+        """在后台为第 turn 轮打分"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._session(session_id)
+            if turn in entry.turns or turn in entry.inflight:
+                return
+            entry.inflight.add(turn)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="turn-eval")
+            executor = self._executor
+        executor.submit(self._run, session_id, turn, user_profile, pm_message, previous_user_message, user_reply)
+
+    def _run(self, session_id: str, turn: int, user_profile: dict,
+             pm_message: str, previous_user_message: str, user_reply: dict) -> None:
+        started = time.monotonic()
+        result = None
+        try:
+            with llm_context(EVALUATION, session_id):
+                result = self.score_turn(user_profile, pm_message, previous_user_message, user_reply)
+        except Exception as e:
+            print(f"[EVAL] 逐轮打分异常: session_id={session_id}, turn={turn}, err={type(e).__name__}: {e}")
+        with self._lock:
+            entry = self._session(session_id)
+            entry.inflight.discard(turn)
+            if result is not None:
+                try:
+                    trust_change = int(user_reply.get("trust_change", 0) or 0)
+                except (TypeError, ValueError):
+                    trust_change = 0
+                result["turn"] = turn
+                result["trust_change"] = trust_change
+                entry.turns[turn] = result
+                self.scored += 1
+            else:
+                self.failed += 1
+            self.total_seconds += time.monotonic() - started
+            entry.cond.notify_all()
+
+    def score_turn(self, user_profile: dict, pm_message: str,
+                   previous_user_message: str, user_reply: dict) -> dict | None:
+        """同步为一轮 PM 发言打分；失败返回 None"""
+        prompt = f"""请只针对产品经理这一轮的发言打分。
+
+## 用户背景
+{user_profile.get('name')}，{user_profile.get('age')}岁，{user_profile.get('occupation')}；主要顾虑：{', '.join(user_profile.get('pain_points') or [])}
+
+## 用户上一句话
+{previous_user_message or '（无）'}
+
+## 产品经理本轮发言
+{pm_message}
+
+## 用户的反应
+- 回复: {user_reply.get('response')}
+- 内心想法: {user_reply.get('inner_thought')}
+- 信任度变化: {user_reply.get('trust_change', 0)}
+
+请从以下维度打分（每项0-100分）：沟通技巧 communication_skills、同理心 empathy、问题解决 problem_solving、
+说服力 persuasion、专业度 professionalism。
+
+用JSON格式回复：
+{{
+    "scores": {{"communication_skills": 分数, "empathy": 分数, "problem_solving": 分数, "persuasion": 分数, "professionalism": 分数}},
+    "note": "一句话点评本轮发言"
+}}"""
+        messages = [
+            {"role": "system", "content": "你是一个专业的产品经理培训评估专家，需要对产品经理的单轮发言进行打分。"},
+            {"role": "user", "content": prompt},
+        ]
+        response_text = llm_client.chat(messages, temperature=0.2, max_tokens=300, timeout=60, model=self.model,
+                                        schema=TURN_SCORE, cache="turn_evaluation")
+        if not response_text or response_text.startswith("["):
+            return None
+        data = parse_llm_json(response_text, "turn_evaluation")
+        if data is None:
+            return None
+        try:
+            scores = {k: max(0, min(100, int(float(data["scores"][k])))) for k in DIMENSIONS}
+        except Exception:
+            return None
+        return {"scores": scores, "note": str(data.get("note") or "")}
+
+    def turn_scores(self, session_id: str) -> list[dict]:
+        """当前已完成的逐轮分数（按轮次排序）"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            return [dict(entry.turns[t]) for t in sorted(entry.turns)]
+
+    def collect(self, session_id: str, turn_count: int, timeout: float | None = None) -> list[dict] | None:
+        """
+        等待第 1..turn_count 轮的打分完成并返回；仍有缺失（失败或超时）时返回 None
+        """
+        if not self.enabled or turn_count <= 0:
+            return None
+        deadline = time.monotonic() + (self.wait_seconds if timeout is None else timeout)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            while True:
+                missing = [t for t in range(1, turn_count + 1) if t not in entry.turns]
+                if not missing:
+                    return [dict(entry.turns[t]) for t in range(1, turn_count + 1)]
+                remaining = deadline - time.monotonic()
+                if not any(t in entry.inflight for t in missing) or remaining <= 0:
+                    return None
+                entry.cond.wait(remaining)
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.scored + self.failed
+            return {
+                "enabled": self.enabled,
+                "model": self.model or llm_client.model,
+                "sessions": len(self._sessions),
+                "inflight": sum(len(s.inflight) for s in self._sessions.values()),
+                "scored": self.scored,
+                "failed": self.failed,
+                "avg_seconds": round(self.total_seconds / finished, 2) if finished else 0.0,
+            }
+
+
+# 全局逐轮评估器
+incremental_evaluator = IncrementalEvaluator(
+    enabled=env_bool("PMTRAINER_TURN_EVAL", True),
+    model=(os.environ.get("PMTRAINER_TURN_EVAL_MODEL") or "").strip() or None,
+    max_workers=env_int("PMTRAINER_TURN_EVAL_WORKERS", 2),
+    wait_seconds=env_float("PMTRAINER_TURN_EVAL_WAIT", 20.0),
+    ttl_seconds=env_float("PMTRAINER_TURN_EVAL_TTL", 7200.0),
+)
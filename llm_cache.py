@@ -0,0 +1,258 @@
+"""
+LLM 回复缓存（按请求内容寻址）
+
+评估类调用温度很低（0.2~0.3），而回放、回归测试、结果页重复点击时会把同一份对话再发一遍。
+这里在 LLMClient.chat 前加一层缓存：
+- 键为 (规范化后的消息, 模型, 温度, max_tokens, 回复格式) 的 sha256；
+  规范化只去掉不影响语义的差异（首尾空白、行尾空白、\r\n），角色与内容顺序保持不变
+- 后端: memory（进程内 LRU）/ sqlite（磁盘持久化，可被多个 worker 共享、重启后仍可命中）
+- 按调用方开启：调用 chat(..., cache="evaluation") 时，只有 LLM_CACHE_SITES 中列出的调用方才读写缓存
+- llm_client 出错时返回的 "[...]" 提示不会写入缓存
+
+环境变量：
+- LLM_CACHE:             memory（默认）/ sqlite / off
+- LLM_CACHE_PATH:        sqlite 文件路径（默认项目根目录 llm_cache.db）
+- LLM_CACHE_MAX_ENTRIES: 最多缓存多少条回复（默认 1000，超出按最近最少使用淘汰）
+- LLM_CACHE_TTL:         缓存有效期，秒（默认 604800，即 7 天；0 表示不过期）
+- LLM_CACHE_SITES:       启用缓存的调用方，逗号分隔（默认 evaluation,evaluation_summary,turn_evaluation）
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import env_float, env_int
+
+
+DEFAULT_SITES = ("evaluation", "evaluation_summary", "turn_evaluation")
+
+
+def _normalize_text(text: str) -> str:
+    lines = str(text or "").replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(messages: list, model: str, temperature: float, max_tokens: int, schema: dict | None = None) -> str:
+    """请求内容的 sha256（十六进制）"""
+    normalized = [[str(m.get("role") or ""), _normalize_text(m.get("content"))] for m in messages]
+    raw = json.dumps(
+        {
+            "messages": normalized,
+            "model": model,
+            "temperature": round(float(temperature), 4),
+            "max_tokens": int(max_tokens),
+            "schema": (schema or {}).get("name"),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """缓存接口；命中/未命中按调用方统计"""
+
+    def __init__(self, sites: set[str] | None = None):
+        self.sites = set(DEFAULT_SITES if sites is None else sites)
+        self._stats_lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+
+    def enabled_for(self, site: str | None) -> bool:
+        return bool(site) and site in self.sites
+
+    def _count(self, site: str, field: str) -> None:
+        with self._stats_lock:
+            counts = self._counts.setdefault(site, {"hits": 0, "misses": 0, "stores": 0})
+            counts[field] += 1
+
+    def lookup(self, site: str, key: str) -> str | None:
+        value = self.get(key)
+        self._count(site, "hits" if value is not None else "misses")
+        return value
+
+    def store(self, site: str, key: str, value: str) -> None:
+        if not value or value.startswith("["):
+            return
+        self.put(key, value)
+        self._count(site, "stores")
+
+    def get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    def put(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            by_site = {site: dict(counts) for site, counts in self._counts.items()}
+        hits = sum(c["hits"] for c in by_site.values())
+        misses = sum(c["misses"] for c in by_site.values())
+        return {
+            "backend": type(self).__name__,
+            "entries": len(self),
+            "sites": sorted(self.sites),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "by_site": by_site,
+        }
+
+
+class NullResponseCache(ResponseCache):
+    """关闭缓存（LLM_CACHE=off）"""
+
+    def __init__(self):
+        super().__init__(sites=set())
+
+    def get(self, key: str) -> str | None:
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+
+class MemoryResponseCache(ResponseCache):
+    """进程内 LRU（线程安全）"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 0.0, sites: set[str] | None = None):
+        super().__init__(sites)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl_seconds > 0 and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({"max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds, "evicted": self.evicted})
+        return stats
+
+
+class SQLiteResponseCache(ResponseCache):
+    """SQLite（WAL）磁盘缓存：多个 worker 共享，重启后仍可命中"""
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl_seconds: float = 0.0, sites: set[str] | None = None):
+        super().__init__(sites)
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._local = threading.local()
+        self._puts = 0
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_used_at ON llm_cache(used_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享：每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds > 0 and now - float(row[1]) > self.ttl_seconds:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO llm_cache(key, response, created_at, used_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET response = excluded.response, "
+            "created_at = excluded.created_at, used_at = excluded.used_at",
+            (key, value, now, now),
+        )
+        self._puts += 1
+        # 不必每次写入都裁剪：每 50 次写入按最近使用时间淘汰一次
+        if self._puts % 50 == 1:
+            if self.ttl_seconds > 0:
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        conn.commit()
+
+    def __len__(self) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        return int(row[0]) if row else 0
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({"max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds, "path": self.path})
+        return stats
+
+
+def create_response_cache() -> ResponseCache:
+    """按环境变量创建回复缓存"""
+    backend = (os.environ.get("LLM_CACHE") or "memory").strip().lower()
+    if backend in ("off", "none", "0", "false"):
+        return NullResponseCache()
+    sites_env = os.environ.get("LLM_CACHE_SITES")
+    sites = None if sites_env is None else {s.strip() for s in sites_env.split(",") if s.strip()}
+    max_entries = env_int("LLM_CACHE_MAX_ENTRIES", 1000)
+    ttl = env_float("LLM_CACHE_TTL", 604800.0)
+    if backend == "sqlite":
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        path = (os.environ.get("LLM_CACHE_PATH") or "").strip() or os.path.join(base_dir, "llm_cache.db")
+        print(f"[LLM] 使用 SQLite 回复缓存: {path}")
+        return SQLiteResponseCache(path, max_entries=max_entries, ttl_seconds=ttl, sites=sites)
+    return MemoryResponseCache(max_entries=max_entries, ttl_seconds=ttl, sites=sites)
+
+
+# 全局 LLM 回复缓存
+llm_cache = create_response_cache()
@@ -0,0 +1,203 @@
+"""
+LLM 调用录制/回放（cassette）
+
+测试或压测 UserSimulator、ConversationEvaluator、Flask 路由都需要真实的 DashScope key 或本地 Ollama。
+这里在 LLMClient.chat / chat_stream（及异步 chat）外加一层录制/回放：
+- record: 照常调用 LLM，把每次成功的回复（含耗时、流式分段的到达时间）追加写入磁带文件
+- replay: 完全不联网，按请求内容从磁带中取回复；同一请求录到多条时按录制顺序依次返回（用完后重复最后一条），
+          保证同样的调用序列得到同样的结果；磁带中没有的请求返回 "[...]" 错误提示
+- auto:   能回放的回放，回放不到的照常调用 LLM 并录制（增量补全磁带）
+- 回放时可按录制时的耗时模拟延迟（LLM_CASSETTE_LATENCY 为倍率，0 表示不等待）
+
+磁带文件为 JSON Lines（路径以 .gz 结尾时 gzip 压缩），每行一条：
+{"key", "model", "response", "latency", "chunks": [[到达时间, 文本], ...]（仅流式）, "recorded_at"}
+请求键与回复缓存一致（见 llm_cache.cache_key），磁带中不保存消息原文。
+
+环境变量：
+- LLM_CASSETTE_MODE:    off（默认）/ record / replay / auto
+- LLM_CASSETTE_PATH:    磁带文件路径（默认项目根目录 cassettes/llm.jsonl.gz）
+- LLM_CASSETTE_LATENCY: 回放延迟倍率（默认 0；1 表示按录制时的耗时等待）
+"""
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Iterator
+
+from config import env_float
+
+
+MODES = ("off", "record", "replay", "auto")
+
+MISS_REPLY = "[回放磁带中没有匹配的请求]"
+
+
+def _open_text(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class LLMCassette:
+    """按请求键录制/回放 LLM 回复（线程安全）"""
+
+    def __init__(self, mode: str = "off", path: str = "", latency_scale: float = 0.0):
+        mode = (mode or "off").strip().lower()
+        self.mode = mode if mode in MODES else "off"
+        self.path = path
+        self.latency_scale = max(0.0, float(latency_scale))
+        self._entries: dict[str, list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self._writer = None
+        self._lock = threading.Lock()
+        self.loaded = 0
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if self.replaying:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode in ("replay", "auto")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode in ("record", "auto")
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            print(f"[CASSETTE] 磁带文件不存在，回放将全部未命中: {self.path}")
+            return
+        try:
+            with _open_text(self.path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+                    self.loaded += 1
+        except (EOFError, OSError, ValueError, KeyError) as e:
+            # 录制进程被强杀时 gzip 尾部可能不完整：保留已读到的记录
+            print(f"[CASSETTE] 读取磁带中断，已载入 {self.loaded} 条: path={self.path}, err={type(e).__name__}: {e}")
+        print(f"[CASSETTE] 回放模式: mode={self.mode}, path={self.path}, 记录数={self.loaded}")
+
+    def _next(self, key: str) -> dict | None:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            idx = self._cursor.get(key, 0)
+            self._cursor[key] = idx + 1
+            self.replayed += 1
+            return entries[min(idx, len(entries) - 1)]
+
+    def lookup(self, key: str) -> tuple[str | None, float]:
+        """
+        回放一次非流式调用，返回 (回复, 应等待的秒数)
+
+        回复为 None 表示应照常调用 LLM（auto 模式未命中）；replay 模式未命中时返回 MISS_REPLY
+        """
+        if not self.replaying:
+            return None, 0.0
+        entry = self._next(key)
+        if entry is None:
+            return (MISS_REPLY if self.mode == "replay" else None), 0.0
+        return entry["response"], float(entry.get("latency") or 0.0) * self.latency_scale
+
+    def lookup_stream(self, key: str) -> list[tuple[float, str]] | None:
+        """回放一次流式调用，返回 [(距上一段的等待秒数, 文本), ...]；None 含义同 lookup"""
+        if not self.replaying:
+            return None
+        entry = self._next(key)
+        if entry is None:
+            return [(0.0, MISS_REPLY)] if self.mode == "replay" else None
+        chunks = entry.get("chunks") or [[entry.get("latency") or 0.0, entry["response"]]]
+        timeline = []
+        previous = 0.0
+        for at, text in chunks:
+            at = float(at)
+            timeline.append((max(0.0, at - previous) * self.latency_scale, text))
+            previous = at
+        return timeline
+
+    def record(self, key: str, model: str, response: str, latency: float,
+               chunks: list[tuple[float, str]] | None = None) -> None:
+        """录制一次成功的调用（"[...]" 错误提示不录制）"""
+        if not self.recording or not response or response.startswith("["):
+            return
+        entry = {
+            "key": key,
+            "model": model,
+            "response": response,
+            "latency": round(float(latency), 4),
+            "recorded_at": round(time.time(), 3),
+        }
+        if chunks is not None:
+            entry["chunks"] = [[round(at, 4), text] for at, text in chunks]
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._writer is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._writer = _open_text(self.path, "a")
+                atexit.register(self.close)
+            self._writer.write(line)
+            # 每条都刷新到文件：进程异常退出时已录制的记录仍可读
+            self._writer.flush()
+            self._entries.setdefault(key, []).append(entry)
+            self.recorded += 1
+
+    def record_stream(self, key: str, model: str, chunks: list[tuple[float, str]]) -> None:
+        """录制一次流式调用：chunks 为 [(距开始的秒数, 文本), ...]"""
+        if not chunks:
+            return
+        self.record(key, model, "".join(text for _, text in chunks), chunks[-1][0], chunks)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path if self.enabled else "",
+                "latency_scale": self.latency_scale,
+                "loaded": self.loaded,
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses,
+            }
+
+
+def replay_stream(timeline: list[tuple[float, str]]) -> Iterator[str]:
+    """按时间线逐段产出回放的流式回复（同步等待）"""
+    for delay, text in timeline:
+        if delay > 0:
+            time.sleep(delay)
+        yield text
+
+
+def create_cassette() -> LLMCassette:
+    """按环境变量创建录制/回放器"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    path = (os.environ.get("LLM_CASSETTE_PATH") or "").strip() or os.path.join(base_dir, "cassettes", "llm.jsonl.gz")
+    return LLMCassette(
+        mode=os.environ.get("LLM_CASSETTE_MODE") or "off",
+        path=path,
+        latency_scale=env_float("LLM_CASSETTE_LATENCY", 0.0),
+    )
+
+
+# 全局录制/回放器
+llm_cassette = create_cassette()
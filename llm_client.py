@@ -4,7 +4,19 @@ LLM API 客户端
 import requests
 import json
 import os
+import time
+from typing import Iterator
+from circuit_breaker import circuit_breakers
 from config import LLM_CONFIG
+from endpoint_memo import endpoint_memo
+from http_pool import get_transport, pool_stats
+from llm_cache import cache_key, llm_cache
+from llm_cassette import llm_cassette, replay_stream
+from llm_scheduler import BUSY_REPLY, LLMBusy, SlotHolder, llm_scheduler
+from metrics import current_labels, llm_calls, llm_requests, observe_stage, span, stage_labels, timed
+from model_availability import model_availability
+from prompt_cache import prefix_cache_stats
+from response_schemas import structured_output
 
 
 class LLMClient:
@@ -12,6 +24,24 @@ class LLMClient:
         self.url = LLM_CONFIG["url"]
         self.api_key = LLM_CONFIG["api_key"]
         self.model = LLM_CONFIG["model"]
+        # 每个后端一个长连接池：多轮对话复用同一条 TCP/TLS 连接
+        self.transports = {
+            "remote": get_transport("remote"),
+            "ollama_native": get_transport("ollama_native"),
+            "ollama_openai": get_transport("ollama_openai"),
+        }
+
+    def pool_stats(self) -> dict:
+        """各后端连接池统计（供 /api/llm/status 诊断）"""
+        return pool_stats()
+
+    def endpoint_stats(self) -> dict:
+        """已确认可用的聊天端点（供 /api/llm/status 诊断）"""
+        return endpoint_memo.stats()
+
+    def breaker_stats(self) -> dict:
+        """各端点熔断器状态（供 /api/llm/status 诊断）"""
+        return circuit_breakers.stats()
 
     def _ollama_base_url(self) -> str:
         # Ollama 默认监听 11434；支持 OpenAI 兼容 /v1/chat/completions（新版本）
@@ -47,26 +77,45 @@ class LLMClient:
             f"{base}/v1/chat/completions",  # OpenAI compatible
         ]
 
-    def _ollama_tags(self) -> tuple[bool, set[str], str]:
+    def _ollama_tags(self, force_refresh: bool = False) -> tuple[bool, set[str], str]:
         """
+        查询 Ollama 模型列表（走共享缓存，稳态下不产生额外请求）
+
+        Returns: (reachable, model_names, err)
+        """
+        return model_availability.get(
+            self._ollama_base_url(),
+            self._fetch_ollama_tags,
+            model=self._ollama_model(),
+            force_refresh=force_refresh,
+        )
+
+    def _fetch_ollama_tags(self) -> tuple[bool, set[str], str]:
+        """
+        直接请求 /api/tags（不经缓存）
+
         Returns: (reachable, model_names, err)
         """
         base = self._ollama_base_url().rstrip("/")
         try:
-            r = requests.get(f"{base}/api/tags", timeout=2)
-            if r.status_code != 200:
-                return False, set(), f"HTTP {r.status_code}"
-            data = r.json() or {}
-            models = data.get("models") or []
-            names = set()
-            if isinstance(models, list):
-                for m in models:
-                    if isinstance(m, dict) and m.get("name"):
-                        names.add(str(m["name"]))
-            return True, names, ""
+            r = self.transports["ollama_native"].get(f"{base}/api/tags", timeout=2)
+            return self._parse_tags_response(r)
         except Exception as e:
             return False, set(), f"{type(e).__name__}: {e}"
 
+    @staticmethod
+    def _parse_tags_response(r) -> tuple[bool, set[str], str]:
+        if r.status_code != 200:
+            return False, set(), f"HTTP {r.status_code}"
+        data = r.json() or {}
+        models = data.get("models") or []
+        names = set()
+        if isinstance(models, list):
+            for m in models:
+                if isinstance(m, dict) and m.get("name"):
+                    names.add(str(m["name"]))
+        return True, names, ""
+
     @staticmethod
     def _extract_openai_content(result: dict) -> str | None:
         try:
@@ -83,153 +132,363 @@ class LLMClient:
         except Exception:
             return None
         
-    def chat(self, messages: list, temperature: float = 0.8, max_tokens: int = 2000, timeout: int = 300) -> str:
+    @staticmethod
+    def _parse_stream_line(line: str, used_backend: str | None) -> tuple[str, bool]:
         """
-        调用LLM进行对话
-        
-        Args:
-            messages: 消息列表，格式为 [{"role": "system/user/assistant", "content": "..."}]
-            temperature: 温度参数，控制回复的随机性
-            
-        Returns:
-            LLM的回复内容
+        解析流式响应的一行，返回 (增量文本, 是否结束)
+        - Ollama 原生：NDJSON，每行 {"message":{"content":"..."}, "done": false}
+        - OpenAI 兼容：SSE，每行 "data: {...}"，以 "data: [DONE]" 结束
+        """
+        try:
+            if used_backend == "ollama_native":
+                obj = json.loads(line)
+                msg = obj.get("message") or {}
+                return str(msg.get("content") or ""), bool(obj.get("done"))
+
+            if not line.startswith("data:"):
+                return "", False
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return "", True
+            obj = json.loads(data)
+            delta = (obj.get("choices") or [{}])[0].get("delta") or {}
+            return str(delta.get("content") or ""), False
+        except Exception:
+            return "", False
+
+    @staticmethod
+    def _record_outcome(endpoint: str, outcome, latency: float, count_slow: bool = True) -> None:
+        """
+        把一次请求结果计入端点熔断器：网络异常与 5xx 记为失败（404 只说明路径不对，不算故障）
+
+        count_slow 为假时成功但很慢的调用不算失败：本地 Ollama 是最后的兜底，慢总比直接报错好
+        """
+        if isinstance(outcome, Exception):
+            circuit_breakers.record(endpoint, False, latency, f"{type(outcome).__name__}: {outcome}")
+        elif outcome.status_code >= 500:
+            circuit_breakers.record(endpoint, False, latency, f"HTTP {outcome.status_code}")
+        else:
+            circuit_breakers.record(endpoint, True, latency, count_slow=count_slow)
+
+    @staticmethod
+    def _record_request(outcome, seconds: float) -> None:
+        """记录一次 HTTP 请求的耗时与结果（标签取自外层 stage_labels：backend / model / endpoint）"""
+        observe_stage("llm.request", seconds)
+        status = type(outcome).__name__ if isinstance(outcome, Exception) else str(outcome.status_code)
+        llm_requests.inc(**current_labels(), status=status)
+
+    @staticmethod
+    def _record_call(source: str, content: str) -> str:
+        """按来源（backend / cache / cassette）与结果（ok / error / busy）计数一次 chat 调用，原样返回回复"""
+        if content == BUSY_REPLY:
+            result = "busy"
+        elif not content or content.startswith("["):
+            result = "error"
+        else:
+            result = "ok"
+        llm_calls.inc(source=source, result=result)
+        return content
+
+    def _stream_labels(self, response, used_backend: str | None) -> dict:
+        """流式响应读取阶段的标签（此时已离开 _open_response 的 stage_labels 范围）"""
+        model = self.model if used_backend == "remote" else self._ollama_model()
+        return {"backend": used_backend, "model": model, "endpoint": response.url}
+
+    @staticmethod
+    def _post(backend: str, endpoint: str, headers: dict, payload: dict, schema: dict | None, model: str):
+        """
+        发送一次请求（_route 的子生成器）：带上结构化输出参数；
+        服务端以 400 拒绝该参数时按 json_schema -> json_object -> off 降级后重试同一端点；
+        与格式参数无关的 400 直接返回，不改变记住的级别
+        """
+        level = structured_output.level(endpoint, model, schema)
+        while True:
+            outcome = yield "post", backend, endpoint, headers, structured_output.apply(backend, payload, schema, level)
+            if level == "off" or isinstance(outcome, Exception) or outcome.status_code != 400:
+                return outcome
+            if not structured_output.rejected(outcome):
+                return outcome
+            next_level = structured_output.downgrade(endpoint, model, level)
+            if next_level is None:
+                return outcome
+            try:
+                outcome.close()
+            except Exception:
+                pass
+            level = next_level
+
+    def _route(self, messages: list, temperature: float, max_tokens: int, stream: bool = False,
+               model: str | None = None, schema: dict | None = None):
+        """
+        后端路由状态机：按“远程优先、本地 Ollama 兜底”的顺序决定下一步请求。
+
+        与具体 I/O 解耦，同步（requests）与异步（httpx）客户端共用同一套路由逻辑：
+        - yield ("post", backend, endpoint, headers, payload)：驱动方发起请求，send 回响应或异常对象
+        - yield ("tags",)：驱动方探测 Ollama 模型列表，send 回 (reachable, model_names, err)
+        - yield ("result", response, used_backend, error_text)：路由结束；
+          error_text 非空表示无可用后端，直接把它作为回复返回即可
+
+        model 仅覆盖远程模型（如用更便宜的模型做后台评估）；Ollama 兜底始终使用 OLLAMA_MODEL
+        schema 为 response_schemas 中定义的回复格式，按后端转换为 response_format / format 参数
         """
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-        
+
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": int(max_tokens)
         }
-        
-        try:
-            print(f"[LLM] 模型: {self.model}")
-            print(f"[LLM] 消息数量: {len(messages)}")
+        if stream:
+            payload["stream"] = True
 
-            # 1) 优先走配置的远程（如 DeepSeek）。若没 key，则跳过远程，直接尝试本地 Ollama。
-            response = None
-            used_backend = None
-
-            if (self.api_key or "").strip():
-                candidates = self._candidate_chat_urls()
-                if not candidates:
-                    return "[LLM_API_URL 未配置]"
-
-                print(f"[LLM] 远程调用: {candidates[0]}")
-                last_err = None
-                for endpoint in candidates:
-                    try:
-                        response = requests.post(
-                            endpoint,
-                            headers=headers,
-                            json=payload,
-                            timeout=int(timeout)
-                        )
-                        if response.status_code == 404:
-                            continue
-                        used_backend = "remote"
-                        break
-                    except requests.exceptions.RequestException as e:
-                        last_err = e
-                        continue
+        # 1) 优先走配置的远程（如 DeepSeek）。若没 key，则跳过远程，直接尝试本地 Ollama。
+        response = None
+        used_backend = None
+
+        if (self.api_key or "").strip():
+            candidates = self._candidate_chat_urls()
+            if not candidates:
+                yield "result", None, None, "[LLM_API_URL 未配置]"
+                return
+            # 已确认可用的端点排在最前：稳态下不再先撞一次 404
+            candidates = endpoint_memo.order("remote", self.url, payload["model"], candidates)
+
+            print(f"[LLM] 远程调用: {candidates[0]}")
+            last_err = None
+            for endpoint in candidates:
+                # 熔断中的端点直接跳过，避免远程故障时每轮都等满超时
+                if not circuit_breakers.allow(endpoint):
+                    print(f"[LLM] 端点熔断中，跳过: {endpoint}")
+                    continue
+                started = time.monotonic()
+                outcome = yield from self._post("remote", endpoint, headers, payload, schema, payload["model"])
+                self._record_outcome(endpoint, outcome, time.monotonic() - started)
+                endpoint_memo.observe("remote", self.url, payload["model"], endpoint, outcome)
+                if isinstance(outcome, Exception):
+                    last_err = outcome
+                    continue
+                response = outcome
+                if response.status_code == 404:
+                    continue
+                used_backend = "remote"
+                break
+
+            if response is None and last_err is not None:
+                print(f"[LLM] 远程请求异常，将尝试本地 Ollama: {last_err}")
+
+        # 2) 兜底走本地 Ollama（免费，无需 key）
+        if response is None:
+            ollama_model = self._ollama_model()
+            ollama_base = self._ollama_base_url()
+            ollama_urls = endpoint_memo.order("ollama", ollama_base, ollama_model, self._candidate_ollama_urls())
+            print(f"[LLM] 本地Ollama尝试: base={self._ollama_base_url()}, model={ollama_model}")
+
+            reachable, available_models, tags_err = yield ("tags",)
+            if not reachable:
+                if not (self.api_key or "").strip():
+                    yield "result", None, None, f"[LLM_API_KEY 未配置，且本地 Ollama 未启动（{self._ollama_base_url()}）]"
+                    return
+                yield "result", None, None, f"[本地 Ollama 不可用（{self._ollama_base_url()}）：{tags_err}]"
+                return
+
+            # 如果模型还没下载完/尚未拉取，会导致 /api/chat 返回 404 或长时间阻塞
+            # tags 为空也意味着本机暂无任何模型可用
+            if ollama_model not in available_models:
+                yield "result", None, None, f"[本地 Ollama 模型未就绪：{ollama_model}（请等待下载完成或执行：ollama pull {ollama_model}）]"
+                return
+
+            # OpenAI compatible payload 基本一致，只需替换 model
+            openai_payload = {**payload, "model": ollama_model}
+            # Ollama native payload 不支持 max_tokens 顶层字段，温度走 options
+            ollama_payload = {
+                "model": ollama_model,
+                "messages": messages,
+                "stream": bool(stream),
+                "options": {"temperature": temperature, "num_predict": int(max_tokens)},
+                # 强制 JSON 输出（避免 user_simulator 解析失败）
+                "format": "json",
+            }
+            # 让 Ollama 在两轮对话之间保留模型与 KV 缓存，相同的系统提示词前缀无需重新计算
+            keep_alive = (os.environ.get("OLLAMA_KEEP_ALIVE") or "").strip()
+            if keep_alive:
+                ollama_payload["keep_alive"] = keep_alive
+            ollama_headers = {"Content-Type": "application/json"}
 
-                if response is None and last_err is not None:
-                    print(f"[LLM] 远程请求异常，将尝试本地 Ollama: {last_err}")
+            for endpoint in ollama_urls:
+                if not circuit_breakers.allow(endpoint):
+                    print(f"[LLM] 端点熔断中，跳过: {endpoint}")
+                    continue
+                started = time.monotonic()
+                if endpoint.endswith("/api/chat"):
+                    outcome = yield from self._post("ollama_native", endpoint, ollama_headers, ollama_payload, schema, ollama_model)
+                    used_backend = "ollama_native"
+                else:
+                    outcome = yield from self._post("ollama_openai", endpoint, ollama_headers, openai_payload, schema, ollama_model)
+                    used_backend = "ollama_openai"
+                self._record_outcome(endpoint, outcome, time.monotonic() - started, count_slow=False)
+                endpoint_memo.observe("ollama", ollama_base, ollama_model, endpoint, outcome)
+
+                if isinstance(outcome, Exception) or outcome.status_code == 404:
+                    if isinstance(outcome, Exception):
+                        # Ollama 可能已停止：让下一次请求重新探测
+                        model_availability.invalidate(self._ollama_base_url())
+                    response = None
+                    continue
+                response = outcome
+                break
 
-            # 2) 兜底走本地 Ollama（免费，无需 key）
             if response is None:
-                ollama_model = self._ollama_model()
-                ollama_urls = self._candidate_ollama_urls()
-                print(f"[LLM] 本地Ollama尝试: base={self._ollama_base_url()}, model={ollama_model}")
-
-                reachable, available_models, tags_err = self._ollama_tags()
-                if not reachable:
-                    if not (self.api_key or "").strip():
-                        return f"[LLM_API_KEY 未配置，且本地 Ollama 未启动（{self._ollama_base_url()}）]"
-                    return f"[本地 Ollama 不可用（{self._ollama_base_url()}）：{tags_err}]"
-
-                # 如果模型还没下载完/尚未拉取，会导致 /api/chat 返回 404 或长时间阻塞
-                # tags 为空也意味着本机暂无任何模型可用
-                if ollama_model not in available_models:
-                    return f"[本地 Ollama 模型未就绪：{ollama_model}（请等待下载完成或执行：ollama pull {ollama_model}）]"
-
-                # OpenAI compatible payload 基本一致，只需替换 model
-                openai_payload = {**payload, "model": ollama_model}
-                # Ollama native payload 不支持 max_tokens 顶层字段，温度走 options
-                ollama_payload = {
-                    "model": ollama_model,
-                    "messages": messages,
-                    "stream": False,
-                    "options": {"temperature": temperature, "num_predict": int(max_tokens)},
-                    # 强制 JSON 输出（避免 user_simulator 解析失败）
-                    "format": "json",
-                }
-
-                last_err = None
-                for endpoint in ollama_urls:
-                    try:
-                        if endpoint.endswith("/api/chat"):
-                            response = requests.post(
-                                endpoint,
-                                headers={"Content-Type": "application/json"},
-                                json=ollama_payload,
-                                timeout=int(timeout),
-                            )
-                            used_backend = "ollama_native"
-                        else:
-                            response = requests.post(
+                # 两边都不行：给出可操作的提示
+                if not (self.api_key or "").strip():
+                    yield "result", None, None, f"[本地 Ollama 模型未就绪或接口不可用：{ollama_model}（base={self._ollama_base_url()}）]"
+                    return
+                yield "result", None, None, "[LLM调用失败：远程不可用且本地 Ollama 未启动]"
+                return
+
+        yield "result", response, used_backend, ""
+
+    def _open_response(self, messages: list, temperature: float, max_tokens: int, timeout: int,
+                       stream: bool = False, model: str | None = None, schema: dict | None = None,
+                       slot: SlotHolder | None = None):
+        """
+        同步驱动 _route，返回 (response, used_backend, error_text)
+
+        slot 非空时，每次向某个后端发请求前先占用该后端的并发额度（见 llm_scheduler.py），
+        额度由调用方在读完响应后归还；排队已满/超时时抛出 LLMBusy
+        """
+        route = self._route(messages, temperature, max_tokens, stream, model=model, schema=schema)
+        try:
+            step = next(route)
+            while step[0] != "result":
+                if step[0] == "tags":
+                    with span("llm.tags", backend="ollama_native"):
+                        outcome = self._ollama_tags()
+                else:
+                    _, backend, endpoint, headers, payload = step
+                    with stage_labels(backend=backend, model=payload.get("model"), endpoint=endpoint):
+                        if slot is not None:
+                            with span("llm.queue_wait"):
+                                slot.switch(backend)
+                        started = time.perf_counter()
+                        try:
+                            outcome = self.transports[backend].post(
                                 endpoint,
-                                headers={"Content-Type": "application/json"},
-                                json=openai_payload,
+                                headers=headers,
+                                json=payload,
                                 timeout=int(timeout),
+                                stream=stream,
                             )
-                            used_backend = "ollama_openai"
+                        except requests.exceptions.RequestException as e:
+                            outcome = e
+                        self._record_request(outcome, time.perf_counter() - started)
+                step = route.send(outcome)
+        finally:
+            route.close()
+        _, response, used_backend, error_text = step
+        return response, used_backend, error_text
 
-                        if response.status_code == 404:
-                            response = None
-                            continue
-                        break
-                    except requests.exceptions.RequestException as e:
-                        last_err = e
-                        response = None
-                        continue
+    def primary_backend(self) -> str:
+        """首选后端：配置了 key 时走远程，否则走本地 Ollama"""
+        return "remote" if (self.api_key or "").strip() else "ollama_native"
+
+    def _request_model(self, model: str | None) -> str:
+        # 远程模型与 Ollama 兜底模型都计入请求键：任一配置变化都不会命中旧回复
+        return f"{model or self.model}|{self._ollama_model()}"
+
+    def _cache_lookup(self, cache: str | None, messages: list, model: str | None, temperature: float,
+                      max_tokens: int, schema: dict | None) -> tuple[str | None, str | None]:
+        """按调用方策略查回复缓存，返回 (缓存键, 命中的回复)；该调用方未启用缓存时缓存键为 None"""
+        if not llm_cache.enabled_for(cache):
+            return None, None
+        key = cache_key(messages, self._request_model(model), temperature, max_tokens, schema)
+        cached = llm_cache.lookup(cache, key)
+        if cached is not None:
+            print(f"[LLM] 命中回复缓存: site={cache}, 长度: {len(cached)}")
+        return key, cached
+
+    def _http_error_message(self, response, used_backend: str | None, messages: list, temperature: float) -> str:
+        """把非 200 响应转换成可展示的错误提示"""
+        error_detail = response.text[:1000] if response.text else "无详细信息"
+        print(f"[LLM] 错误响应内容: {error_detail}")
+        print(f"[LLM] backend={used_backend}, payload: model={self.model}, messages_count={len(messages)}, temperature={temperature}")
 
-                if response is None:
-                    # 两边都不行：给出可操作的提示
-                    if not (self.api_key or "").strip():
-                        return f"[本地 Ollama 模型未就绪或接口不可用：{ollama_model}（base={self._ollama_base_url()}）]"
-                    return "[LLM调用失败：远程不可用且本地 Ollama 未启动]"
+        # 根据不同错误码给出提示
+        if response.status_code == 400:
+            # 尝试解析错误信息
+            try:
+                error_json = response.json()
+                error_msg = error_json.get("error", {}).get("message", error_detail)
+            except:
+                error_msg = error_detail
+            print(f"[LLM] 400错误详情: {error_msg}")
+            return f"[API参数错误: {error_msg[:100]}]"
+        elif response.status_code == 401:
+            return "[API密钥无效或未配置（401）]"
+        elif response.status_code == 403:
+            return "[API访问被拒绝，可能是网络限制]"
+        elif response.status_code == 429:
+            return "[API请求频率过高，请稍后重试]"
+        elif response.status_code >= 500:
+            return "[API服务器错误，请稍后重试]"
+        return f"[API错误 {response.status_code}]"
+
+    @timed("llm.chat")
+    def chat(self, messages: list, temperature: float = 0.8, max_tokens: int = 2000, timeout: int = 300,
+             model: str | None = None, schema: dict | None = None, cache: str | None = None) -> str:
+        """
+        调用LLM进行对话
+        
+        Args:
+            messages: 消息列表，格式为 [{"role": "system/user/assistant", "content": "..."}]
+            temperature: 温度参数，控制回复的随机性
+            model: 覆盖远程模型（默认使用 LLM_MODEL）
+            schema: 要求的回复格式（见 response_schemas.py），不支持时自动降级
+            cache: 调用方标识；该调用方在 LLM_CACHE_SITES 中时读写回复缓存（见 llm_cache.py）
             
+        Returns:
+            LLM的回复内容
+        """
+        key, cached = self._cache_lookup(cache, messages, model, temperature, max_tokens, schema)
+        if cached is not None:
+            return self._record_call("cache", cached)
+        tape_key = None
+        if llm_cassette.enabled:
+            tape_key = cache_key(messages, self._request_model(model), temperature, max_tokens, schema)
+            replayed, delay = llm_cassette.lookup(tape_key)
+            if replayed is not None:
+                time.sleep(delay)
+                return self._record_call("cassette", replayed)
+
+        started = time.monotonic()
+        content = self._chat(messages, temperature, max_tokens, timeout, model, schema)
+        if tape_key is not None:
+            llm_cassette.record(tape_key, self._request_model(model), content, time.monotonic() - started)
+        if key is not None:
+            llm_cache.store(cache, key, content)
+        return self._record_call("backend", content)
+
+    def _chat(self, messages: list, temperature: float, max_tokens: int, timeout: int,
+              model: str | None, schema: dict | None) -> str:
+        """实际发起一次非流式调用（不经过缓存/录制回放）"""
+        slot = SlotHolder(llm_scheduler)
+        try:
+            print(f"[LLM] 模型: {model or self.model}")
+            print(f"[LLM] 消息数量: {len(messages)}")
+
+            response, used_backend, error_text = self._open_response(
+                messages, temperature, max_tokens, timeout, model=model, schema=schema, slot=slot
+            )
+            if error_text:
+                return error_text
+
             print(f"[LLM] 响应状态码: {response.status_code}")
             
             if response.status_code != 200:
-                error_detail = response.text[:1000] if response.text else "无详细信息"
-                print(f"[LLM] 错误响应内容: {error_detail}")
-                print(f"[LLM] backend={used_backend}, payload: model={payload.get('model')}, messages_count={len(messages)}, temperature={temperature}")
-                
-                # 根据不同错误码给出提示
-                if response.status_code == 400:
-                    # 尝试解析错误信息
-                    try:
-                        error_json = response.json()
-                        error_msg = error_json.get("error", {}).get("message", error_detail)
-                    except:
-                        error_msg = error_detail
-                    print(f"[LLM] 400错误详情: {error_msg}")
-                    return f"[API参数错误: {error_msg[:100]}]"
-                elif response.status_code == 401:
-                    return "[API密钥无效或未配置（401）]"
-                elif response.status_code == 403:
-                    return "[API访问被拒绝，可能是网络限制]"
-                elif response.status_code == 429:
-                    return "[API请求频率过高，请稍后重试]"
-                elif response.status_code >= 500:
-                    return "[API服务器错误，请稍后重试]"
-                return f"[API错误 {response.status_code}]"
+                return self._http_error_message(response, used_backend, messages, temperature)
                 
             result = response.json()
 
@@ -238,6 +497,7 @@ class LLMClient:
                 content = self._extract_ollama_content(result)
             else:
                 content = self._extract_openai_content(result)
+                prefix_cache_stats.record_usage(result.get("usage") if isinstance(result, dict) else None)
 
             if not content:
                 print(f"[LLM] 响应格式异常: {json.dumps(result, ensure_ascii=False)[:500]}")
@@ -258,6 +518,102 @@ class LLMClient:
         except (KeyError, IndexError, json.JSONDecodeError) as e:
             print(f"[LLM] 解析错误: {str(e)}")
             return f"[解析响应失败: {str(e)}]"
+        except LLMBusy as e:
+            print(f"[LLM] 调度繁忙: {e}")
+            return BUSY_REPLY
+        finally:
+            slot.release()
+
+    def chat_stream(self, messages: list, temperature: float = 0.8, max_tokens: int = 2000,
+                    timeout: int = 300, schema: dict | None = None) -> Iterator[str]:
+        """
+        流式调用LLM：逐段 yield 增量文本（首 token 到达即可展示）
+
+        出错时与 chat() 保持一致：yield 一段 "[...]" 错误提示后结束。
+        """
+        if not llm_cassette.enabled:
+            yield from self._chat_stream(messages, temperature, max_tokens, timeout, schema)
+            return
+        tape_key = cache_key(messages, self._request_model(None), temperature, max_tokens, schema)
+        timeline = llm_cassette.lookup_stream(tape_key)
+        if timeline is not None:
+            yield from replay_stream(timeline)
+            return
+
+        chunks = []
+        started = time.monotonic()
+        try:
+            for delta in self._chat_stream(messages, temperature, max_tokens, timeout, schema):
+                chunks.append((time.monotonic() - started, delta))
+                yield delta
+        finally:
+            # 调用方读到完整 JSON 后可能提前结束读取：已收到的部分同样录制
+            llm_cassette.record_stream(tape_key, self._request_model(None), chunks)
+
+    def _chat_stream(self, messages: list, temperature: float, max_tokens: int,
+                     timeout: int, schema: dict | None) -> Iterator[str]:
+        """实际发起一次流式调用（不经过录制回放）"""
+        response = None
+        slot = SlotHolder(llm_scheduler)
+        try:
+            print(f"[LLM] 模型: {self.model}（流式）")
+            print(f"[LLM] 消息数量: {len(messages)}")
+
+            response, used_backend, error_text = self._open_response(
+                messages, temperature, max_tokens, timeout, stream=True, schema=schema, slot=slot
+            )
+            if error_text:
+                yield error_text
+                return
+
+            print(f"[LLM] 响应状态码: {response.status_code}")
+
+            if response.status_code != 200:
+                yield self._http_error_message(response, used_backend, messages, temperature)
+                return
+
+            total = 0
+            labels = self._stream_labels(response, used_backend)
+            started = time.perf_counter()
+            try:
+                for raw in response.iter_lines():
+                    if not raw:
+                        continue
+                    line = raw.decode("utf-8", errors="replace").strip()
+                    delta, done = self._parse_stream_line(line, used_backend)
+                    if delta:
+                        if total == 0:
+                            observe_stage("llm.first_token", time.perf_counter() - started, **labels)
+                        total += len(delta)
+                        yield delta
+                    if done:
+                        break
+            finally:
+                # 调用方读到完整 JSON 后可能提前关闭生成器：同样记录已读取的时长
+                observe_stage("llm.stream", time.perf_counter() - started, **labels)
+
+            if total == 0:
+                yield "[API返回格式异常]"
+                return
+            print(f"[LLM] 流式回复完成，长度: {total}")
+
+        except requests.exceptions.Timeout:
+            print("[LLM] 请求超时")
+            yield "[API请求超时，请重试]"
+        except requests.exceptions.ConnectionError as e:
+            print(f"[LLM] 连接错误: {str(e)}")
+            yield f"[无法连接到API服务器: {self.url}]"
+        except requests.exceptions.RequestException as e:
+            print(f"[LLM] 请求异常: {str(e)}")
+            yield f"[API调用失败: {str(e)}]"
+        except LLMBusy as e:
+            print(f"[LLM] 调度繁忙: {e}")
+            yield BUSY_REPLY
+        finally:
+            # 归还连接到连接池，并归还并发额度
+            if response is not None:
+                response.close()
+            slot.release()
 
 
 # 全局客户端实例
@@ -0,0 +1,385 @@
+"""
+LLM 回复中的 JSON 处理工具
+
+模型按提示词输出 JSON 时经常不规范：包在 ```json 代码块里、前面带一句说明、max_tokens 用尽被截断、
+结尾多逗号、用单引号或中文引号、Python 风格的 True/None 等。原先各调用方各自按 "```json" 切分再
+json.loads，任何一处不规范都会走兜底（或重新生成一次）。这里提供共用的容错解析：
+- parse_llm_json():      从整段回复中取出第一个 JSON 对象，必要时修复后再解析，并记录解析统计
+- JSONObjectStream:      增量扫描流式片段，对象的右花括号一到即可结束读取
+- PartialFieldExtractor: 流式输出时边生成边取出某个字符串字段的值
+- json_parse_stats:      按调用方统计 直接解析 / 修复后解析 / 失败 的次数与失败率（/api/llm/status）
+"""
+import json
+import re
+import threading
+
+from metrics import span
+
+
+class PartialFieldExtractor:
+    """
+    从流式到达的 JSON 片段中增量取出某个字符串字段的值
+
+    用于流式对话：模型按 {"response": "...", "inner_thought": ...} 输出时，
+    "response" 的内容可以边生成边展示，无需等整段 JSON 完整后再解析。
+
+    用法：
+        extractor = PartialFieldExtractor("response")
+        for chunk in stream:
+            visible = extractor.feed(chunk)   # 本次新增的可见文本（可能为空）
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, field: str = "response"):
+        self.field = field
+        self._key_re = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._buf = ""
+        self._pos = -1  # 字段值在 _buf 中的下一个待解码位置；-1 表示尚未找到字段
+        self.value = ""
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        self._buf += chunk
+
+        if self._pos < 0:
+            m = self._key_re.search(self._buf)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        out = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+
+            # 转义序列可能被拆在两个 chunk 之间：不完整就等下一次 feed
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc == "u":
+                if i + 6 > len(buf):
+                    break
+                try:
+                    code = int(buf[i + 2:i + 6], 16)
+                except ValueError:
+                    out.append(buf[i:i + 6])
+                    i += 6
+                    continue
+                # 代理对（如 emoji）：等低位代理也到齐后再一起解码
+                if 0xD800 <= code <= 0xDBFF:
+                    if i + 12 > len(buf):
+                        break
+                    if buf[i + 6:i + 8] == "\\u":
+                        try:
+                            low = int(buf[i + 8:i + 12], 16)
+                        except ValueError:
+                            low = 0
+                        if 0xDC00 <= low <= 0xDFFF:
+                            out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                            i += 12
+                            continue
+                out.append(chr(code))
+                i += 6
+                continue
+            out.append(self._ESCAPES.get(esc, esc))
+            i += 2
+
+        self._pos = i
+        text = "".join(out)
+        self.value += text
+        return text
+
+
+_OPENERS = {"{": "}", "[": "]"}
+_CLOSERS = {"}", "]"}
+# 字符串起始引号 -> 结束引号；中文/弯引号只在字符串外（即被模型当作 JSON 引号使用时）才识别
+_QUOTE_PAIRS = {'"': '"', "'": "'", "\u201c": "\u201d", "\u2018": "\u2019"}
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_DANGLING_KEY_RE = re.compile(r',?\s*"(?:[^"\\]|\\.)*"\s*:\s*$')
+
+
+def _find_start(text: str) -> int:
+    """第一个 JSON 对象的起始位置：优先取代码块内的，其次取全文第一个 "{" """
+    fence = text.find("```")
+    if fence >= 0:
+        start = text.find("{", fence)
+        if start >= 0:
+            return start
+    return text.find("{")
+
+
+def _scan_end(text: str, start: int) -> int:
+    """从 start 处的 "{" 开始扫描，返回与之配对的 "}" 之后的位置；对象不完整时返回 -1"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _OPENERS:
+            depth += 1
+        elif ch in _CLOSERS:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def _loads(text: str) -> dict | None:
+    try:
+        # strict=False：允许字符串里出现未转义的换行等控制字符
+        value = json.loads(text, strict=False)
+    except (ValueError, RecursionError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _close(out: list[str], stack: list[str]) -> str:
+    """把截断处补成完整对象：去掉结尾的逗号/悬空的键，按层级补齐右括号"""
+    text = "".join(out).rstrip()
+    while True:
+        trimmed = _DANGLING_KEY_RE.sub("", text).rstrip().rstrip(",").rstrip()
+        if trimmed == text:
+            break
+        text = trimmed
+    return text + "".join(_OPENERS[opener] for opener in reversed(stack))
+
+
+def repair_json(text: str, start: int = 0) -> dict | None:
+    """
+    修复常见缺陷后解析从 start 开始的 JSON 对象：
+    结尾多余的逗号、单引号字符串、字符串外的中文引号、True/False/None、被截断（补齐引号与括号）
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    # 每个逗号处的 (输出长度, 括号栈)：补齐后仍无法解析时，退回到最近的逗号处截断
+    cuts: list[tuple[int, tuple[str, ...]]] = []
+    quote = ""
+    escaped = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+                # 单引号字符串里的 \' 在 JSON 中不需要转义
+                if quote == "'" and ch == "'":
+                    out[-1] = "'"
+                else:
+                    out.append(ch)
+            elif ch == "\\":
+                escaped = True
+                out.append(ch)
+            elif ch == quote:
+                quote = ""
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in _QUOTE_PAIRS:
+            quote = _QUOTE_PAIRS[ch]
+            out.append('"')
+        elif ch in _OPENERS:
+            stack.append(ch)
+            out.append(ch)
+        elif ch in _CLOSERS:
+            # 去掉右括号前多余的逗号
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                return _loads("".join(out))
+        elif ch == ",":
+            cuts.append((len(out), tuple(stack)))
+            out.append(ch)
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 截断：先闭合未结束的字符串，再补齐括号
+    if quote:
+        if escaped:
+            out.pop()
+        out.append('"')
+    result = _loads(_close(out, stack))
+    for length, cut_stack in reversed(cuts[-8:]):
+        if result is not None:
+            break
+        result = _loads(_close(out[:length], list(cut_stack)))
+    return result
+
+
+def extract_json_object(text: str) -> tuple[dict | None, str]:
+    """
+    从 LLM 回复中取出第一个 JSON 对象
+
+    Returns:
+        (对象或 None, 状态)；状态为 "clean"（直接解析）、"repaired"（修复后解析）或 "failed"
+    """
+    if not text:
+        return None, "failed"
+    start = _find_start(text)
+    if start < 0:
+        return None, "failed"
+    end = _scan_end(text, start)
+    if end > 0:
+        result = _loads(text[start:end])
+        if result is not None:
+            return result, "clean"
+    result = repair_json(text, start)
+    return (result, "repaired") if result is not None else (None, "failed")
+
+
+class JSONParseStats:
+    """按调用方统计 JSON 解析结果（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+
+    def record(self, source: str, status: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(source or "other", {"clean": 0, "repaired": 0, "failed": 0})
+            counts[status] = counts.get(status, 0) + 1
+
+    @staticmethod
+    def _summary(counts: dict[str, int]) -> dict:
+        total = sum(counts.values())
+        return {
+            "total": total,
+            **counts,
+            "failure_rate": round(counts.get("failed", 0) / total, 4) if total else 0.0,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = {"clean": 0, "repaired": 0, "failed": 0}
+            for counts in self._counts.values():
+                for status, count in counts.items():
+                    totals[status] = totals.get(status, 0) + count
+            return {
+                **self._summary(totals),
+                "by_source": {source: self._summary(counts) for source, counts in self._counts.items()},
+            }
+
+
+# 全局 JSON 解析统计
+json_parse_stats = JSONParseStats()
+
+
+def parse_llm_json(text: str, source: str = "") -> dict | None:
+    """容错解析 LLM 回复中的 JSON 对象并记录统计；取不出对象时返回 None"""
+    # llm_client 出错时返回的 "[...]" 提示不是模型输出，不计入解析统计
+    if not text or (text.startswith("[") and "{" not in text):
+        return None
+    with span("json.parse"):
+        result, status = extract_json_object(text)
+    json_parse_stats.record(source, status)
+    if status == "failed":
+        print(f"[LLM] JSON 解析失败: source={source or 'other'}, text={(text or '')[:100]!r}")
+    return result
+
+
+class JSONObjectStream:
+    """
+    增量扫描流式到达的 JSON 片段，判断第一个对象是否已经完整
+
+    模型输出完 JSON 后常常还会补一个代码块结束符或一段说明；对象的右花括号到达后即可停止读取流。
+
+    用法：
+        stream = JSONObjectStream()
+        for chunk in chunks:
+            if stream.feed(chunk):
+                break
+        result = stream.result("simulator")
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._pending = ""   # 尚未找到对象起点时累积的文本
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> bool:
+        """送入一段文本；第一个 JSON 对象已完整时返回 True"""
+        if self.complete or not chunk:
+            return self.complete
+        self._chunks.append(chunk)
+        if not self._started:
+            self._pending += chunk
+            # 与 _find_start 一致：出现代码块时只从代码块内找起点
+            fence = self._pending.find("```")
+            pos = self._pending.find("{", fence if fence >= 0 else 0)
+            if pos < 0:
+                return False
+            self._started = True
+            chunk = self._pending[pos:]
+            self._pending = ""
+        for ch in chunk:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in _OPENERS:
+                self._depth += 1
+            elif ch in _CLOSERS:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+                    break
+        return self.complete
+
+    def result(self, source: str = "") -> dict | None:
+        """解析已收到的文本（对象不完整时按截断修复）"""
+        return parse_llm_json(self.text, source)
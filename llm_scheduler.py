@@ -0,0 +1,333 @@
+"""
+LLM 请求调度（并发上限 / 优先级 / 按会话公平排队 / 准入控制）
+
+本地 Ollama 同时只能跑少数几个生成任务。原先每个 Flask 线程都直接调用 LLMClient.chat，
+突发流量全部堆在 Ollama 内部排队，等满 300 秒后以“[API请求超时，请重试]”返回。这里在真正发出请求前调度：
+- 并发上限：每个后端（remote / ollama）同时进行的请求数有上限，超出的请求在本进程内排队
+- 优先级：对话（interactive）> 开场白预生成（opening）> 评估（evaluation）> 其它后台任务（background），
+  有空位时总是先放行高优先级的请求
+- 公平排队：同一优先级内按会话轮转放行，单个会话的多个后台请求不会把其它会话挤在后面
+- 准入控制：对话请求排队已满或等待超时时立即返回“繁忙”（LLMBusy），而不是静默等到超时；
+  后台任务不设排队上限，一直等到有空位
+
+优先级与会话通过 contextvars 传递（llm_context），后台线程/异步协程在执行前各自设置。
+
+环境变量：
+- LLM_SCHED:                        是否启用调度（默认 1）
+- LLM_SCHED_MAX_CONCURRENCY_REMOTE: 远程后端最大并发（默认 16，0 表示不限）
+- LLM_SCHED_MAX_CONCURRENCY_OLLAMA: 本地 Ollama 最大并发（默认 2，0 表示不限）
+- LLM_SCHED_MAX_QUEUE:              每个后端最多排队多少个对话请求（默认 32，超出时直接返回繁忙）
+- LLM_SCHED_QUEUE_TIMEOUT:          对话请求最多排队多少秒（默认 30，超时返回繁忙）
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Iterator
+
+from config import env_bool, env_float, env_int
+
+
+INTERACTIVE = 0
+OPENING = 1
+EVALUATION = 2
+BACKGROUND = 3
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", OPENING: "opening", EVALUATION: "evaluation", BACKGROUND: "background"}
+
+BUSY_REPLY = "[当前使用人数较多，LLM 服务繁忙，请稍后重试]"
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+_session: contextvars.ContextVar[str] = contextvars.ContextVar("llm_session", default="")
+
+
+class LLMBusy(Exception):
+    """LLM 后端繁忙（排队已满或排队超时）"""
+
+
+@contextmanager
+def llm_context(priority: int, session_id: str | None = None) -> Iterator[None]:
+    """在此范围内发起的 LLM 请求使用给定的优先级与会话"""
+    priority_token = _priority.set(priority)
+    session_token = _session.set(session_id or "")
+    try:
+        yield
+    finally:
+        _session.reset(session_token)
+        _priority.reset(priority_token)
+
+
+def bind_context(coro: Awaitable) -> Awaitable:
+    """把当前的优先级/会话带进要提交到其它线程事件循环执行的协程"""
+    priority, session_id = _priority.get(), _session.get()
+
+    async def run():
+        with llm_context(priority, session_id):
+            return await coro
+
+    return run()
+
+
+def backend_group(backend: str) -> str:
+    """后端分组：ollama_native / ollama_openai 共用本地 Ollama 的并发额度"""
+    return "ollama" if backend.startswith("ollama") else "remote"
+
+
+class _Waiter:
+    __slots__ = ("priority", "session_id", "enqueued_at", "granted", "_event", "_loop", "_future")
+
+    def __init__(self, priority: int, session_id: str, loop: asyncio.AbstractEventLoop | None = None):
+        self.priority = priority
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def grant(self) -> None:
+        # 调用方持有调度器锁
+        self.granted = True
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout: float | None) -> None:
+        self._event.wait(timeout)
+
+    async def wait_async(self, timeout: float | None) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _Group:
+    """一个后端分组的并发额度与等待队列：{优先级: {会话: [等待者...]}}"""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(0, int(limit))
+        self.max_queue = max(0, int(max_queue))
+        self.active = 0
+        self.queues: dict[int, OrderedDict[str, deque[_Waiter]]] = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self.granted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+
+    def queued(self, priority: int | None = None) -> int:
+        queues = [self.queues[priority]] if priority is not None else self.queues.values()
+        return sum(len(w) for q in queues for w in q.values())
+
+    def has_capacity(self) -> bool:
+        return self.limit <= 0 or self.active < self.limit
+
+    def enqueue(self, waiter: _Waiter) -> None:
+        self.queues[waiter.priority].setdefault(waiter.session_id, deque()).append(waiter)
+
+    def remove(self, waiter: _Waiter) -> None:
+        queue = self.queues[waiter.priority]
+        waiters = queue.get(waiter.session_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        if not waiters:
+            del queue[waiter.session_id]
+
+    def pop_next(self) -> _Waiter | None:
+        """取出下一个放行的等待者：最高优先级中，轮到的会话的最早请求"""
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            if not queue:
+                continue
+            session_id, waiters = next(iter(queue.items()))
+            waiter = waiters.popleft()
+            del queue[session_id]
+            if waiters:
+                # 该会话还有请求：排到本优先级队尾，先轮到其它会话
+                queue[session_id] = waiters
+            return waiter
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": {PRIORITY_NAMES[p]: self.queued(p) for p in sorted(self.queues)},
+            "max_queue": self.max_queue,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_wait_seconds": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+        }
+
+
+class LLMScheduler:
+    """按后端分组调度 LLM 请求（线程安全，同步线程与异步协程均可使用）"""
+
+    def __init__(self, enabled: bool = True, limits: dict[str, int] | None = None,
+                 max_queue: int = 32, queue_timeout: float = 30.0):
+        self.enabled = bool(enabled)
+        self.queue_timeout = float(queue_timeout)
+        self._lock = threading.Lock()
+        self._groups = {name: _Group(name, limit, max_queue)
+                        for name, limit in (limits or {"remote": 16, "ollama": 2}).items()}
+
+    def _group(self, name: str) -> _Group:
+        group = self._groups.get(name)
+        if group is None:
+            group = self._groups[name] = _Group(name, 0, 0)
+        return group
+
+    def overloaded(self, group_name: str) -> bool:
+        """准入检查：该后端的对话请求排队是否已满（用于在修改会话状态前快速拒绝）"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            group = self._group(group_name)
+            return group.max_queue > 0 and not group.has_capacity() \
+                and group.queued(INTERACTIVE) >= group.max_queue
+
+    def _enter(self, group_name: str, loop: asyncio.AbstractEventLoop | None = None) -> tuple[_Group, _Waiter | None]:
+        """有空位时直接占用（返回等待者 None），否则排队；对话请求排队已满时抛出 LLMBusy"""
+        priority = _priority.get()
+        with self._lock:
+            group = self._group(group_name)
+            if group.has_capacity() and group.queued() == 0:
+                group.active += 1
+                group.granted += 1
+                return group, None
+            if priority == INTERACTIVE and group.max_queue > 0 and group.queued(INTERACTIVE) >= group.max_queue:
+                group.rejected += 1
+                raise LLMBusy(f"{group_name} 排队已满（{group.max_queue}）")
+            waiter = _Waiter(priority, _session.get(), loop)
+            group.enqueue(waiter)
+            return group, waiter
+
+    def _settle(self, group: _Group, waiter: _Waiter) -> None:
+        """等待结束：已被放行则计入统计，否则移出队列并视为超时"""
+        with self._lock:
+            if waiter.granted:
+                group.total_wait += time.monotonic() - waiter.enqueued_at
+                return
+            group.remove(waiter)
+            group.timeouts += 1
+        raise LLMBusy(f"{group.name} 排队超时（{self.queue_timeout:g} 秒）")
+
+    def _abandon(self, group: _Group, waiter: _Waiter) -> None:
+        """等待者放弃等待：避免额度转交给已不存在的调用方后永远不被归还"""
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                group.remove(waiter)
+        if granted:
+            self.release(group.name)
+
+    def _timeout(self) -> float | None:
+        # 后台任务不设排队超时：由各自的调用方决定等多久
+        return self.queue_timeout if _priority.get() == INTERACTIVE and self.queue_timeout > 0 else None
+
+    def acquire(self, group_name: str) -> str:
+        """占用一个并发额度（阻塞等待）；返回分组名，用完后调用 release"""
+        if not self.enabled:
+            return group_name
+        group, waiter = self._enter(group_name)
+        if waiter is not None:
+            waiter.wait(self._timeout())
+            self._settle(group, waiter)
+        return group_name
+
+    async def acquire_async(self, group_name: str) -> str:
+        """acquire 的异步版本（在事件循环中等待，不占用线程）"""
+        if not self.enabled:
+            return group_name
+        group, waiter = self._enter(group_name, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await waiter.wait_async(self._timeout())
+            except BaseException:
+                # 等待中被取消（调用方断开、外层 wrap_future 取消等）：已被放行则归还额度，否则移出队列
+                self._abandon(group, waiter)
+                raise
+            self._settle(group, waiter)
+        return group_name
+
+    def release(self, group_name: str) -> None:
+        """归还额度：有等待者时直接转交给下一个（active 不变）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            group = self._group(group_name)
+            waiter = group.pop_next()
+            if waiter is None:
+                group.active = max(0, group.active - 1)
+                return
+            group.granted += 1
+            waiter.grant()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queue_timeout": self.queue_timeout,
+                "groups": {name: group.stats() for name, group in self._groups.items()},
+            }
+
+
+class SlotHolder:
+    """
+    一次 LLM 调用持有的并发额度：路由切换后端（如远程失败改走 Ollama）时换成新后端的额度，
+    调用结束（包括流式响应读完/关闭）时归还
+    """
+
+    def __init__(self, scheduler: LLMScheduler):
+        self.scheduler = scheduler
+        self.group: str | None = None
+
+    def switch(self, backend: str) -> None:
+        group = backend_group(backend)
+        if group == self.group:
+            return
+        self.release()
+        self.group = self.scheduler.acquire(group)
+
+    async def switch_async(self, backend: str) -> None:
+        group = backend_group(backend)
+        if group == self.group:
+            return
+        self.release()
+        self.group = await self.scheduler.acquire_async(group)
+
+    def release(self) -> None:
+        if self.group is not None:
+            self.scheduler.release(self.group)
+            self.group = None
+
+    def __enter__(self) -> "SlotHolder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+# 全局 LLM 调度器
+llm_scheduler = LLMScheduler(
+    enabled=env_bool("LLM_SCHED", True),
+    limits={
+        "remote": env_int("LLM_SCHED_MAX_CONCURRENCY_REMOTE", 16),
+        "ollama": env_int("LLM_SCHED_MAX_CONCURRENCY_OLLAMA", 2),
+    },
+    max_queue=env_int("LLM_SCHED_MAX_QUEUE", 32),
+    queue_timeout=env_float("LLM_SCHED_QUEUE_TIMEOUT", 30.0),
+)
@@ -0,0 +1,292 @@
+"""
+分阶段耗时与指标导出（Prometheus 文本格式）
+
+原先只有 print("[LLM] ...")，学员说“好慢”时无法判断时间花在了 DNS/TLS、_candidate_chat_urls 的 404 探测、
+Ollama 模型列表检查、模型生成、JSON 解析还是 Flask 本身。这里提供：
+- span(stage) / timed(stage): 记录一个阶段的耗时，计入直方图 pmtrainer_stage_duration_seconds，
+  按 stage / backend / model / endpoint 细分；backend 等标签可由外层 stage_labels() 统一设置，
+  内层阶段（如建立连接）自动继承
+- Counter / Histogram: 线程安全的计数器与直方图；register_collector 可把已有的统计（缓存命中、
+  JSON 解析、调度队列等）在导出时转换为指标
+- 请求级追踪: Flask 请求开始时 start_trace()，请求内各阶段耗时汇总后以 Server-Timing 响应头返回，
+  浏览器开发者工具中即可看到本次请求的耗时分布
+- render(): /metrics 接口输出的 Prometheus 文本
+
+主要阶段：
+- llm.chat（一次完整的 LLM 调用，含缓存/回放）、llm.queue_wait（调度排队）、llm.tags（Ollama 模型列表检查）、
+  llm.connect（新建连接：DNS + TCP）、llm.tls（TLS 握手）、llm.request（单次 HTTP 请求，含 404 探测）、
+  llm.first_token / llm.stream（流式首字 / 读完）、json.parse
+- simulator.respond / simulator.opening、evaluator.evaluate / evaluator.evaluate_incremental
+
+环境变量：
+- PMTRAINER_METRICS:               是否记录指标（默认 1）
+- PMTRAINER_METRICS_SERVER_TIMING: 是否返回 Server-Timing 响应头（默认 1）
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterable, Iterator
+
+from config import env_bool
+
+
+# 覆盖从毫秒级（解析/连接）到分钟级（本地模型生成）的耗时
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_LABELS = ("stage", "backend", "model", "endpoint")
+
+_labels: contextvars.ContextVar[dict] = contextvars.ContextVar("metrics_labels", default={})
+_trace: contextvars.ContextVar[list | None] = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: dict[tuple, Any] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in series
+        ]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（le 为上界，含 +Inf）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各桶计数（非累积，最后一格为 +Inf）, 总和, 次数]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = self.header()
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表：同名指标只创建一次；collector 在每次导出时调用"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], Iterable[tuple[str, str, str, Iterable[tuple[dict, float]]]]]] = []
+
+    def _get(self, cls, name: str, help_text: str, labelnames: Iterable[str], **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get(Counter, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, Iterable[tuple[dict, float]]]]]) -> None:
+        """collector() 返回 [(指标名, counter/gauge, 说明, [(标签, 值), ...]), ...]"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[METRICS] 指标收集失败: {type(e).__name__}: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics = MetricsRegistry(enabled=env_bool("PMTRAINER_METRICS", True))
+
+SERVER_TIMING = env_bool("PMTRAINER_METRICS_SERVER_TIMING", True)
+
+stage_seconds = metrics.histogram(
+    "pmtrainer_stage_duration_seconds", "各处理阶段耗时（秒）", STAGE_LABELS,
+)
+llm_requests = metrics.counter(
+    "pmtrainer_llm_requests_total", "发往 LLM 后端的 HTTP 请求数（status 为状态码或异常类型）",
+    ("backend", "model", "endpoint", "status"),
+)
+llm_calls = metrics.counter(
+    "pmtrainer_llm_calls_total", "LLM 调用次数（source: backend / cache / cassette；result: ok / error / busy）",
+    ("source", "result"),
+)
+http_seconds = metrics.histogram(
+    "pmtrainer_http_request_duration_seconds", "Flask 请求耗时（流式响应为返回响应头之前的耗时）",
+    ("method", "route", "status"),
+)
+
+
+@contextmanager
+def stage_labels(**labels) -> Iterator[None]:
+    """在此范围内记录的阶段默认带上这些标签（如 backend / model / endpoint）"""
+    token = _labels.set({**_labels.get(), **{k: v for k, v in labels.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> dict:
+    return dict(_labels.get())
+
+
+def observe_stage(stage: str, seconds: float, **labels) -> None:
+    """记录一个阶段的耗时：计入直方图，并加入当前请求的追踪"""
+    if not metrics.enabled:
+        return
+    stage_seconds.observe(seconds, stage=stage, **{**_labels.get(), **labels})
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[None]:
+    """记录 with 块的耗时（异常退出同样记录）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, **labels)
+
+
+def timed(stage: str) -> Callable:
+    """装饰器：记录函数（同步或协程）每次调用的耗时"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace() -> contextvars.Token:
+    """开始记录当前请求的各阶段耗时（返回值交给 end_trace）"""
+    return _trace.set([])
+
+
+def end_trace(token: contextvars.Token) -> list[tuple[str, float]]:
+    trace = _trace.get() or []
+    _trace.reset(token)
+    return trace
+
+
+def server_timing(trace: list[tuple[str, float]], total: float | None = None) -> str:
+    """把追踪汇总为 Server-Timing 响应头：同名阶段累加耗时（毫秒）"""
+    totals: dict[str, float] = {}
+    for stage, seconds in trace:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def bind_trace(coro: Awaitable) -> Awaitable:
+    """把当前请求的追踪与阶段标签带进要提交到其它线程事件循环执行的协程"""
+    trace, labels = _trace.get(), _labels.get()
+
+    async def run():
+        trace_token, labels_token = _trace.set(trace), _labels.set(labels)
+        try:
+            return await coro
+        finally:
+            _labels.reset(labels_token)
+            _trace.reset(trace_token)
+
+    return run()
@@ -0,0 +1,185 @@
+"""
+Ollama 模型可用性缓存（/api/tags 探测结果）
+
+每次兜底到 Ollama 前都要确认“服务是否可达、模型是否已拉取”。直接探测会给每轮对话多加一次
+往返（超时 2 秒），这里把探测结果按 base_url 缓存起来：
+- 可达：缓存 OLLAMA_TAGS_TTL 秒（默认 60）
+- 不可达（负缓存）：缓存 OLLAMA_TAGS_NEGATIVE_TTL 秒（默认 5），避免 Ollama 未启动时每轮都等超时
+- 所需模型不在列表中：OLLAMA_TAGS_MISSING_TTL 秒（默认 5）后重新探测，模型下载完成能很快被发现
+- OLLAMA_TAGS_BACKGROUND_REFRESH=1 时由后台线程定期刷新，稳态下请求路径零额外往返
+"""
+import threading
+import time
+from typing import Callable
+
+from config import env_bool, env_float
+
+
+TagsResult = tuple[bool, set[str], str]
+
+
+class _Entry:
+    __slots__ = ("reachable", "models", "error", "fetched_at")
+
+    def __init__(self, result: TagsResult, fetched_at: float):
+        self.reachable, self.models, self.error = result
+        self.fetched_at = fetched_at
+
+    def result(self) -> TagsResult:
+        return self.reachable, set(self.models), self.error
+
+
+class ModelAvailabilityCache:
+    """按 base_url 缓存 Ollama 模型列表（线程安全，同一 base_url 并发未命中只探测一次）"""
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        missing_ttl: float = 5.0,
+        background_refresh: bool = False,
+    ):
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.missing_ttl = float(missing_ttl)
+        self.background_refresh = bool(background_refresh)
+
+        self._entries: dict[str, _Entry] = {}
+        self._fetchers: dict[str, Callable[[], TagsResult]] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._refresher: threading.Thread | None = None
+        self.hits = 0
+        self.probes = 0
+
+    def _base_lock(self, base_url: str) -> threading.Lock:
+        with self._lock:
+            lock = self._locks.get(base_url)
+            if lock is None:
+                lock = self._locks[base_url] = threading.Lock()
+            return lock
+
+    def _is_fresh(self, entry: _Entry | None, model: str | None, now: float) -> bool:
+        if entry is None:
+            return False
+        age = now - entry.fetched_at
+        if not entry.reachable:
+            return age < self.negative_ttl
+        if model and model not in entry.models:
+            return age < self.missing_ttl
+        # 开启后台刷新时，过期数据仍先返回（后台线程负责更新）
+        return self.background_refresh or age < self.ttl
+
+    def peek(self, base_url: str, model: str | None = None) -> TagsResult | None:
+        """仅查缓存：命中且未过期时返回结果，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(base_url)
+            if self._is_fresh(entry, model, time.monotonic()):
+                self.hits += 1
+                return entry.result()
+        return None
+
+    def store(self, base_url: str, result: TagsResult) -> None:
+        with self._lock:
+            self._entries[base_url] = _Entry(result, time.monotonic())
+            self.probes += 1
+
+    def get(
+        self,
+        base_url: str,
+        fetch: Callable[[], TagsResult],
+        model: str | None = None,
+        force_refresh: bool = False,
+    ) -> TagsResult:
+        """
+        获取模型列表；缓存未命中时调用 fetch() 探测
+
+        Returns: (reachable, model_names, err)
+        """
+        with self._lock:
+            self._fetchers[base_url] = fetch
+        self._ensure_refresher()
+
+        if not force_refresh:
+            cached = self.peek(base_url, model)
+            if cached is not None:
+                return cached
+
+        with self._base_lock(base_url):
+            # 等锁期间可能已被其他线程刷新
+            if not force_refresh:
+                cached = self.peek(base_url, model)
+                if cached is not None:
+                    return cached
+            result = fetch()
+            self.store(base_url, result)
+            return result[0], set(result[1]), result[2]
+
+    def invalidate(self, base_url: str | None = None) -> None:
+        """请求 Ollama 失败时调用，下一次访问会重新探测"""
+        with self._lock:
+            if base_url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(base_url, None)
+
+    def _ensure_refresher(self) -> None:
+        if not self.background_refresh or self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="ollama-tags-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        interval = max(1.0, min(self.ttl / 2, self.negative_ttl))
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                targets = list(self._fetchers.items())
+            now = time.monotonic()
+            for base_url, fetch in targets:
+                with self._lock:
+                    entry = self._entries.get(base_url)
+                if entry is not None:
+                    age = now - entry.fetched_at
+                    due = self.ttl / 2 if entry.reachable else self.negative_ttl
+                    if age < due:
+                        continue
+                try:
+                    with self._base_lock(base_url):
+                        self.store(base_url, fetch())
+                except Exception as e:
+                    print(f"[LLM] 后台刷新 Ollama 模型列表失败: {type(e).__name__}: {e}")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = {
+                base: {
+                    "reachable": e.reachable,
+                    "models": sorted(e.models),
+                    "error": e.error,
+                    "age_seconds": round(now - e.fetched_at, 1),
+                }
+                for base, e in self._entries.items()
+            }
+            return {
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "missing_ttl": self.missing_ttl,
+                "background_refresh": self.background_refresh,
+                "hits": self.hits,
+                "probes": self.probes,
+                "entries": entries,
+            }
+
+
+# 全局共享缓存（同步/异步客户端、/api/llm/status 共用）
+model_availability = ModelAvailabilityCache(
+    ttl=env_float("OLLAMA_TAGS_TTL", 60.0),
+    negative_ttl=env_float("OLLAMA_TAGS_NEGATIVE_TTL", 5.0),
+    missing_ttl=env_float("OLLAMA_TAGS_MISSING_TTL", 5.0),
+    background_refresh=env_bool("OLLAMA_TAGS_BACKGROUND_REFRESH", False),
+)
@@ -0,0 +1,192 @@
+"""
+开场白预生成池
+
+原先 /api/session/start 要同步等 LLM 生成开场白（超时 45 秒）才返回，是整个应用里最慢的一次点击，
+Ollama 冷启动时尤其明显。这里按 (画像, 场景, 心理状态) 组合在后台预先生成开场白：
+- 开始会话时直接从池里取一条（字典 pop），取走后在后台补充
+- 池为空（尚未生成好/生成失败）时返回 None，调用方照常同步生成
+- 超过保鲜期的开场白丢弃不用
+
+环境变量：
+- PMTRAINER_OPENING_POOL_SIZE:    每个组合预生成几条（默认 1，0 表示关闭）
+- PMTRAINER_OPENING_POOL_TTL:     开场白保鲜期，秒（默认 0，表示不过期）
+- PMTRAINER_OPENING_POOL_WARM:    启动时预热哪些组合：defaults（各画像的默认场景/心理状态，默认）/ all（全部组合）/ none
+- PMTRAINER_OPENING_POOL_WORKERS: 后台生成线程数（默认 1）
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from config import env_float, env_int
+from llm_client import llm_client
+from llm_scheduler import OPENING as OPENING_PRIORITY, llm_context
+from response_schemas import OPENING as OPENING_SCHEMA
+from training_config import find_by_id, get_training_options, get_user_profiles
+from user_simulator import UserSimulator
+
+
+def generate_opening(profile: dict, scenario: dict | None, mental_state: dict | None) -> dict | None:
+    """调用 LLM 生成一条开场白；失败或格式不对时返回 None（不把兜底模板放进池里）"""
+    simulator = UserSimulator(profile, scenario=scenario, mental_state=mental_state)
+    response_text = llm_client.chat(simulator._opening_messages(), temperature=0.8, max_tokens=300, timeout=45, schema=OPENING_SCHEMA)
+    return UserSimulator.parse_opening(response_text)
+
+
+class OpeningPool:
+    """按组合维护的开场白池（线程安全，同一组合同时只有一个补充任务）"""
+
+    def __init__(
+        self,
+        size: int = 1,
+        ttl_seconds: float = 0.0,
+        max_workers: int = 1,
+        generate: Callable[[dict, dict | None, dict | None], dict | None] = generate_opening,
+    ):
+        self.size = max(0, int(size))
+        self.ttl_seconds = float(ttl_seconds)
+        self.generate = generate
+        self._max_workers = max(1, int(max_workers))
+        self._executor: ThreadPoolExecutor | None = None
+        self._pools: dict[str, deque[tuple[dict, float]]] = {}
+        self._filling: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failed = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    @staticmethod
+    def key(profile: dict, scenario: dict | None, mental_state: dict | None) -> str:
+        return f"{profile.get('id')}|{(scenario or {}).get('id')}|{(mental_state or {}).get('id')}"
+
+    def _is_fresh(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds <= 0 or now - created_at < self.ttl_seconds
+
+    def take(self, profile: dict, scenario: dict | None, mental_state: dict | None) -> dict | None:
+        """取出一条预生成的开场白（并在后台补充）；池中没有可用的时返回 None"""
+        if not self.enabled:
+            return None
+        key = self.key(profile, scenario, mental_state)
+        now = time.monotonic()
+        opening = None
+        with self._lock:
+            pool = self._pools.get(key)
+            while pool:
+                candidate, created_at = pool.popleft()
+                if self._is_fresh(created_at, now):
+                    opening = candidate
+                    break
+                self.expired += 1
+            if opening is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.refill(profile, scenario, mental_state)
+        return opening
+
+    def refill(self, profile: dict, scenario: dict | None, mental_state: dict | None) -> None:
+        """提交后台任务，把该组合的池补满"""
+        if not self.enabled:
+            return
+        key = self.key(profile, scenario, mental_state)
+        with self._lock:
+            if key in self._filling:
+                return
+            self._filling.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="opening-pool")
+            executor = self._executor
+        executor.submit(self._fill, key, profile, scenario, mental_state)
+
+    def _fill(self, key: str, profile: dict, scenario: dict | None, mental_state: dict | None) -> None:
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    pool = self._pools.setdefault(key, deque())
+                    while pool and not self._is_fresh(pool[0][1], now):
+                        pool.popleft()
+                        self.expired += 1
+                    if len(pool) >= self.size:
+                        return
+                try:
+                    with llm_context(OPENING_PRIORITY):
+                        opening = self.generate(profile, scenario, mental_state)
+                except Exception as e:
+                    print(f"[OPENING] 预生成开场白异常: key={key}, err={type(e).__name__}: {e}")
+                    opening = None
+                with self._lock:
+                    if opening is None:
+                        # 失败时不重试，下次 take() 未命中时会再次触发补充
+                        self.failed += 1
+                        return
+                    self._pools.setdefault(key, deque()).append((opening, time.monotonic()))
+                    self.generated += 1
+        finally:
+            with self._lock:
+                self._filling.discard(key)
+
+    def warm(self, mode: str = "defaults") -> int:
+        """
+        按配置预热开场白池，返回提交的组合数
+        - defaults: 各画像的默认场景/心理状态（前端未指定时 /api/session/start 使用的组合）
+        - all:      画像 × 场景 × 心理状态 全部组合
+        """
+        if not self.enabled or mode not in ("defaults", "all"):
+            return 0
+        options = get_training_options()
+        scenarios = options.get("scenarios") or [None]
+        mental_states = options.get("mental_states") or [None]
+        combos = []
+        for profile in get_user_profiles():
+            if mode == "all":
+                combos.extend((profile, s, m) for s in scenarios for m in mental_states)
+                continue
+            scenario = find_by_id(scenarios, profile.get("default_scenario_id")) if profile.get("default_scenario_id") else None
+            mental_state = find_by_id(mental_states, profile.get("default_mental_state_id")) if profile.get("default_mental_state_id") else None
+            # 默认值为 random 时无法预知组合，跳过
+            if (scenario is None and options.get("scenarios")) or (mental_state is None and options.get("mental_states")):
+                continue
+            combos.append((profile, scenario, mental_state))
+        for profile, scenario, mental_state in combos:
+            self.refill(profile, scenario, mental_state)
+        print(f"[OPENING] 开场白池预热: mode={mode}, 组合数={len(combos)}, 每个组合 {self.size} 条")
+        return len(combos)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": self.size,
+                "ttl_seconds": self.ttl_seconds,
+                "combinations": len(self._pools),
+                "ready": sum(len(pool) for pool in self._pools.values()),
+                "filling": len(self._filling),
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated,
+                "failed": self.failed,
+                "expired": self.expired,
+            }
+
+
+# 全局开场白池
+opening_pool = OpeningPool(
+    size=env_int("PMTRAINER_OPENING_POOL_SIZE", 1),
+    ttl_seconds=env_float("PMTRAINER_OPENING_POOL_TTL", 0.0),
+    max_workers=env_int("PMTRAINER_OPENING_POOL_WORKERS", 1),
+)
+
+
+def warm_opening_pool() -> int:
+    """按 PMTRAINER_OPENING_POOL_WARM 预热全局开场白池"""
+    mode = (os.environ.get("PMTRAINER_OPENING_POOL_WARM") or "defaults").strip().lower()
+    return opening_pool.warm(mode)
@@ -0,0 +1,88 @@
+"""
+提示词前缀缓存：布局开关与命中率统计
+
+后端的前缀/KV 缓存（DashScope 上下文缓存、Ollama keep_alive 复用）只在请求开头若干字节
+与之前的请求完全一致时才生效。原先系统提示词把每轮变化的信任度、已解答顾虑、触发事件
+插在中间，前缀每轮都变，缓存永远命中不了。
+
+PMTRAINER_PROMPT_LAYOUT：
+- legacy（默认）: 沿用原来的整段系统提示词
+- prefix:        系统提示词只包含画像/场景/心理状态/规则等稳定内容（逐字节不变），
+                 信任度/顾虑/事件等易变状态附在最后一条消息末尾
+
+命中率两种口径：
+- prefix: 本进程发出的请求中，系统提示词前缀此前是否出现过（客户端视角，估算上限）
+- backend: 后端 usage 中报告的 cached_tokens / prompt_tokens（DashScope/OpenAI 兼容返回时可用）
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def prompt_layout() -> str:
+    layout = (os.environ.get("PMTRAINER_PROMPT_LAYOUT") or "legacy").strip().lower()
+    return layout if layout in ("legacy", "prefix") else "legacy"
+
+
+class PrefixCacheStats:
+    """统计提示词前缀复用情况（线程安全）"""
+
+    def __init__(self, max_prefixes: int = 512):
+        self.max_prefixes = max(1, int(max_prefixes))
+        self._seen: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.prefix_requests = 0
+        self.prefix_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.usage_reports = 0
+
+    def record_prefix(self, prefix: str) -> bool:
+        """记录一次请求的稳定前缀；返回该前缀此前是否出现过"""
+        digest = hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.prefix_requests += 1
+            hit = digest in self._seen
+            if hit:
+                self.prefix_hits += 1
+                self._seen.move_to_end(digest)
+            self._seen[digest] = len(prefix)
+            while len(self._seen) > self.max_prefixes:
+                self._seen.popitem(last=False)
+            return hit
+
+    def record_usage(self, usage: dict | None) -> None:
+        """记录后端返回的 usage（OpenAI 兼容：prompt_tokens_details.cached_tokens）"""
+        if not isinstance(usage, dict):
+            return
+        try:
+            prompt_tokens = int(usage.get("prompt_tokens") or 0)
+            details = usage.get("prompt_tokens_details") or {}
+            cached = int((details.get("cached_tokens") if isinstance(details, dict) else 0) or 0)
+        except Exception:
+            return
+        if prompt_tokens <= 0:
+            return
+        with self._lock:
+            self.usage_reports += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "layout": prompt_layout(),
+                "prefix_requests": self.prefix_requests,
+                "prefix_hits": self.prefix_hits,
+                "prefix_hit_rate": round(self.prefix_hits / self.prefix_requests, 3) if self.prefix_requests else 0.0,
+                "distinct_prefixes": len(self._seen),
+                "backend_usage_reports": self.usage_reports,
+                "backend_prompt_tokens": self.prompt_tokens,
+                "backend_cached_tokens": self.cached_tokens,
+                "backend_cached_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            }
+
+
+# 全局统计
+prefix_cache_stats = PrefixCacheStats()
@@ -0,0 +1,170 @@
+"""
+结构化输出（JSON Schema）
+
+原先只有本地 Ollama 原生接口带 "format": "json"，远程（DashScope / OpenAI 兼容）只靠提示词要求 JSON，
+模型常常输出代码块、前言或多余字段，既浪费 token 又容易解析失败。这里为各调用方定义回复的 JSON Schema，
+由 LLMClient 按后端转换为请求参数：
+- 远程 / Ollama OpenAI 兼容接口: response_format = {"type": "json_schema", ...}（或 {"type": "json_object"}）
+- Ollama 原生接口:              format = <schema>（或 "json"）
+- 服务端不支持时（返回 400，且错误信息提到 response_format / format / json_schema）自动降级：
+  json_schema -> json_object -> 不带格式参数，降级结果按 (端点, 模型) 记住，之后的请求不再重复试错；
+  其它原因的 400（上下文过长、采样参数错误等）原样返回，不影响之后的请求
+
+环境变量：
+- LLM_STRUCTURED_OUTPUT: 结构化输出级别 json_schema（默认）/ json_object / off
+"""
+import os
+import re
+import threading
+
+
+DIMENSIONS = ("communication_skills", "empathy", "problem_solving", "persuasion", "professionalism")
+
+LEVELS = ("json_schema", "json_object", "off")
+
+# 400 错误信息中出现这些词时，才认为是服务端拒绝了结构化输出参数
+_FORMAT_ERROR = re.compile(r"response_format|json_schema|json_object|\bformat\b", re.IGNORECASE)
+
+
+def _object(properties: dict, required: list | None = None) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties) if required is None else required,
+        "additionalProperties": False,
+    }
+
+
+_STRING = {"type": "string"}
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+_SCORE = {"type": "integer", "minimum": 0, "maximum": 100}
+_SCORES = _object({key: _SCORE for key in DIMENSIONS})
+
+
+# 模拟用户的每轮回复（user_simulator._apply_reply）
+SIMULATOR_REPLY = {
+    "name": "simulator_reply",
+    "schema": _object({
+        "response": _STRING,
+        "inner_thought": _STRING,
+        "trust_change": {"type": "integer", "minimum": -2, "maximum": 2},
+        "concern_addressed": {"type": ["string", "null"]},
+        "willing_to_continue": {"type": "boolean"},
+        "ready_to_open_account": {"type": "boolean"},
+    }),
+}
+
+# 开场白（user_simulator.parse_opening）
+OPENING = {
+    "name": "opening",
+    "schema": _object({"response": _STRING, "inner_thought": _STRING}),
+}
+
+# 整段评估报告（总分由规则计算，不要求模型输出）
+EVALUATION_REPORT = {
+    "name": "evaluation_report",
+    "schema": _object({
+        "scores": _SCORES,
+        "highlights": _STRING_LIST,
+        "improvements": _STRING_LIST,
+        "key_insights": _STRING,
+        "overall_comment": _STRING,
+        "end_explanation": _STRING,
+    }),
+}
+
+# 基于逐轮分数的总结（维度分已由逐轮打分给出）
+EVALUATION_SUMMARY = {
+    "name": "evaluation_summary",
+    "schema": _object({
+        "highlights": _STRING_LIST,
+        "improvements": _STRING_LIST,
+        "key_insights": _STRING,
+        "overall_comment": _STRING,
+        "end_explanation": _STRING,
+    }),
+}
+
+# 单轮打分（incremental_evaluator.score_turn）
+TURN_SCORE = {
+    "name": "turn_score",
+    "schema": _object({"scores": _SCORES, "note": _STRING}),
+}
+
+# 早期对话摘要（conversation_context.HistorySummarizer）
+HISTORY_SUMMARY = {
+    "name": "history_summary",
+    "schema": _object({"summary": _STRING}),
+}
+
+
+class StructuredOutput:
+    """按后端生成结构化输出参数，并记住各端点支持到哪一级（线程安全）"""
+
+    def __init__(self, mode: str = "json_schema"):
+        mode = (mode or "").strip().lower()
+        self.mode = mode if mode in LEVELS else "json_schema"
+        self._levels: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.requests = {level: 0 for level in LEVELS}
+        self.downgrades = 0
+
+    @staticmethod
+    def _key(endpoint: str, model: str) -> str:
+        return f"{endpoint}|{model}"
+
+    def level(self, endpoint: str, model: str, schema: dict | None) -> str:
+        """本次请求使用的级别：未指定 schema 时为 off"""
+        if schema is None:
+            return "off"
+        with self._lock:
+            return self._levels.get(self._key(endpoint, model), self.mode)
+
+    @staticmethod
+    def rejected(response) -> bool:
+        """400 响应是否因为结构化输出参数（而不是上下文过长、采样参数错误等其它原因）"""
+        try:
+            body = response.text or ""
+        except Exception:
+            return False
+        return bool(_FORMAT_ERROR.search(body))
+
+    def downgrade(self, endpoint: str, model: str, level: str) -> str | None:
+        """level 被服务端拒绝：记住并返回下一级；已是最低级时返回 None"""
+        idx = LEVELS.index(level)
+        if idx + 1 >= len(LEVELS):
+            return None
+        next_level = LEVELS[idx + 1]
+        with self._lock:
+            self._levels[self._key(endpoint, model)] = next_level
+            self.downgrades += 1
+        print(f"[LLM] 端点不支持结构化输出 {level}，降级为 {next_level}: {endpoint}")
+        return next_level
+
+    def apply(self, backend: str, payload: dict, schema: dict | None, level: str) -> dict:
+        """返回带上结构化输出参数的请求体（不修改传入的 payload）"""
+        with self._lock:
+            self.requests[level] += 1
+        if schema is None or level == "off":
+            return payload
+        if backend == "ollama_native":
+            # 原生接口本来就带 "format": "json"，这里只在 json_schema 级别换成具体 schema
+            return {**payload, "format": schema["schema"]} if level == "json_schema" else payload
+        if level == "json_schema":
+            response_format = {"type": "json_schema", "json_schema": {"name": schema["name"], "schema": schema["schema"]}}
+        else:
+            response_format = {"type": "json_object"}
+        return {**payload, "response_format": response_format}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "requests": dict(self.requests),
+                "downgrades": self.downgrades,
+                "downgraded_endpoints": dict(self._levels),
+            }
+
+
+# 全局结构化输出配置
+structured_output = StructuredOutput(os.environ.get("LLM_STRUCTURED_OUTPUT") or "json_schema")
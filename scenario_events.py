@@ -0,0 +1,107 @@
+"""
+场景事件触发索引
+
+原先每轮对话都要遍历场景的全部事件：逐个事件把 keyword_any 转小写、重建“已触发”集合、
+逐个关键词查找。场景事件多达几十个时这部分开销会逐轮累积。这里在配置加载时把事件编译成索引：
+- 轮次阈值（turn_gte）、信任度阈值（trust_gte）按阈值排序，每轮只看阈值已达到的事件
+- 所有事件的关键词合成一个关键词匹配器，每轮对 PM 消息只扫描一次
+- 触发顺序、概率判定（random.random() 的调用顺序）与原先逐个事件判断完全一致
+"""
+import bisect
+from typing import Any
+
+from text_matcher import KeywordMatcher, cached_compile
+
+
+# 未配置的阈值视为无下限
+_NO_THRESHOLD = -(2 ** 31)
+
+
+def _threshold(value: Any) -> int:
+    return _NO_THRESHOLD if value is None else int(value)
+
+
+class _CompiledEvent:
+    __slots__ = ("order", "event", "event_id", "turn_gte", "trust_gte", "needs_keyword", "probability")
+
+    def __init__(self, order: int, event: dict, turn_gte: int, trust_gte: int, needs_keyword: bool, probability: float):
+        self.order = order
+        self.event = event
+        self.event_id = event.get("id")
+        self.turn_gte = turn_gte
+        self.trust_gte = trust_gte
+        self.needs_keyword = needs_keyword
+        self.probability = probability
+
+
+class ScenarioEventIndex:
+    """一个场景的事件触发索引（只读，可在会话间共享）"""
+
+    def __init__(self, events: list | None):
+        self.events: list[_CompiledEvent] = []
+        keywords = []
+        for order, ev in enumerate(events if isinstance(events, list) else []):
+            if not isinstance(ev, dict):
+                continue
+            trigger = ev.get("trigger") or {}
+            if not isinstance(trigger, dict):
+                continue
+            try:
+                turn_gte = _threshold(trigger.get("turn_gte"))
+                trust_gte = _threshold(trigger.get("trust_gte"))
+            except (TypeError, ValueError):
+                print(f"[CONFIG] 场景事件阈值无效，已忽略: event={ev.get('id')}, trigger={trigger}")
+                continue
+            keyword_any = trigger.get("keyword_any") or []
+            prob = trigger.get("probability", 1.0)
+            try:
+                prob = float(prob)
+            except Exception:
+                prob = 1.0
+            compiled = _CompiledEvent(order, ev, turn_gte, trust_gte, bool(keyword_any), prob)
+            self.events.append(compiled)
+            for k in keyword_any:
+                keywords.append((str(k), order))
+
+        self.keywords = KeywordMatcher(keywords)
+        # 按轮次阈值排序：bisect 一次即可取出“轮次已达到”的事件
+        self._by_turn = sorted(self.events, key=lambda e: e.turn_gte)
+        self._turn_keys = [e.turn_gte for e in self._by_turn]
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def triggered(self, turn: int, trust: int, pm_message: str, exclude_ids: set, rng: Any) -> list[dict]:
+        """
+        返回本轮新触发的事件（按配置顺序）
+
+        Args:
+            turn: 产品经理已发言轮数
+            trust: 当前信任度
+            pm_message: 本轮 PM 消息
+            exclude_ids: 已触发事件的 id（本轮开始时的快照）
+            rng: 提供 random() 的随机数源（用于概率触发）
+        """
+        if not self.events:
+            return []
+        reached = self._by_turn[:bisect.bisect_right(self._turn_keys, turn)]
+        candidates = [e for e in reached if e.trust_gte <= trust and e.event_id not in exclude_ids]
+        if not candidates:
+            return []
+
+        hit_orders = self.keywords.values_in(pm_message or "") if any(e.needs_keyword for e in candidates) else set()
+        fired = []
+        for e in sorted(candidates, key=lambda c: c.order):
+            if e.needs_keyword and e.order not in hit_orders:
+                continue
+            if e.probability < 1.0 and rng.random() > e.probability:
+                continue
+            fired.append(e.event)
+        return fired
+
+
+def scenario_event_index(events: list | None, store: bool = True) -> ScenarioEventIndex:
+    """按事件列表对象缓存编译结果（配置加载时预编译）"""
+    if not isinstance(events, list):
+        return ScenarioEventIndex(None)
+    return cached_compile(events, ScenarioEventIndex, store=store)
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+自对弈压测（PM 智能体 vs 用户模拟器）
+
+不依赖真人在 train.js 里打字，批量跑「画像 × 场景 × 心理状态」的全部组合，用于容量规划：
+- PM 智能体: scripted（按话术脚本轮换发言，默认）/ llm（由 LLM 扮演产品经理，失败时退回脚本）
+- 驱动方式: python（直接调用 UserSimulator，不经过 Flask）/ http（请求运行中的 app.py 接口，
+  --stream 时走 /chat/stream 并统计首字延迟）
+- 多个会话并行（--concurrency），每个会话内逐轮对话，可用 --think-time 模拟真人打字间隔
+- LLM 繁忙（调度器排队已满 / HTTP 503）时按 Retry-After 等待后重发本轮，并计入 busy 次数
+- 报告: 吞吐（轮/秒、会话/分钟）、每轮延迟 p50/p95/p99、开场白/首字/评估延迟、
+  结束原因分布、成功率（按画像/场景/心理状态及各组合成功率的分布）；--json 输出机器可读报告
+
+用法：
+    python selfplay.py --repeat 2 --concurrency 8
+    python selfplay.py --driver http --url http://127.0.0.1:8080 --stream --concurrency 32 --think-time 3
+    python selfplay.py --agent llm --profiles 1,4 --scenarios default --mental-states default --json report.json
+    python selfplay.py --script pm_lines.txt --max-turns 8        # 话术脚本：每行一句
+
+环境变量：
+- PMTRAINER_SELFPLAY_URL: http 驱动默认的服务地址（默认 http://127.0.0.1:8080）
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any
+
+import requests
+
+from evaluator import ConversationEvaluator
+from llm_client import llm_client
+from llm_scheduler import INTERACTIVE, LLMBusy, llm_context
+from training_config import get_goals_config, get_training_options, get_user_profiles
+from user_simulator import UserSimulator
+
+
+# 达成训练目标的结束原因（与 app._finish_chat_turn 一致）
+SUCCESS_REASONS = ("success", "trust_full", "concerns_full")
+
+# 默认话术脚本：覆盖安全、费用、风险、操作、开户流程等常见顾虑
+DEFAULT_SCRIPT = [
+    "您好！我是腾讯自选股的产品经理，您先别着急，有什么不明白的都可以慢慢问我。",
+    "您最担心的是哪一块呢？是资金安全、操作难，还是怕亏钱？",
+    "资金安全这点您可以放心：开户是在持牌券商完成的，资金由银行第三方存管，我们和券商都碰不到您的钱。",
+    "炒股确实有风险，我不会跟您说稳赚。刚开始可以先用模拟盘或者很小的金额熟悉一下，亏了也不心疼。",
+    "专业名词不用怕，您就把股票理解成买了一家公司的一小份，App 里每个术语点一下都有通俗解释。",
+    "操作上其实和用微信差不多，开户全程在手机上跟着提示拍身份证、做个视频确认就行，大概十分钟。",
+    "费用方面，开户本身不收钱，买卖的时候券商会收一点佣金，页面上都写得清清楚楚，没有隐藏收费。",
+    "如果您平时比较忙，可以先只用自选和提醒功能，关注几只熟悉的公司，不用天天盯盘。",
+    "身边很多和您情况差不多的用户，一开始也是先看看行情、学点知识，觉得合适了才开始小额尝试。",
+    "您看我这样解释清楚吗？还有哪里让您觉得不放心，我们一条条说。",
+    "要不这样，我陪您先把开户流程走一遍，中间有任何不确定的地方随时可以停下来，不会自动扣任何钱。",
+    "开好户之后也不一定要马上买，您可以先放着观察，想好了再决定，完全由您自己做主。",
+]
+
+PM_AGENT_PROMPT = """你是腾讯自选股的产品经理，正在和一位潜在用户聊天，目标是理解对方的顾虑、用通俗的语言解答，
+逐步建立信任并引导开户。不要承诺收益，不要使用专业术语堆砌，每次只说一到三句话。
+
+对方的基本情况：{name}，{age}岁，{occupation}。{trigger_scenario}
+
+直接输出你要说的话，不要输出任何说明或引号。"""
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """最近秩百分位数（values 为空时返回 0）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+# ---- PM 智能体 ----
+
+class ScriptedPMAgent:
+    """按话术脚本轮换发言；每个会话从脚本中随机的位置开始，避免所有会话发出完全相同的请求"""
+
+    name = "scripted"
+
+    def __init__(self, lines: list[str] | None = None, seed: int | None = None):
+        self.lines = [line for line in (lines or DEFAULT_SCRIPT) if line.strip()]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def start(self) -> int:
+        """开始一个会话，返回该会话的状态（脚本起始位置）"""
+        with self._lock:
+            return self._random.randrange(len(self.lines))
+
+    def reply(self, state: Any, profile: dict, transcript: list[dict], turn: int) -> str:
+        return self.lines[(state + turn) % len(self.lines)]
+
+
+class LLMPMAgent:
+    """由 LLM 扮演产品经理；LLM 调用失败时退回话术脚本"""
+
+    name = "llm"
+
+    def __init__(self, model: str | None = None, fallback: ScriptedPMAgent | None = None):
+        self.model = model
+        self.fallback = fallback or ScriptedPMAgent()
+        self.fallbacks = 0
+
+    def start(self) -> int:
+        return self.fallback.start()
+
+    def reply(self, state: Any, profile: dict, transcript: list[dict], turn: int) -> str:
+        messages = [{"role": "system", "content": PM_AGENT_PROMPT.format(**{
+            key: profile.get(key, "") for key in ("name", "age", "occupation", "trigger_scenario")
+        })}]
+        # 对 PM 智能体而言，用户的发言是输入（user），自己说过的话是 assistant
+        for item in transcript:
+            messages.append({"role": "assistant" if item["role"] == "pm" else "user", "content": item["content"]})
+        text = llm_client.chat(messages, temperature=0.8, max_tokens=200, model=self.model).strip()
+        if not text or text.startswith("["):
+            self.fallbacks += 1
+            return self.fallback.reply(state, profile, transcript, turn)
+        return text.strip("\"“”")
+
+
+# ---- 驱动 ----
+
+class TurnResult:
+    __slots__ = ("response", "ended", "end_reason", "trust_level", "ttft")
+
+    def __init__(self, response: str, ended: bool, end_reason: str | None, trust_level: int,
+                 ttft: float | None = None):
+        self.response = response
+        self.ended = ended
+        self.end_reason = end_reason
+        self.trust_level = trust_level
+        self.ttft = ttft
+
+
+class PythonDriver:
+    """直接调用 UserSimulator（不经过 Flask），结束条件与 app._finish_chat_turn 一致"""
+
+    name = "python"
+
+    def __init__(self, stream: bool = False, max_turns: int | None = None):
+        self.stream = stream
+        end_conditions = get_goals_config().get("end_conditions") or {}
+        self.max_turns = int(max_turns or end_conditions.get("max_turns", 20))
+
+    def start(self, session_id: str, profile: dict, scenario: dict | None, mental_state: dict | None):
+        simulator = UserSimulator(profile, scenario=scenario, mental_state=mental_state)
+        with llm_context(INTERACTIVE, session_id):
+            opening = simulator.get_opening_message()
+        return simulator, opening["response"]
+
+    def turn(self, session_id: str, simulator: UserSimulator, message: str, turn: int) -> TurnResult:
+        started = time.monotonic()
+        ttft = None
+        with llm_context(INTERACTIVE, session_id):
+            if self.stream:
+                response = None
+                for kind, value in simulator.respond_stream(message):
+                    if kind == "delta" and ttft is None:
+                        ttft = time.monotonic() - started
+                    elif kind == "done":
+                        response = value
+            else:
+                response = simulator.respond(message)
+        end_reason = self._end_reason(simulator, response, turn)
+        return TurnResult(response["response"], end_reason is not None, end_reason, simulator.trust_level, ttft)
+
+    def _end_reason(self, simulator: UserSimulator, response: dict, turn: int) -> str | None:
+        if simulator.is_convinced:
+            return "success"
+        if not response.get("willing_to_continue", True):
+            return "user_quit"
+        if int(simulator.trust_level) >= 10:
+            return "trust_full"
+        total_concerns = len(simulator.profile.get("pain_points") or [])
+        if total_concerns > 0 and len(simulator.concerns_addressed or []) >= total_concerns:
+            return "concerns_full"
+        if turn >= self.max_turns:
+            return "max_turns"
+        return None
+
+    def evaluate(self, session_id: str, simulator: UserSimulator, turn: int, end_reason: str | None) -> None:
+        ConversationEvaluator().evaluate(
+            simulator.conversation_history, simulator.profile, simulator.trust_level,
+            simulator.is_convinced, simulator.concerns_addressed, turn,
+            scenario=simulator.scenario, mental_state=simulator.mental_state, end_reason=end_reason,
+        )
+
+
+class HTTPDriver:
+    """请求运行中的 app.py（每个线程一个 keep-alive 连接）"""
+
+    name = "http"
+
+    def __init__(self, base_url: str, stream: bool = False, timeout: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.stream = stream
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        http = getattr(self._local, "session", None)
+        if http is None:
+            http = self._local.session = requests.Session()
+        return http
+
+    def _post(self, path: str, payload: dict | None = None, stream: bool = False) -> requests.Response:
+        resp = self._session().post(f"{self.base_url}{path}", json=payload or {}, timeout=self.timeout, stream=stream)
+        if resp.status_code == 503:
+            retry_after = resp.headers.get("Retry-After") or "5"
+            resp.close()
+            raise LLMBusy(retry_after)
+        if resp.status_code >= 400:
+            text = resp.text[:200]
+            resp.close()
+            raise RuntimeError(f"HTTP {resp.status_code} {path}: {text}")
+        return resp
+
+    def start(self, session_id: str, profile: dict, scenario: dict | None, mental_state: dict | None):
+        data = self._post("/api/session/start", {
+            "profile_id": profile.get("id"),
+            "scenario_id": (scenario or {}).get("id"),
+            "mental_state_id": (mental_state or {}).get("id"),
+        }).json()
+        return data["session_id"], data.get("opening_message") or ""
+
+    def turn(self, session_id: str, remote_id: str, message: str, turn: int) -> TurnResult:
+        if not self.stream:
+            data = self._post(f"/api/session/{remote_id}/chat", {"message": message}).json()
+            return self._result(data)
+        started = time.monotonic()
+        ttft = None
+        event = None
+        with self._post(f"/api/session/{remote_id}/chat/stream", {"message": message}, stream=True) as resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:].strip())
+                    if event == "delta" and ttft is None:
+                        ttft = time.monotonic() - started
+                    elif event == "done":
+                        return self._result(data, ttft)
+                    elif event == "error":
+                        if data.get("busy"):
+                            raise LLMBusy("5")
+                        raise RuntimeError(data.get("error") or "stream error")
+        raise RuntimeError("流式响应未返回 done 事件")
+
+    @staticmethod
+    def _result(data: dict, ttft: float | None = None) -> TurnResult:
+        status = data.get("status") or {}
+        return TurnResult(data.get("response") or "", bool(data.get("is_ended")), data.get("end_reason"),
+                          int(status.get("trust_level") or 0), ttft)
+
+    def evaluate(self, session_id: str, remote_id: str, turn: int, end_reason: str | None) -> None:
+        self._post(f"/api/session/{remote_id}/evaluate").close()
+
+
+# ---- 对弈 ----
+
+def _parse_ids(value: str, items: list[dict], cast=str) -> list | None:
+    """all -> 全部；default -> None（使用画像默认）；否则为逗号分隔的 id"""
+    value = (value or "all").strip()
+    if value == "all":
+        return [item.get("id") for item in items]
+    if value == "default":
+        return None
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def build_combinations(profiles_arg: str = "all", scenarios_arg: str = "all",
+                       mental_states_arg: str = "all") -> list[tuple[dict, dict | None, dict | None]]:
+    """画像 × 场景 × 心理状态 的组合；default 表示使用画像的默认场景/心理状态"""
+    options = get_training_options()
+    scenarios = {s.get("id"): s for s in options.get("scenarios") or []}
+    mental_states = {m.get("id"): m for m in options.get("mental_states") or []}
+    profiles = {p.get("id"): p for p in get_user_profiles()}
+    profile_ids = _parse_ids(profiles_arg, list(profiles.values()), cast=int) or list(profiles)
+    scenario_ids = _parse_ids(scenarios_arg, list(scenarios.values()))
+    mental_state_ids = _parse_ids(mental_states_arg, list(mental_states.values()))
+
+    combos = []
+    for profile_id in profile_ids:
+        profile = profiles.get(profile_id)
+        if profile is None:
+            raise ValueError(f"用户画像不存在: {profile_id}")
+        for scenario_id in scenario_ids or [profile.get("default_scenario_id")]:
+            for mental_state_id in mental_state_ids or [profile.get("default_mental_state_id")]:
+                combos.append((profile, scenarios.get(scenario_id), mental_states.get(mental_state_id)))
+    return combos
+
+
+class SelfPlay:
+    """并行运行多个自对弈会话并汇总延迟/成功率"""
+
+    def __init__(self, driver, agent, concurrency: int = 4, think_time: float = 0.0,
+                 busy_retries: int = 5, evaluate: bool = False):
+        self.driver = driver
+        self.agent = agent
+        self.concurrency = max(1, int(concurrency))
+        self.think_time = max(0.0, float(think_time))
+        self.busy_retries = max(0, int(busy_retries))
+        self.evaluate = evaluate
+
+    def _with_busy_retry(self, result: dict, call, *args):
+        """LLM 繁忙时按 Retry-After 等待后重试；超过重试次数时抛出 LLMBusy"""
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return call(*args)
+            except LLMBusy as e:
+                result["busy"] += 1
+                if attempt >= self.busy_retries:
+                    raise
+                try:
+                    wait = float(str(e) or 5)
+                except ValueError:
+                    wait = 5.0
+                time.sleep(min(wait, 30.0))
+
+    def run_session(self, index: int, profile: dict, scenario: dict | None, mental_state: dict | None) -> dict:
+        session_id = f"selfplay-{index}"
+        result: dict[str, Any] = {
+            "index": index,
+            "profile_id": profile.get("id"),
+            "scenario_id": (scenario or {}).get("id"),
+            "mental_state_id": (mental_state or {}).get("id"),
+            "turns": 0,
+            "end_reason": None,
+            "final_trust": None,
+            "opening_latency": None,
+            "turn_latencies": [],
+            "ttfts": [],
+            "agent_latencies": [],
+            "evaluation_latency": None,
+            "busy": 0,
+            "error": None,
+        }
+        started = time.monotonic()
+        try:
+            t0 = time.monotonic()
+            handle, opening = self._with_busy_retry(result, self.driver.start, session_id, profile, scenario, mental_state)
+            result["opening_latency"] = time.monotonic() - t0
+            transcript = [{"role": "user", "content": opening}]
+            state = self.agent.start()
+            turn = 0
+            while True:
+                if self.think_time > 0:
+                    time.sleep(self.think_time)
+                t0 = time.monotonic()
+                message = self.agent.reply(state, profile, transcript, turn)
+                result["agent_latencies"].append(time.monotonic() - t0)
+                turn += 1
+                t0 = time.monotonic()
+                outcome = self._with_busy_retry(result, self.driver.turn, session_id, handle, message, turn)
+                result["turn_latencies"].append(time.monotonic() - t0)
+                if outcome.ttft is not None:
+                    result["ttfts"].append(outcome.ttft)
+                transcript.append({"role": "pm", "content": message})
+                transcript.append({"role": "user", "content": outcome.response})
+                result["turns"] = turn
+                result["final_trust"] = outcome.trust_level
+                if outcome.ended:
+                    result["end_reason"] = outcome.end_reason
+                    break
+            if self.evaluate:
+                t0 = time.monotonic()
+                self.driver.evaluate(session_id, handle, turn, result["end_reason"])
+                result["evaluation_latency"] = time.monotonic() - t0
+        except LLMBusy:
+            result["end_reason"] = "busy"
+        except Exception as e:
+            result["end_reason"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["duration"] = time.monotonic() - started
+        return result
+
+    def run(self, combos: list[tuple[dict, dict | None, dict | None]], repeat: int = 1) -> dict:
+        jobs = [combo for _ in range(max(1, int(repeat))) for combo in combos]
+        print(f"[SELFPLAY] driver={self.driver.name}, agent={self.agent.name}, 组合 {len(combos)} 个 × {repeat} 次 "
+              f"= {len(jobs)} 个会话, concurrency={self.concurrency}")
+        results = []
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="selfplay") as pool:
+            futures = [pool.submit(self.run_session, i, *combo) for i, combo in enumerate(jobs)]
+            for finished, future in enumerate(as_completed(futures), 1):
+                results.append(future.result())
+                if finished % 10 == 0 or finished == len(futures):
+                    print(f"[SELFPLAY] 进度 {finished}/{len(futures)}，已用 {time.monotonic() - started:.1f} 秒")
+        return build_report(results, time.monotonic() - started, self)
+
+
+def _success_rates(results: list[dict], key) -> dict:
+    groups: dict[str, list[bool]] = {}
+    for r in results:
+        groups.setdefault(str(key(r)), []).append(r["end_reason"] in SUCCESS_REASONS)
+    return {name: {"sessions": len(flags), "success_rate": round(sum(flags) / len(flags), 4)}
+            for name, flags in sorted(groups.items())}
+
+
+def build_report(results: list[dict], wall_seconds: float, selfplay: SelfPlay | None = None) -> dict:
+    """汇总各会话结果"""
+    turn_latencies = [x for r in results for x in r["turn_latencies"]]
+    turns = len(turn_latencies)
+    end_reasons: dict[str, int] = {}
+    for r in results:
+        end_reasons[str(r["end_reason"])] = end_reasons.get(str(r["end_reason"]), 0) + 1
+    successes = sum(1 for r in results if r["end_reason"] in SUCCESS_REASONS)
+
+    by_combo = _success_rates(results, lambda r: f"{r['profile_id']}/{r['scenario_id']}/{r['mental_state_id']}")
+    # 各组合成功率的分布：每 20% 一档
+    buckets = {f"{lo}-{lo + 20}%": 0 for lo in range(0, 100, 20)}
+    for stats in by_combo.values():
+        lo = min(80, int(stats["success_rate"] * 100) // 20 * 20)
+        buckets[f"{lo}-{lo + 20}%"] += 1
+
+    trust: dict[str, int] = {}
+    for r in results:
+        if r["final_trust"] is not None:
+            trust[str(r["final_trust"])] = trust.get(str(r["final_trust"]), 0) + 1
+
+    report = {
+        "driver": selfplay.driver.name if selfplay else None,
+        "agent": selfplay.agent.name if selfplay else None,
+        "concurrency": selfplay.concurrency if selfplay else None,
+        "think_time": selfplay.think_time if selfplay else None,
+        "sessions": len(results),
+        "turns": turns,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "turns_per_second": round(turns / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+            "sessions_per_minute": round(len(results) * 60 / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        },
+        "latency": {
+            "turn": latency_summary(turn_latencies),
+            "ttft": latency_summary([x for r in results for x in r["ttfts"]]),
+            "opening": latency_summary([r["opening_latency"] for r in results if r["opening_latency"] is not None]),
+            "evaluation": latency_summary([r["evaluation_latency"] for r in results
+                                           if r["evaluation_latency"] is not None]),
+            "pm_agent": latency_summary([x for r in results for x in r["agent_latencies"]]),
+        },
+        "busy_retries": sum(r["busy"] for r in results),
+        "errors": [r["error"] for r in results if r["error"]][:20],
+        "success_rate": round(successes / len(results), 4) if results else 0.0,
+        "end_reasons": dict(sorted(end_reasons.items())),
+        "final_trust": dict(sorted(trust.items(), key=lambda kv: int(kv[0]))),
+        "success_by_profile": _success_rates(results, lambda r: r["profile_id"]),
+        "success_by_scenario": _success_rates(results, lambda r: r["scenario_id"]),
+        "success_by_mental_state": _success_rates(results, lambda r: r["mental_state_id"]),
+        "success_by_combination": by_combo,
+        "combination_success_distribution": buckets,
+    }
+    if selfplay is not None and isinstance(selfplay.agent, LLMPMAgent):
+        report["pm_agent_fallbacks"] = selfplay.agent.fallbacks
+    return report
+
+
+def print_report(report: dict) -> None:
+    print()
+    print(f"会话 {report['sessions']} 个，对话 {report['turns']} 轮，耗时 {report['wall_seconds']} 秒")
+    print(f"吞吐: {report['throughput']['turns_per_second']} 轮/秒，"
+          f"{report['throughput']['sessions_per_minute']} 会话/分钟；繁忙重试 {report['busy_retries']} 次")
+    for name, label in (("turn", "每轮延迟"), ("ttft", "首字延迟"), ("opening", "开场白"),
+                        ("evaluation", "评估"), ("pm_agent", "PM 智能体")):
+        stats = report["latency"][name]
+        if stats["count"]:
+            print(f"{label}: p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s p99={stats['p99']:.3f}s "
+                  f"max={stats['max']:.3f}s (n={stats['count']})")
+    print(f"成功率: {report['success_rate']:.1%}；结束原因: {report['end_reasons']}")
+    for title, key in (("画像", "success_by_profile"), ("场景", "success_by_scenario"),
+                       ("心理状态", "success_by_mental_state")):
+        parts = [f"{name}={stats['success_rate']:.0%}" for name, stats in report[key].items()]
+        print(f"按{title}: {', '.join(parts)}")
+    print(f"各组合成功率分布: {report['combination_success_distribution']}")
+    if report["errors"]:
+        print(f"错误（前 {len(report['errors'])} 条）: {report['errors']}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="PM 智能体与用户模拟器自对弈压测")
+    parser.add_argument("--driver", choices=("python", "http"), default="python", help="驱动方式（默认 python）")
+    parser.add_argument("--url", default=os.environ.get("PMTRAINER_SELFPLAY_URL") or "http://127.0.0.1:8080",
+                        help="http 驱动的服务地址")
+    parser.add_argument("--stream", action="store_true", help="使用流式回复并统计首字延迟")
+    parser.add_argument("--agent", choices=("scripted", "llm"), default="scripted", help="PM 智能体（默认 scripted）")
+    parser.add_argument("--agent-model", help="llm 智能体使用的模型（默认与模拟器相同）")
+    parser.add_argument("--script", help="话术脚本文件（每行一句），默认使用内置脚本")
+    parser.add_argument("--profiles", default="all", help="画像 id，逗号分隔（默认 all）")
+    parser.add_argument("--scenarios", default="all", help="场景 id，逗号分隔；all / default（画像默认场景）")
+    parser.add_argument("--mental-states", default="all", help="心理状态 id，逗号分隔；all / default")
+    parser.add_argument("--repeat", type=int, default=1, help="每个组合跑几次（默认 1）")
+    parser.add_argument("--concurrency", type=int, default=4, help="并行会话数（默认 4）")
+    parser.add_argument("--max-turns", type=int, help="python 驱动的最大轮数（默认取 goals.end_conditions.max_turns）")
+    parser.add_argument("--think-time", type=float, default=0.0, help="每轮发言前等待的秒数，模拟真人打字（默认 0）")
+    parser.add_argument("--busy-retries", type=int, default=5, help="LLM 繁忙时每轮最多重试几次（默认 5）")
+    parser.add_argument("--evaluate", action="store_true", help="会话结束后请求评估并统计评估延迟")
+    parser.add_argument("--seed", type=int, help="话术脚本起始位置的随机种子")
+    parser.add_argument("--json", help="把报告写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    lines = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+    scripted = ScriptedPMAgent(lines, seed=args.seed)
+    agent = LLMPMAgent(model=args.agent_model, fallback=scripted) if args.agent == "llm" else scripted
+    if args.driver == "http":
+        driver = HTTPDriver(args.url, stream=args.stream)
+    else:
+        driver = PythonDriver(stream=args.stream, max_turns=args.max_turns)
+
+    combos = build_combinations(args.profiles, args.scenarios, args.mental_states)
+    selfplay = SelfPlay(driver, agent, concurrency=args.concurrency, think_time=args.think_time,
+                        busy_retries=args.busy_retries, evaluate=args.evaluate)
+    report = selfplay.run(combos, repeat=args.repeat)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[SELFPLAY] 报告已写入: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
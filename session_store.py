@@ -0,0 +1,350 @@
+"""
+训练会话存储
+
+原先所有 TrainingSession 都放在 app.py 的全局 dict 里：从不回收、重启即丢失、
+多个 gunicorn worker 之间也无法共享。这里提供可插拔的会话存储：
+- memory: 进程内 LRU + 空闲过期（默认，单进程开发用）
+- sqlite: SQLite（WAL 模式）持久化，会话以 JSON 状态保存，可被多个 worker 共享、重启后仍可继续
+
+环境变量：
+- PMTRAINER_SESSION_STORE: memory / sqlite（默认 memory）
+- PMTRAINER_SESSION_DB:    sqlite 文件路径（默认项目根目录 sessions.db）
+- PMTRAINER_SESSION_TTL:   会话空闲多少秒后过期（默认 7200）
+- PMTRAINER_SESSION_MAX:   memory 模式最多保留多少个会话（默认 1000，超出按 LRU 淘汰）
+- PMTRAINER_SESSION_MEMORY_MB:      memory 模式所有会话的内存预算（默认 256，超出按 LRU 淘汰）
+- PMTRAINER_SESSION_SWEEP_INTERVAL: memory 模式空闲会话清扫间隔，秒（默认 60，0 表示不启用后台清扫）
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from config import env_float, env_int
+
+
+class SessionStore:
+    """会话存储接口；支持 `in` / `[]` 以兼容原先 dict 的用法"""
+
+    def get(self, session_id: str) -> Any | None:
+        raise NotImplementedError
+
+    def save(self, session_obj: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "sessions": len(self)}
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id: str) -> Any:
+        session_obj = self.get(session_id)
+        if session_obj is None:
+            raise KeyError(session_id)
+        return session_obj
+
+    def __setitem__(self, session_id: str, session_obj: Any) -> None:
+        self.save(session_obj)
+
+
+class _Slot:
+    __slots__ = ("session_obj", "touched_at", "size", "measured_size", "measured_messages")
+
+    def __init__(self, session_obj: Any, touched_at: float, size: int,
+                 measured_size: int = 0, measured_messages: int = 0):
+        self.session_obj = session_obj
+        self.touched_at = touched_at
+        self.size = size
+        # 上次完整序列化时的大小与消息条数：之后只按新增消息增量估算
+        self.measured_size = measured_size
+        self.measured_messages = measured_messages
+
+
+class MemorySessionStore(SessionStore):
+    """
+    进程内 LRU 会话存储，三种淘汰方式：
+    - idle: 空闲超过 ttl 秒（后台线程定期清扫，访问时也会检查）
+    - count: 会话数超过 max_sessions
+    - memory: 所有会话估算大小之和超过 max_bytes
+
+    会话大小按其 JSON 状态的字节数估算。每轮对话都完整序列化一次的开销随对话长度增长，因此 save() 时
+    只按新增消息的字节数增量估算；估算值比上次完整测量翻倍，或所有会话合计接近内存预算时才重新完整序列化，
+    保证按内存淘汰时依据的是准确大小。
+    """
+
+    # 每字节新增消息对应的会话状态增长（消息同时保存在前端消息列表与模拟器对话历史中）
+    MESSAGE_GROWTH_FACTOR = 2
+    # 合计估算超过预算的这一比例时，改为每次完整测量
+    REMEASURE_RATIO = 0.9
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl_seconds: float = 7200.0,
+        max_bytes: int = 256 * 1024 * 1024,
+        to_state: Callable[[Any], dict] | None = None,
+        sweep_interval: float = 60.0,
+    ):
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = max(0, int(max_bytes))
+        self.to_state = to_state
+        self.sweep_interval = float(sweep_interval)
+        self._items: OrderedDict[str, _Slot] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evicted: dict[str, int] = {"idle": 0, "count": 0, "memory": 0}
+        if self.sweep_interval > 0:
+            threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True).start()
+
+    def _estimate_size(self, session_obj: Any) -> int:
+        if self.to_state is None:
+            return 0
+        try:
+            return len(json.dumps(self.to_state(session_obj), ensure_ascii=False).encode("utf-8"))
+        except Exception:
+            return 0
+
+    @staticmethod
+    def _messages(session_obj: Any) -> list:
+        messages = getattr(session_obj, "messages", None)
+        return messages if isinstance(messages, list) else []
+
+    def _incremental_size(self, session_obj: Any, slot: _Slot | None) -> int | None:
+        """按上次完整测量后新增的消息估算大小；需要重新完整测量时返回 None"""
+        if slot is None or slot.session_obj is not session_obj or not slot.measured_size:
+            return None
+        messages = self._messages(session_obj)
+        if len(messages) < slot.measured_messages:
+            return None
+        try:
+            added = sum(len(json.dumps(m, ensure_ascii=False).encode("utf-8"))
+                        for m in messages[slot.measured_messages:])
+        except Exception:
+            return None
+        size = slot.measured_size + added * self.MESSAGE_GROWTH_FACTOR
+        if size >= 2 * slot.measured_size:
+            return None
+        if self.max_bytes and self._total_bytes - slot.size + size > self.max_bytes * self.REMEASURE_RATIO:
+            return None
+        return size
+
+    def _pop(self, session_id: str, reason: str | None = None) -> None:
+        slot = self._items.pop(session_id, None)
+        if slot is None:
+            return
+        self._total_bytes -= slot.size
+        if reason:
+            self.evicted[reason] += 1
+
+    def _evict(self, now: float, keep: str | None = None) -> None:
+        # OrderedDict 按最近访问排序，最旧的在前；刚写入的会话（keep）不会被淘汰
+        for session_id in list(self._items.keys()):
+            if session_id == keep:
+                continue
+            slot = self._items[session_id]
+            if now - slot.touched_at > self.ttl_seconds:
+                self._pop(session_id, "idle")
+            elif len(self._items) > self.max_sessions:
+                self._pop(session_id, "count")
+            elif self.max_bytes and self._total_bytes > self.max_bytes:
+                self._pop(session_id, "memory")
+            else:
+                break
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def sweep(self) -> None:
+        """清理所有空闲过期的会话（LRU 顺序之外的过期会话也会被清掉）"""
+        now = time.time()
+        with self._lock:
+            for session_id in [sid for sid, slot in self._items.items() if now - slot.touched_at > self.ttl_seconds]:
+                self._pop(session_id, "idle")
+
+    def get(self, session_id: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            slot = self._items.get(session_id)
+            if slot is None:
+                return None
+            if now - slot.touched_at > self.ttl_seconds:
+                self._pop(session_id, "idle")
+                return None
+            slot.touched_at = now
+            self._items.move_to_end(session_id)
+            return slot.session_obj
+
+    def save(self, session_obj: Any) -> None:
+        now = time.time()
+        with self._lock:
+            slot = self._items.get(session_obj.session_id)
+            size = self._incremental_size(session_obj, slot)
+        if size is None:
+            size = self._estimate_size(session_obj)
+            measured_size, measured_messages = size, len(self._messages(session_obj))
+        else:
+            measured_size, measured_messages = slot.measured_size, slot.measured_messages
+        with self._lock:
+            self._pop(session_obj.session_id)
+            self._items[session_obj.session_id] = _Slot(session_obj, now, size, measured_size, measured_messages)
+            self._total_bytes += size
+            self._evict(now, keep=session_obj.session_id)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._pop(session_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            sizes = [slot.size for slot in self._items.values()]
+            idle = [now - slot.touched_at for slot in self._items.values()]
+            return {
+                "backend": type(self).__name__,
+                "sessions": len(self._items),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_session_bytes": max(sizes) if sizes else 0,
+                "avg_session_bytes": int(sum(sizes) / len(sizes)) if sizes else 0,
+                "max_idle_seconds": round(max(idle), 1) if idle else 0.0,
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "evicted": dict(self.evicted),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite（WAL）会话存储：会话序列化为 JSON 状态
+
+    每次 get 都会从数据库重新构建会话对象，因此修改会话后必须调用 save() 写回。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        to_state: Callable[[Any], dict],
+        from_state: Callable[[dict], Any],
+        ttl_seconds: float = 7200.0,
+    ):
+        self.path = path
+        self.to_state = to_state
+        self.from_state = from_state
+        self.ttl_seconds = float(ttl_seconds)
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享：每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,))
+        conn.commit()
+
+    def get(self, session_id: str) -> Any | None:
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - float(row[1]) > self.ttl_seconds:
+            return None
+        try:
+            return self.from_state(json.loads(row[0]))
+        except Exception as e:
+            print(f"[SESSION] 会话反序列化失败: session_id={session_id}, err={type(e).__name__}: {e}")
+            return None
+
+    def save(self, session_obj: Any) -> None:
+        now = time.time()
+        state = json.dumps(self.to_state(session_obj), ensure_ascii=False)
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO sessions(session_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (session_obj.session_id, state, now),
+        )
+        conn.commit()
+        self._sweep(now)
+
+    def delete(self, session_id: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+    def __len__(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        row = self._conn().execute("SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (cutoff,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def stats(self) -> dict:
+        cutoff = time.time() - self.ttl_seconds
+        row = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(state AS BLOB))), 0), COALESCE(MAX(LENGTH(CAST(state AS BLOB))), 0) "
+            "FROM sessions WHERE updated_at >= ?",
+            (cutoff,),
+        ).fetchone()
+        count, total_bytes, max_bytes = (int(x) for x in (row or (0, 0, 0)))
+        return {
+            "backend": type(self).__name__,
+            "sessions": count,
+            "total_bytes": total_bytes,
+            "max_session_bytes": max_bytes,
+            "avg_session_bytes": int(total_bytes / count) if count else 0,
+            "path": self.path,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+def create_session_store(to_state: Callable[[Any], dict], from_state: Callable[[dict], Any]) -> SessionStore:
+    """按环境变量创建会话存储"""
+    backend = (os.environ.get("PMTRAINER_SESSION_STORE") or "memory").strip().lower()
+    ttl = env_float("PMTRAINER_SESSION_TTL", 7200.0)
+    if backend == "sqlite":
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        path = (os.environ.get("PMTRAINER_SESSION_DB") or "").strip() or os.path.join(base_dir, "sessions.db")
+        print(f"[SESSION] 使用 SQLite 会话存储: {path}")
+        return SQLiteSessionStore(path, to_state, from_state, ttl_seconds=ttl)
+    return MemorySessionStore(
+        max_sessions=env_int("PMTRAINER_SESSION_MAX", 1000),
+        ttl_seconds=ttl,
+        max_bytes=int(env_float("PMTRAINER_SESSION_MEMORY_MB", 256) * 1024 * 1024),
+        to_state=to_state,
+        sweep_interval=env_float("PMTRAINER_SESSION_SWEEP_INTERVAL", 60.0),
+    )
@@ -0,0 +1,149 @@
+"""
+多模式文本匹配
+
+评分规则（scoring_rules.bonuses / penalties）和场景事件都是“关键词任一命中 / 正则任一命中”的形式。
+原先每次评估都要对每条规则重新小写化文本与关键词、逐条规则查找、每次经 re 模块查缓存取正则。这里：
+- KeywordMatcher:  预编译的多关键词匹配器（小写化、去重、按关键词聚合规则），返回全部出现位置（含重叠）
+- CompiledRuleSet: 把一组规则编译为一个关键词匹配器 + 预编译正则，返回每条规则的命中位置
+- compiled_rule_set(): 按规则列表对象缓存编译结果（配置加载时预编译，评估时直接复用）
+
+关键词匹配不区分大小写（与原先 `keyword in text.lower()` 一致）；命中位置是小写化后文本中的位置，
+对中文和 ASCII 文本与原文一致。
+"""
+import re
+import threading
+from typing import Any, Callable, Iterable, Iterator
+
+
+class KeywordMatcher:
+    """
+    预编译的多关键词匹配器：关键词在构造时统一小写、去重，并按关键词聚合关联值
+
+    说明：在 CPython 下，纯 Python 逐字符推进的多模式自动机（如 Aho–Corasick）比 C 实现的
+    str.find 慢一到两个数量级；关键词数量在几十到几百的规模时，对小写化一次的文本逐个关键词
+    调用 str.find 反而最快，因此这里采用这种方式。每个关键词可关联一个或多个任意值。
+    """
+
+    def __init__(self, keywords: Iterable[tuple[str, Any]] = (), case_insensitive: bool = True):
+        self.case_insensitive = case_insensitive
+        self._table: dict[str, list[Any]] = {}
+        for keyword, value in keywords:
+            self.add(keyword, value)
+
+    @property
+    def size(self) -> int:
+        return len(self._table)
+
+    def add(self, keyword: str, value: Any) -> None:
+        keyword = str(keyword or "")
+        if self.case_insensitive:
+            keyword = keyword.lower()
+        if not keyword:
+            return
+        values = self._table.setdefault(keyword, [])
+        if value not in values:
+            values.append(value)
+
+    def _prepare(self, text: str) -> str:
+        return text.lower() if self.case_insensitive else text
+
+    def finditer(self, text: str, limit: int | None = None, prepared: bool = False) -> Iterator[tuple[int, int, Any]]:
+        """
+        产出 (start, end, value)；limit 限制每个关键词最多报告多少处出现
+        prepared=True 表示 text 已按大小写规则处理过（避免重复小写化）
+        """
+        if not text or not self._table:
+            return
+        if not prepared:
+            text = self._prepare(text)
+        for keyword, values in self._table.items():
+            start = text.find(keyword)
+            found = 0
+            while start >= 0 and (limit is None or found < limit):
+                end = start + len(keyword)
+                for value in values:
+                    yield start, end, value
+                found += 1
+                start = text.find(keyword, start + 1)
+
+    def values_in(self, text: str) -> set:
+        """文本中出现过的关键词所关联的值"""
+        if not text or not self._table:
+            return set()
+        text = self._prepare(text)
+        hit = set()
+        for keyword, values in self._table.items():
+            if keyword in text:
+                hit.update(values)
+        return hit
+
+
+class CompiledRuleSet:
+    """
+    预编译的一组规则：{"id", "name", "delta", "keyword_any": [...], "regex_any": [...]}
+
+    match(text) 返回 {规则下标: [(start, end), ...]}，只包含命中的规则
+    """
+
+    def __init__(self, rules: list):
+        self.rules = [r for r in (rules if isinstance(rules, list) else []) if isinstance(r, dict)]
+        keywords = []
+        self._regexes: list[tuple[int, re.Pattern]] = []
+        for idx, rule in enumerate(self.rules):
+            for k in rule.get("keyword_any") or []:
+                keywords.append((str(k), idx))
+            for pat in rule.get("regex_any") or []:
+                try:
+                    self._regexes.append((idx, re.compile(str(pat), flags=re.IGNORECASE)))
+                except re.error as e:
+                    print(f"[CONFIG] 规则正则无效，已忽略: rule={rule.get('id')}, pattern={pat}, err={e}")
+        self.keywords = KeywordMatcher(keywords)
+
+    def match(self, text: str, max_hits: int | None = None) -> dict[int, list[tuple[int, int]]]:
+        """max_hits 限制每条规则最多报告多少处命中（按位置排序后截断）"""
+        hits: dict[int, list[tuple[int, int]]] = {}
+        if not text:
+            return hits
+        for start, end, idx in self.keywords.finditer(text, limit=max_hits):
+            hits.setdefault(idx, []).append((start, end))
+        for idx, pattern in self._regexes:
+            for n, m in enumerate(pattern.finditer(text)):
+                if max_hits is not None and n >= max_hits:
+                    break
+                hits.setdefault(idx, []).append(m.span())
+        for idx, positions in hits.items():
+            positions.sort()
+            if max_hits is not None:
+                del positions[max_hits:]
+        return hits
+
+
+_compiled: dict[tuple[int, Any], tuple[Any, Any]] = {}
+_COMPILED_MAX = 64
+_compiled_lock = threading.Lock()
+
+
+def cached_compile(source: Any, factory: Callable[[Any], Any], store: bool = True) -> Any:
+    """
+    按源对象（如配置中的规则列表）身份缓存编译结果：同一个对象只编译一次
+
+    store=False 时只查缓存、未命中则现编译但不缓存（用于会话反序列化出的临时副本）
+    """
+    key = (id(source), factory)
+    with _compiled_lock:
+        entry = _compiled.get(key)
+        if entry is not None and entry[0] is source:
+            return entry[1]
+    compiled = factory(source)
+    if store:
+        with _compiled_lock:
+            # 持有源对象引用，保证 id 不会被复用；缓存过多时丢弃最早的
+            while len(_compiled) >= _COMPILED_MAX:
+                _compiled.pop(next(iter(_compiled)))
+            _compiled[key] = (source, compiled)
+    return compiled
+
+
+def compiled_rule_set(rules: list) -> CompiledRuleSet:
+    """按规则列表对象缓存编译结果（同一个列表对象只编译一次）"""
+    return cached_compile(rules, CompiledRuleSet)
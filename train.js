@@ -613,6 +613,104 @@ function removeTypingIndicator() {
     }
 }
 
+// 流式输出中的用户消息（首个 token 到达后替换加载指示器）
+function addStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'chat-message user';
+    messageDiv.id = 'streaming-message';
+    messageDiv.innerHTML = `
+        <div class="chat-avatar">${getAvatarEmoji(currentProfile.occupation)}</div>
+        <div class="chat-content">
+            <div class="chat-bubble"></div>
+        </div>
+    `;
+    elements.chatMessages.appendChild(messageDiv);
+    return messageDiv.querySelector('.chat-bubble');
+}
+
+function removeStreamingMessage() {
+    const el = document.getElementById('streaming-message');
+    if (el) {
+        el.remove();
+    }
+}
+
+function supportsStreaming() {
+    return typeof window.ReadableStream !== 'undefined' && typeof window.TextDecoder !== 'undefined';
+}
+
+// 读取 SSE 流：delta 事件增量渲染，返回 done 事件的数据
+async function readChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let bubble = null;
+    let finalData = null;
+
+    const handleEvent = (rawEvent) => {
+        let eventName = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                eventName = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (!dataLines.length) return;
+        let payload = null;
+        try {
+            payload = JSON.parse(dataLines.join('\n'));
+        } catch (e) {
+            return;
+        }
+        if (eventName === 'delta') {
+            if (!bubble) {
+                removeTypingIndicator();
+                bubble = addStreamingMessage();
+            }
+            bubble.textContent += payload.text || '';
+            elements.chatMessages.scrollTop = elements.chatMessages.scrollHeight;
+        } else if (eventName === 'done') {
+            finalData = payload;
+        } else if (eventName === 'error') {
+            finalData = { error: payload.error || '对话处理失败', busy: !!payload.busy };
+        }
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let idx;
+        while ((idx = buffer.indexOf('\n\n')) >= 0) {
+            handleEvent(buffer.slice(0, idx));
+            buffer = buffer.slice(idx + 2);
+        }
+    }
+    if (buffer.trim()) handleEvent(buffer);
+    return finalData;
+}
+
+// 处理一轮对话的最终结果（流式/非流式共用）
+async function handleChatResult(data) {
+    // 检查是否是API错误消息
+    if (data.response && data.response.startsWith('[') && data.response.includes('错误')) {
+        addMessage('user', `（系统提示：${data.response}，请重试）`);
+        return;
+    }
+    // 添加用户回复
+    addMessage('user', data.response, data.inner_thought, data.trust_change);
+    
+    // 更新状态
+    updateStatus(data.status);
+    
+    // 检查是否结束
+    if (data.is_ended) {
+        await showResult(data.end_reason, data.evaluation_job_id);
+    }
+}
+
 // 发送消息
 async function sendMessage() {
     const message = elements.messageInput.value.trim();
@@ -629,43 +727,43 @@ async function sendMessage() {
     addTypingIndicator();
     
     try {
-        const response = await fetch(`/api/session/${currentSession}/chat`, {
+        const useStream = supportsStreaming();
+        const url = useStream
+            ? `/api/session/${currentSession}/chat/stream`
+            : `/api/session/${currentSession}/chat`;
+        const response = await fetch(url, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ message })
         });
         
-        const data = await safeReadJson(response);
+        const isEventStream = (response.headers.get('content-type') || '').includes('text/event-stream');
+        const data = (response.ok && isEventStream && response.body)
+            ? await readChatStream(response)
+            : await safeReadJson(response);
         
-        // 移除加载指示器
+        // 移除加载指示器/流式占位消息（由最终结果重新渲染完整消息）
         removeTypingIndicator();
+        removeStreamingMessage();
         
-        if (response.ok) {
-            // 检查是否是API错误消息
-            if (data.response && data.response.startsWith('[') && data.response.includes('错误')) {
-                addMessage('user', `（系统提示：${data.response}，请重试）`);
-            } else {
-                // 添加用户回复
-                addMessage('user', data.response, data.inner_thought, data.trust_change);
-                
-                // 更新状态
-                updateStatus(data.status);
-                
-                // 检查是否结束
-                if (data.is_ended) {
-                    await showResult(data.end_reason);
-                }
-            }
+        if (response.ok && data && !data.error) {
+            await handleChatResult(data);
+        } else if (data && data.busy) {
+            // 服务繁忙：本轮未被处理，把消息放回输入框以便稍后重发
+            addMessage('user', `（系统：${data.error}，这条消息未发送成功，已放回输入框）`);
+            elements.messageInput.value = message;
         } else if (response.status === 404) {
             // 会话丢失
             addMessage('user', '（系统：会话已过期，请刷新页面重新开始）');
             alert('会话已过期，请刷新页面重新选择用户开始训练');
         } else {
-            addMessage('user', `（系统：服务器错误 ${response.status}：${data.error || '请重试'}）`);
+            const errorText = (data && data.error) || '请重试';
+            addMessage('user', `（系统：服务器错误 ${response.status}：${errorText}）`);
         }
     } catch (error) {
         console.error('发送消息失败:', error);
         removeTypingIndicator();
+        removeStreamingMessage();
         addMessage('user', '（系统：网络连接失败，请检查网络后重试）');
     }
     
@@ -675,7 +773,7 @@ async function sendMessage() {
 }
 
 // 显示评估结果
-async function showResult(endReason) {
+async function showResult(endReason, evaluationJobId = null) {
     // 设置结果标题
     const resultIcon = document.getElementById('result-icon');
     const resultTitle = document.getElementById('result-title');
@@ -702,24 +800,33 @@ async function showResult(endReason) {
         resultSubtitle.textContent = '查看你的表现评估';
     }
     
-    // 获取评估结果
+    // 评分标准：用于维度说明（来自配置，避免“编造标准”）
+    await loadEvaluationCriteriaOnce();
+
+    // 获取评估结果：先提交后台评估任务，规则分立即展示，LLM 评语生成后再补全
     try {
-        const response = await fetch(`/api/session/${currentSession}/evaluate`, {
-            method: 'POST'
-        });
-        const evaluation = await response.json();
-        // 评分标准：用于维度说明（来自配置，避免“编造标准”）
-        await loadEvaluationCriteriaOnce();
-        
-        // 填充评估数据
-        fillEvaluationData(evaluation, endReason);
-        // 如果有“结束原因解释”，优先展示在副标题上（尤其是用户失去兴趣）
-        const endExplain = (evaluation && evaluation.end_explanation) ? String(evaluation.end_explanation) : '';
-        if (endExplain) {
-            const resultSubtitle2 = document.getElementById('result-subtitle');
-            if (resultSubtitle2) resultSubtitle2.textContent = endExplain;
+        const job = await createEvaluationJob(evaluationJobId);
+        if (job) {
+            const preview = job.preview || {};
+            renderEvaluation(preview, endReason, true);
+            switchStage('result');
+            // 任务失败或轮询中断：改为同步评估重试一次（失败的任务不会被复用），仍失败则替换“生成中”提示
+            const evaluation = await waitEvaluationJob(job.job_id) || await fetchEvaluation();
+            if (evaluation) {
+                renderEvaluation(evaluation, endReason, false);
+            } else {
+                renderEvaluationFailed(preview, endReason);
+            }
+            return;
+        }
+
+        // 旧接口兜底：同步等待评估完成
+        const evaluation = await fetchEvaluation();
+        if (evaluation) {
+            renderEvaluation(evaluation, endReason, false);
+        } else {
+            renderEvaluationFailed({}, endReason);
         }
-        
     } catch (error) {
         console.error('获取评估失败:', error);
     }
@@ -728,6 +835,105 @@ async function showResult(endReason) {
     switchStage('result');
 }
 
+// 提交后台评估任务；对话结束时服务端已提前开始评估的，直接使用该任务；失败时返回 null
+async function createEvaluationJob(existingJobId = null) {
+    try {
+        if (existingJobId) {
+            const existing = await fetch(`/api/evaluation-jobs/${existingJobId}`);
+            if (existing.ok) return await safeReadJson(existing);
+        }
+        const response = await fetch(`/api/session/${currentSession}/evaluation-jobs`, {
+            method: 'POST'
+        });
+        if (response.status !== 202) return null;
+        return await safeReadJson(response);
+    } catch (e) {
+        return null;
+    }
+}
+
+// 等待评估任务完成：优先 SSE 推送，不支持时轮询
+function waitEvaluationJob(jobId) {
+    if (typeof window.EventSource !== 'undefined') {
+        return new Promise(resolve => {
+            const source = new EventSource(`/api/evaluation-jobs/${jobId}/events`);
+            source.addEventListener('done', (e) => {
+                source.close();
+                try {
+                    resolve(JSON.parse(e.data));
+                } catch (err) {
+                    resolve(null);
+                }
+            });
+            source.addEventListener('error', () => {
+                // 连接中断或任务失败：改为轮询兜底
+                source.close();
+                pollEvaluationJob(jobId).then(resolve);
+            });
+        });
+    }
+    return pollEvaluationJob(jobId);
+}
+
+async function pollEvaluationJob(jobId) {
+    for (let i = 0; i < 300; i++) {
+        try {
+            const response = await fetch(`/api/evaluation-jobs/${jobId}`);
+            const job = await safeReadJson(response);
+            if (!response.ok || !job) return null;
+            if (job.status === 'done') return job.result;
+            if (job.status === 'error') return null;
+        } catch (e) {
+            return null;
+        }
+        await new Promise(r => setTimeout(r, 1000));
+    }
+    return null;
+}
+
+// 同步评估（等待服务端评估完成）；失败时返回 null
+async function fetchEvaluation() {
+    try {
+        const response = await fetch(`/api/session/${currentSession}/evaluate`, {
+            method: 'POST'
+        });
+        const evaluation = await safeReadJson(response);
+        if (!response.ok || !evaluation || evaluation.error) return null;
+        return evaluation;
+    } catch (e) {
+        return null;
+    }
+}
+
+// AI 评语生成失败：保留规则分，评语区域显示失败提示
+function renderEvaluationFailed(preview, endReason) {
+    fillEvaluationData(preview, endReason);
+    const failedText = 'AI 评语生成失败，以上为规则评分结果';
+    document.getElementById('highlights-list').innerHTML = `<li>${failedText}</li>`;
+    document.getElementById('improvements-list').innerHTML = `<li>${failedText}</li>`;
+    document.getElementById('insight-text').textContent = failedText;
+    document.getElementById('comment-text').textContent = failedText;
+}
+
+// 渲染评估结果；pending=true 表示只有规则分，LLM 评语仍在生成
+function renderEvaluation(evaluation, endReason, pending) {
+    // 填充评估数据
+    fillEvaluationData(evaluation, endReason);
+    if (pending) {
+        const pendingText = 'AI 评语生成中…';
+        document.getElementById('highlights-list').innerHTML = `<li>${pendingText}</li>`;
+        document.getElementById('improvements-list').innerHTML = `<li>${pendingText}</li>`;
+        document.getElementById('insight-text').textContent = pendingText;
+        document.getElementById('comment-text').textContent = pendingText;
+    }
+    // 如果有“结束原因解释”，优先展示在副标题上（尤其是用户失去兴趣）
+    const endExplain = (evaluation && evaluation.end_explanation) ? String(evaluation.end_explanation) : '';
+    if (endExplain) {
+        const resultSubtitle2 = document.getElementById('result-subtitle');
+        if (resultSubtitle2) resultSubtitle2.textContent = endExplain;
+    }
+}
+
 // 填充评估数据
 function fillEvaluationData(evaluation, endReason) {
     const stats = evaluation.stats || {};
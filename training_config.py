@@ -14,6 +14,8 @@ from typing import Any, Dict, List, Optional
 
 from config import USER_PROFILES as LEGACY_USER_PROFILES
 from config import EVALUATION_CRITERIA as LEGACY_EVALUATION_CRITERIA
+from scenario_events import scenario_event_index
+from text_matcher import compiled_rule_set
 
 
 _CACHE: Optional[Dict[str, Any]] = None
@@ -110,6 +112,18 @@ def load_training_config(force_reload: bool = False) -> Dict[str, Any]:
     cfg.setdefault("evaluation_criteria", LEGACY_EVALUATION_CRITERIA)
     cfg.setdefault("scoring_rules", _default_config()["scoring_rules"])
 
+    # 预编译评分规则（关键词自动机 + 正则），评估时直接复用
+    scoring = cfg.get("scoring_rules")
+    if isinstance(scoring, dict):
+        for kind in ("bonuses", "penalties"):
+            if isinstance(scoring.get(kind), list):
+                compiled_rule_set(scoring[kind])
+
+    # 预编译各场景的事件触发索引
+    for scenario in cfg.get("scenarios") or []:
+        if isinstance(scenario, dict) and isinstance(scenario.get("events"), list):
+            scenario_event_index(scenario["events"])
+
     _CACHE = cfg
     return cfg
 
@@ -2,9 +2,17 @@
 小白用户模拟器
 模拟不同背景的用户与产品经理进行对话
 """
-import json
 import random
+import time
+from typing import Any, Iterator
+from conversation_context import create_conversation_window
 from llm_client import llm_client
+from llm_json import JSONObjectStream, PartialFieldExtractor, parse_llm_json
+from llm_scheduler import BUSY_REPLY, LLMBusy
+from metrics import observe_stage, timed
+from prompt_cache import prefix_cache_stats, prompt_layout
+from response_schemas import OPENING, SIMULATOR_REPLY
+from scenario_events import ScenarioEventIndex, scenario_event_index
 from training_config import get_goals_config, get_user_profiles as load_user_profiles
 
 
@@ -22,41 +30,48 @@ class UserSimulator:
         self.is_convinced = False
         self.pm_turn_count = 0
         self.active_events: list[dict] = []
-        
-    def _is_event_triggered(self, event: dict, pm_message: str) -> bool:
-        trigger = event.get("trigger") or {}
-        if not isinstance(trigger, dict):
-            return False
-
-        # turn_gte
-        turn_gte = trigger.get("turn_gte")
-        if turn_gte is not None and self.pm_turn_count < int(turn_gte):
-            return False
-
-        # trust_gte
-        trust_gte = trigger.get("trust_gte")
-        if trust_gte is not None and self.trust_level < int(trust_gte):
-            return False
-
-        # keyword_any
-        keyword_any = trigger.get("keyword_any") or []
-        if keyword_any:
-            text = (pm_message or "").lower()
-            keywords = [str(k).lower() for k in keyword_any]
-            if not any(k and k in text for k in keywords):
-                return False
-
-        # probability (默认 1.0)
-        prob = trigger.get("probability", 1.0)
-        try:
-            prob = float(prob)
-        except Exception:
-            prob = 1.0
-        if prob < 1.0 and random.random() > prob:
-            return False
+        self._stable_prompt: str | None = None
+        self._event_index: ScenarioEventIndex | None = None
+        # 本轮开始前的 (pm_turn_count, 事件数, 历史条数)，用于撤销未完成的一轮
+        self._turn_checkpoint: tuple[int, int, int] | None = None
+        self.history_window = create_conversation_window(
+            persona=f"{profile['name']}（{profile['age']}岁，{profile['occupation']}）"
+        )
 
-        return True
+    def to_state(self) -> dict:
+        """导出可 JSON 序列化的模拟器状态（用于持久化会话）"""
+        return {
+            "profile": self.profile,
+            "scenario": self.scenario,
+            "mental_state": self.mental_state,
+            "goals_config": self.goals_config,
+            "trust_level": self.trust_level,
+            "conversation_history": self.conversation_history,
+            "concerns_addressed": self.concerns_addressed,
+            "is_convinced": self.is_convinced,
+            "pm_turn_count": self.pm_turn_count,
+            "active_events": self.active_events,
+            "history_window": self.history_window.to_state(),
+        }
 
+    @classmethod
+    def from_state(cls, state: dict) -> "UserSimulator":
+        """由 to_state() 的结果恢复模拟器"""
+        sim = cls(
+            state["profile"],
+            scenario=state.get("scenario"),
+            mental_state=state.get("mental_state"),
+            goals_config=state.get("goals_config"),
+        )
+        sim.trust_level = int(state.get("trust_level", 1))
+        sim.conversation_history = list(state.get("conversation_history") or [])
+        sim.concerns_addressed = list(state.get("concerns_addressed") or [])
+        sim.is_convinced = bool(state.get("is_convinced", False))
+        sim.pm_turn_count = int(state.get("pm_turn_count", 0))
+        sim.active_events = list(state.get("active_events") or [])
+        sim.history_window.load_state(state.get("history_window"))
+        return sim
+        
     def _update_active_events(self, pm_message: str) -> None:
         if not self.scenario:
             return
@@ -64,21 +79,18 @@ class UserSimulator:
         if not isinstance(events, list) or not events:
             return
 
+        if self._event_index is None:
+            # 配置中的场景在加载时已预编译；从会话状态恢复的副本现编译，不进入共享缓存
+            self._event_index = scenario_event_index(events, store=False)
         already = {e.get("id") for e in self.active_events}
-        for ev in events:
-            if not isinstance(ev, dict):
-                continue
-            ev_id = ev.get("id")
-            if ev_id in already:
-                continue
-            if self._is_event_triggered(ev, pm_message):
-                self.active_events.append(ev)
+        self.active_events.extend(
+            self._event_index.triggered(self.pm_turn_count, self.trust_level, pm_message, already, random)
+        )
 
-    def get_system_prompt(self) -> str:
-        """生成用户模拟的系统提示词"""
-        scenario_block = ""
-        if self.scenario:
-            scenario_block = f"""
+    def _scenario_block(self) -> str:
+        if not self.scenario:
+            return ""
+        return f"""
 ## 你所处的场景（非常重要）
 - 场景名称: {self.scenario.get('name')}
 - 场景概述: {self.scenario.get('summary')}
@@ -88,29 +100,39 @@ class UserSimulator:
 - 场景约束: {', '.join(self.scenario.get('constraints', []) or [])}
 """
 
-        mental_block = ""
-        if self.mental_state:
-            mental_block = f"""
+    def _mental_block(self) -> str:
+        if not self.mental_state:
+            return ""
+        return f"""
 ## 你当前的心理状态（非常重要）
 - 心理状态: {self.mental_state.get('name')}
 - 描述: {self.mental_state.get('description')}
 - 行为指引: {', '.join(self.mental_state.get('behavior_guidelines', []) or [])}
 """
 
-        events_block = ""
-        if self.active_events:
-            lines = []
-            for ev in self.active_events:
-                impact = ev.get("impact") or {}
-                add_ctx = ""
-                if isinstance(impact, dict):
-                    add_ctx = str(impact.get("add_context") or "").strip()
-                lines.append(f"- {ev.get('name')}: {ev.get('description')}{('；' + add_ctx) if add_ctx else ''}")
-            events_block = f"""
+    def _events_block(self) -> str:
+        if not self.active_events:
+            return ""
+        lines = []
+        for ev in self.active_events:
+            impact = ev.get("impact") or {}
+            add_ctx = ""
+            if isinstance(impact, dict):
+                add_ctx = str(impact.get("add_context") or "").strip()
+            lines.append(f"- {ev.get('name')}: {ev.get('description')}{('；' + add_ctx) if add_ctx else ''}")
+        return f"""
 ## 你刚刚经历/正在经历的事件（会影响你的态度与提问）
 {chr(10).join(lines)}
 """
 
+    def _state_section(self) -> str:
+        return f"""## 当前状态
+- 信任度: {self.trust_level}/10 (达到{self.profile['trust_threshold']}才会考虑开户)
+- 已解答的顾虑: {self.concerns_addressed if self.concerns_addressed else '暂无'}
+
+"""
+
+    def _render_system_prompt(self, events_block: str, state_section: str) -> str:
         return f"""你现在要扮演一个腾讯自选股App的潜在用户，进行角色扮演训练。
 
 ## 你的角色信息
@@ -123,8 +145,8 @@ class UserSimulator:
 - 主要顾虑: {', '.join(self.profile['pain_points'])}
 - 触发场景: {self.profile['trigger_scenario']}
 - 性格特点: {self.profile['personality']}
-{scenario_block}
-{mental_block}
+{self._scenario_block()}
+{self._mental_block()}
 {events_block}
 
 ## 角色扮演规则
@@ -136,11 +158,7 @@ class UserSimulator:
 6. 当你觉得对方真的解答了你的疑虑时，可以表现出态度软化
 7. 保持角色一致性，用符合角色的语气说话
 
-## 当前状态
-- 信任度: {self.trust_level}/10 (达到{self.profile['trust_threshold']}才会考虑开户)
-- 已解答的顾虑: {self.concerns_addressed if self.concerns_addressed else '暂无'}
-
-## 回复格式
+{state_section}## 回复格式
 请用JSON格式回复，包含以下字段：
 {{
     "response": "你作为用户的回复内容",
@@ -153,16 +171,46 @@ class UserSimulator:
 
 请始终保持角色扮演，用第一人称回复。"""
 
-    def respond(self, pm_message: str) -> dict:
+    def get_system_prompt(self) -> str:
+        """生成用户模拟的系统提示词"""
+        return self._render_system_prompt(self._events_block(), self._state_section())
+
+    def get_stable_system_prompt(self) -> str:
         """
-        根据产品经理的消息生成用户回复
-        
+        前缀缓存布局的系统提示词：只含画像/场景/心理状态/规则/回复格式，
+        整个会话期间逐字节不变（易变状态见 get_state_message）
+        """
+        if self._stable_prompt is None:
+            self._stable_prompt = self._render_system_prompt("", "")
+        return self._stable_prompt
+
+    def get_state_message(self) -> str:
+        """前缀缓存布局下，附在最后一条消息末尾的易变状态（信任度/顾虑/事件）"""
+        return f"""（以下为你此刻的角色状态，仅供参考，不要在回复中提及）
+{self._events_block()}
+{self._state_section()}""".rstrip()
+
+    def _build_messages(self, tail: list) -> list:
+        """
+        组装发送给 LLM 的消息列表
+
         Args:
-            pm_message: 产品经理的消息
-            
-        Returns:
-            用户回复的结构化数据
+            tail: 系统提示词之后的消息（对话历史或开场白指令），最后一条为 user 消息
         """
+        if prompt_layout() != "prefix":
+            return [{"role": "system", "content": self.get_system_prompt()}, *tail]
+
+        system_prompt = self.get_stable_system_prompt()
+        prefix_cache_stats.record_prefix(system_prompt)
+        messages = [{"role": "system", "content": system_prompt}, *tail]
+        last = messages[-1]
+        messages[-1] = {**last, "content": f"{last['content']}\n\n{self.get_state_message()}"}
+        return messages
+
+    def _prepare_turn(self, pm_message: str) -> list:
+        """记录产品经理的消息并构造本轮发送给 LLM 的消息列表"""
+        # 本轮开始前的状态：LLM 调度繁忙时据此撤销本轮
+        self._turn_checkpoint = (self.pm_turn_count, len(self.active_events), len(self.conversation_history))
         self.pm_turn_count += 1
         self._update_active_events(pm_message)
 
@@ -171,25 +219,74 @@ class UserSimulator:
             "content": pm_message
         })
         
-        messages = [
-            {"role": "system", "content": self.get_system_prompt()},
-            *self.conversation_history
-        ]
-        
-        response_text = llm_client.chat(messages, temperature=0.7)
+        # 只发送最近几轮原文 + 更早轮次的滚动摘要，避免输入随轮次线性增长
+        return self._build_messages(self.history_window.build(self.conversation_history))
+
+    def rollback_turn(self) -> None:
+        """撤销尚未得到回复的一轮（PM 消息、轮次计数、本轮触发的事件）；可重复调用"""
+        if self._turn_checkpoint is None:
+            return
+        turn_count, events, history = self._turn_checkpoint
+        self.pm_turn_count = turn_count
+        del self.active_events[events:]
+        del self.conversation_history[history:]
+        self._turn_checkpoint = None
+
+    def _raise_if_busy(self, response_text: str) -> None:
+        """调度繁忙时 LLM 并未真正处理本轮：撤销本轮记录的 PM 消息，交由调用方返回“繁忙”"""
+        if response_text != BUSY_REPLY:
+            return
+        self.rollback_turn()
+        raise LLMBusy("LLM 服务繁忙")
+
+    @timed("simulator.respond")
+    def respond(self, pm_message: str) -> dict:
+        """
+        根据产品经理的消息生成用户回复
         
+        Args:
+            pm_message: 产品经理的消息
+            
+        Returns:
+            用户回复的结构化数据
+        """
+        messages = self._prepare_turn(pm_message)
+        response_text = llm_client.chat(messages, temperature=0.7, schema=SIMULATOR_REPLY)
+        self._raise_if_busy(response_text)
+        return self._apply_reply(response_text)
+
+    def respond_stream(self, pm_message: str) -> Iterator[tuple[str, Any]]:
+        """
+        流式版本的 respond：
+        - ("delta", str): 用户回复（response 字段）的增量文本，可直接展示
+        - ("done", dict): 最后一条，与 respond() 返回值一致的结构化结果
+        """
+        started = time.perf_counter()
+        messages = self._prepare_turn(pm_message)
+        extractor = PartialFieldExtractor("response")
+        stream = JSONObjectStream()
+        for delta in llm_client.chat_stream(messages, temperature=0.7, schema=SIMULATOR_REPLY):
+            self._raise_if_busy(delta)
+            visible = extractor.feed(delta)
+            if visible:
+                yield "delta", visible
+            # JSON 对象已完整：不再读取模型随后补充的代码块结束符/说明文字
+            if stream.feed(delta):
+                break
+        result = self._apply_reply(stream.text)
+        observe_stage("simulator.respond", time.perf_counter() - started)
+        yield "done", result
+
+    def _apply_reply(self, response_text: str) -> dict:
+        """解析 LLM 回复并更新信任度/顾虑/通关状态"""
+        # 本轮已得到回复，不再撤销
+        self._turn_checkpoint = None
         # 解析JSON响应
         try:
-            # 尝试提取JSON部分
-            if "```json" in response_text:
-                json_str = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                json_str = response_text.split("```")[1].split("```")[0]
-            else:
-                json_str = response_text
-                
-            result = json.loads(json_str.strip())
-            
+            result = parse_llm_json(response_text, "simulator")
+            if result is None or not isinstance(result.get("response"), str):
+                raise KeyError("response")
+
             # 更新信任度
             trust_change = result.get("trust_change", 0)
             # 允许信任度跌到 0，用于“失去兴趣”触发条件
@@ -250,7 +347,7 @@ class UserSimulator:
             
             return result
             
-        except (json.JSONDecodeError, KeyError) as e:
+        except KeyError:
             # 如果解析失败，返回原始文本
             fallback = {
                 "response": response_text,
@@ -266,8 +363,8 @@ class UserSimulator:
             })
             return fallback
     
-    def get_opening_message(self) -> dict:
-        """生成用户的开场白"""
+    def _opening_messages(self) -> list:
+        """构造生成开场白的消息列表"""
         prompt = f"""作为{self.profile['name']}，你刚刚打开腾讯自选股App，因为"{self.profile['trigger_scenario']}"。
         
 请生成你的第一句话，表达你的困惑或需求。记住你是一个小白用户。
@@ -278,34 +375,40 @@ class UserSimulator:
     "inner_thought": "你内心的真实想法"
 }}"""
         
-        messages = [
-            {"role": "system", "content": self.get_system_prompt()},
-            {"role": "user", "content": prompt}
-        ]
-        
+        return self._build_messages([{"role": "user", "content": prompt}])
+
+    @timed("simulator.opening")
+    def get_opening_message(self) -> dict:
+        """生成用户的开场白"""
         # 开场白不需要太长，且首次冷启动可能较慢：缩短 max_tokens + timeout，超时走兜底模板
-        response_text = llm_client.chat(messages, temperature=0.8, max_tokens=300, timeout=45)
-        
-        try:
-            if "```json" in response_text:
-                json_str = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                json_str = response_text.split("```")[1].split("```")[0]
-            else:
-                json_str = response_text
-            result = json.loads(json_str.strip())
-            
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": result["response"]
-            })
-            return result
-        except:
+        response_text = llm_client.chat(self._opening_messages(), temperature=0.8, max_tokens=300, timeout=45, schema=OPENING)
+        return self._apply_opening(response_text)
+
+    @staticmethod
+    def parse_opening(response_text: str) -> dict | None:
+        """解析 LLM 返回的开场白；格式不对时返回 None"""
+        result = parse_llm_json(response_text, "opening")
+        if result is None or not result.get("response"):
+            return None
+        return result
+
+    def accept_opening(self, opening: dict) -> None:
+        """采用一条开场白（如预生成池中取出的），写入对话历史"""
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": opening["response"]
+        })
+
+    def _apply_opening(self, response_text: str) -> dict:
+        """解析开场白；解析失败时使用兜底模板"""
+        result = self.parse_opening(response_text)
+        if result is None:
             return {
                 "response": f"你好，我想问一下...我是{self.profile['occupation']}，{self.profile['trigger_scenario']}，但是我不太懂这些...",
                 "inner_thought": "希望能有人帮我解答"
             }
-
+        self.accept_opening(result)
+        return result
 
 def get_user_profiles():
     """获取所有用户画像"""